@@ -0,0 +1,188 @@
+from dataclasses import dataclass, field
+import itertools
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+# --------------------------------------------- Admission Control ---------------------------------------------
+
+# A container used to start every request that reached it, at the quality it asked for. Under a burst they all
+# shared the GPU, so every user waited longer and longer. The admission controller sits in front of the request
+# handlers instead:
+#
+# - every request gets a cost estimate in GPU seconds: audio_duration x infer_step x (GPU seconds per step-second
+#   of audio), learned from the diffusion batches that ran (see observe), so it includes what batching saves
+# - only `slots` requests run at the same time, the others wait for a slot: higher priority classes first,
+#   then in order of arrival
+# - the projected wait of a new request is the cost of everything ahead of it (the running requests and the
+#   waiting ones of its class or a higher one), since the GPU works through them one batch after the other
+# - when the projected wait passes `degrade_from` of its class's SLO (max_wait_seconds), the request gets fewer
+#   diffusion steps, down to the class's floor at the SLO; past the SLO it is rejected right away (Overloaded)
+#   with a retry-after of the time the queue needs to drain back under the SLO
+#
+# Running requests count with their whole cost, so the projection errs on the safe side (by at most one batch).
+#
+# Example:
+#   controller = AdmissionController(slots=4, classes={"interactive": INTERACTIVE, "background": BACKGROUND})
+#   ticket = controller.admit("interactive", audio_duration=180, infer_step=60)  # may raise Overloaded
+#   try:
+#       controller.wait_for_slot(ticket)
+#       generate(infer_step=ticket.infer_step)
+#   finally:
+#       controller.release(ticket)
+
+
+# A request was rejected because the server is overloaded; try again after `retry_after` seconds.
+class Overloaded(Exception):
+    def __init__(self, priority: str, projected_wait: float, retry_after: int):
+        super().__init__(f"server overloaded: projected wait {projected_wait:.0f}s for {priority} requests, retry after {retry_after}s")
+        self.priority = priority
+        self.projected_wait = projected_wait
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class PriorityClass:
+    name: str
+    rank: int # lower runs first
+    max_wait_seconds: Optional[float] = None # the SLO on the projected wait, None = never degraded or rejected
+    min_infer_step: Optional[int] = None # the fewest diffusion steps it may be degraded to, None = never degraded
+
+
+# Requests from the endpoints: a user is waiting for them.
+INTERACTIVE = "interactive"
+# Background jobs: already accepted (the user polls), so they are never rejected or degraded, they wait.
+BACKGROUND = "background"
+
+
+# One admitted request.
+@dataclass
+class Ticket:
+    priority: PriorityClass
+    requested_infer_step: int
+    infer_step: int # what it runs with (fewer steps than requested when it was degraded)
+    cost_seconds: float
+    projected_wait: float
+    sequence: int # order of arrival
+    admitted_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None # when it got a slot
+
+    @property
+    def degraded(self) -> bool:
+        return self.infer_step < self.requested_infer_step
+
+
+class AdmissionController:
+    def __init__(self, slots: int, classes: Dict[str, PriorityClass], seconds_per_step_second: float = 0.003, degrade_from: float = 0.5, step_granularity: int = 10, smoothing: float = 0.2):
+        self.slots = slots
+        self.classes = classes
+        self.seconds_per_step_second = seconds_per_step_second # GPU seconds per (second of audio x diffusion step), learned by observe
+        self.degrade_from = degrade_from # share of the SLO where degrading starts
+        self.step_granularity = step_granularity # degraded steps are rounded to this, so degraded songs still share batches
+        self.smoothing = smoothing # weight of the newest batch in the learned cost
+
+        self._condition = threading.Condition()
+        self._running: List[Ticket] = []
+        self._waiting: List[Ticket] = []
+        self._sequence = itertools.count()
+        self._stats = {"admitted": 0, "degraded": 0, "rejected": 0}
+
+    # Estimated GPU seconds of `songs` songs.
+    def estimate(self, audio_duration: float, infer_step: int, songs: int = 1) -> float:
+        return self.seconds_per_step_second * audio_duration * infer_step * songs
+
+    # Decides on a new request: returns its ticket (with the steps to run it with), or raises Overloaded.
+    # The ticket waits in line from now on, call wait_for_slot before the work and release after it.
+    def admit(self, priority: str, audio_duration: float, infer_step: int, songs: int = 1) -> Ticket:
+        priority_class = self.classes[priority]
+        with self._condition:
+            wait = self._projected_wait(priority_class.rank)
+            steps = self._steps_for(priority_class, infer_step, wait)
+            if steps is None:
+                self._stats["rejected"] += 1
+                retry_after = max(1, math.ceil(wait - priority_class.max_wait_seconds))
+                raise Overloaded(priority, wait, retry_after)
+
+            ticket = Ticket(
+                priority=priority_class,
+                requested_infer_step=infer_step,
+                infer_step=steps,
+                cost_seconds=self.estimate(audio_duration, steps, songs),
+                projected_wait=wait,
+                sequence=next(self._sequence)
+            )
+            self._waiting.append(ticket)
+            self._stats["admitted"] += 1
+            if ticket.degraded:
+                self._stats["degraded"] += 1
+            return ticket
+
+    # Blocks until the ticket may run: a slot is free and no ticket of a higher class (or an earlier one of the same class) waits.
+    def wait_for_slot(self, ticket: Ticket):
+        with self._condition:
+            while len(self._running) >= self.slots or self._next_waiting() is not ticket:
+                self._condition.wait()
+            self._waiting.remove(ticket)
+            self._running.append(ticket)
+            ticket.started_at = time.monotonic()
+            self._condition.notify_all()
+
+    # The ticket's work is done (or failed, or it never got to run).
+    def release(self, ticket: Ticket):
+        with self._condition:
+            if ticket in self._running:
+                self._running.remove(ticket)
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._condition.notify_all()
+
+    # Learns the cost of a diffusion batch that took `seconds` for songs of `step_seconds` in total
+    # (the sum of audio_duration x infer_step of its songs).
+    def observe(self, step_seconds: float, seconds: float):
+        if step_seconds <= 0:
+            return
+        with self._condition:
+            self.seconds_per_step_second += self.smoothing * (seconds / step_seconds - self.seconds_per_step_second)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                **self._stats,
+                "running": len(self._running),
+                "waiting": len(self._waiting),
+                "seconds_per_step_second": self.seconds_per_step_second,
+                "projected_wait": {name: self._projected_wait(priority_class.rank) for name, priority_class in self.classes.items()}
+            }
+
+    # ------------------------------------------------ Internals ------------------------------------------------
+    # must be called while holding self._condition
+
+    # GPU seconds of the work ahead of a new request of `rank`.
+    def _projected_wait(self, rank: int) -> float:
+        ahead = self._running + [ticket for ticket in self._waiting if ticket.priority.rank <= rank]
+        return sum(ticket.cost_seconds for ticket in ahead)
+
+    # The steps a request gets with a projected wait of `wait`, or None if it has to be rejected.
+    def _steps_for(self, priority_class: PriorityClass, requested: int, wait: float) -> Optional[int]:
+        slo = priority_class.max_wait_seconds
+        if slo is None:
+            return requested
+        if wait > slo:
+            return None
+        floor = priority_class.min_infer_step
+        if floor is None or floor >= requested:
+            return requested
+        load = wait / slo if slo > 0 else 1.0
+        if load <= self.degrade_from:
+            return requested
+        # fewer steps the closer the wait gets to the SLO, the floor at the SLO
+        share = min(1.0, (load - self.degrade_from) / (1 - self.degrade_from)) if self.degrade_from < 1 else 1.0
+        steps = requested - (requested - floor) * share
+        steps = int(steps // self.step_granularity * self.step_granularity)
+        return max(floor, min(requested, steps))
+
+    def _next_waiting(self) -> Optional[Ticket]:
+        if not self._waiting:
+            return None
+        return min(self._waiting, key=lambda ticket: (ticket.priority.rank, ticket.sequence))
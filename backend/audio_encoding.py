@@ -0,0 +1,59 @@
+import io
+import struct # Packs the WAV header.
+import subprocess # Runs ffmpeg, which does the actual encoding.
+
+# --------------------------------------------- Audio Encoding ---------------------------------------------
+
+# Every output format we support: file extension, Content-Type for S3/browsers, and the ffmpeg settings.
+# Opus and MP3 use the requested bitrate, FLAC is lossless (smaller than WAV, same sound).
+AUDIO_FORMATS = {
+    "wav": {"extension": "wav", "content_type": "audio/wav", "ffmpeg": None}, # ACE-Step already gives us a WAV
+    "flac": {"extension": "flac", "content_type": "audio/flac", "ffmpeg": ["-c:a", "flac", "-f", "flac"]},
+    "opus": {"extension": "opus", "content_type": "audio/ogg; codecs=opus", "ffmpeg": ["-c:a", "libopus", "-f", "ogg"]},
+    "mp3": {"extension": "mp3", "content_type": "audio/mpeg", "ffmpeg": ["-c:a", "libmp3lame", "-f", "mp3"]}
+}
+
+LOSSY_FORMATS = ("opus", "mp3")
+
+
+# Re-encodes an in-memory WAV into `output_format` and returns the new in-memory file.
+# It runs on the CPU (ffmpeg in its own process, reading from and writing to pipes, no temp files),
+# so it can run on a worker thread while the GPU works on the rest of the song.
+def encode_audio(wav_buffer: io.BytesIO, output_format: str, bitrate_kbps: int = 192) -> io.BytesIO:
+    settings = AUDIO_FORMATS[output_format]
+    if settings["ffmpeg"] is None:
+        return wav_buffer
+
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "wav", "-i", "pipe:0", *settings["ffmpeg"]]
+    if output_format in LOSSY_FORMATS:
+        command[-2:-2] = ["-b:a", f"{bitrate_kbps}k"] # the bitrate goes before the output container
+    command.append("pipe:1")
+
+    result = subprocess.run(command, input=wav_buffer.getvalue(), capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not encode the audio to {output_format}: {result.stderr.decode(errors='replace').strip()}")
+
+    wav_buffer.close() # the WAV is not needed anymore, free its memory
+    return io.BytesIO(result.stdout)
+
+
+# Writes audio samples (channels x samples, a torch tensor or numpy array) into an in-memory 32-bit float WAV.
+# Same file torchaudio.save writes for a float tensor, without needing torchaudio (or a GPU) to do it.
+def write_wav(samples, sample_rate: int = 48000) -> io.BytesIO:
+    import numpy as np
+
+    if hasattr(samples, "cpu"): # torch tensor
+        samples = samples.float().cpu().numpy()
+    samples = np.asarray(samples, dtype="<f4")
+    if samples.ndim == 1:
+        samples = samples[np.newaxis, :]
+    channels = samples.shape[0]
+    data = samples.T.tobytes() # interleaved: left, right, left, right, ...
+
+    buffer = io.BytesIO()
+    buffer.write(b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE")
+    # format 3 = IEEE float, 4 bytes per sample
+    buffer.write(b"fmt " + struct.pack("<IHHIIHH", 16, 3, channels, sample_rate, sample_rate * channels * 4, channels * 4, 32))
+    buffer.write(b"data" + struct.pack("<I", len(data)) + data)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,135 @@
+from concurrent.futures import Future
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# --------------------------------------------- Micro-Batching ---------------------------------------------
+
+# One song to generate with ACE-Step.
+@dataclass
+class AudioRequest:
+    prompt: str
+    lyrics: str
+    audio_duration: float
+    infer_step: int
+    guidance_scale: float
+    seed: int # -1 = random
+    segment_seconds: Optional[float] = None # progressive mode: decode the song in segments this long
+    on_segment: Optional[Callable[[int, Any, int], None]] = None # progressive mode: gets (index, audio, sample rate) of every segment
+
+
+# Songs can only share one diffusion run when these settings are the same.
+def audio_bucket(request: AudioRequest) -> Hashable:
+    return (float(request.audio_duration), int(request.infer_step), float(request.guidance_scale), request.segment_seconds)
+
+
+# Collects requests that arrive at about the same time and runs them together as ONE batch.
+# A batch runs as soon as `max_batch_size` requests of the same bucket are waiting, or when the
+# oldest waiting request has waited `max_wait_seconds`. Batches run one after the other on a
+# single background thread, so the GPU only ever works on one batch at a time.
+#
+# `run_batch(requests)` must return one result per request, in the same order.
+#
+# Example:
+#   batcher = MicroBatcher(run_batch, bucket_key=audio_bucket, max_batch_size=4, max_wait_seconds=0.05)
+#   result = batcher.submit(request) # waits until the batch with this request is done
+class MicroBatcher:
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], bucket_key: Callable[[Any], Hashable] = lambda item: None, max_batch_size: int = 4, max_wait_seconds: float = 0.05):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.bucket_key = bucket_key
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+
+        self._pending: Dict[Hashable, List[tuple]] = {} # bucket -> [(arrival time, item, future), ...]
+        self._condition = threading.Condition()
+        self._closed = False
+        self.batch_sizes: List[int] = [] # size of every batch that ran, for logs and benchmarks
+
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    # Adds a request and waits for its own result.
+    def submit(self, item: Any) -> Any:
+        return self.submit_async(item).result()
+
+    # Adds a request and returns a Future of its result right away.
+    def submit_async(self, item: Any) -> Future:
+        return self.submit_many([item])[0]
+
+    # Adds several requests at once and returns a Future for each, in the same order.
+    # They arrive together, so requests of the same bucket always share a batch (up to max_batch_size per batch).
+    def submit_many(self, items: List[Any]) -> List[Future]:
+        futures: List[Future] = [Future() for _ in items]
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("the batcher is closed")
+            now = time.monotonic()
+            for item, future in zip(items, futures):
+                self._pending.setdefault(self.bucket_key(item), []).append((now, item, future))
+            self._condition.notify()
+        return futures
+
+    # Stops the background thread after the waiting requests are done.
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    # ------------------------------------------------ Internals ------------------------------------------------
+
+    # Picks the next batch to run, or returns how long to wait before one is ready.
+    # must be called while holding self._condition
+    def _next_batch(self):
+        now = time.monotonic()
+        wait = None
+        oldest_bucket = None
+        for bucket, entries in self._pending.items():
+            if len(entries) >= self.max_batch_size:
+                return self._take(bucket), None
+            waited = now - entries[0][0]
+            if waited >= self.max_wait_seconds or self._closed:
+                if oldest_bucket is None or entries[0][0] < self._pending[oldest_bucket][0][0]:
+                    oldest_bucket = bucket
+            else:
+                remaining = self.max_wait_seconds - waited
+                wait = remaining if wait is None else min(wait, remaining)
+        if oldest_bucket is not None:
+            return self._take(oldest_bucket), None
+        return None, wait
+
+    def _take(self, bucket: Hashable) -> List[tuple]:
+        entries = self._pending[bucket]
+        batch, rest = entries[:self.max_batch_size], entries[self.max_batch_size:]
+        if rest:
+            self._pending[bucket] = rest
+        else:
+            del self._pending[bucket]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                batch, wait = self._next_batch()
+                while batch is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait(timeout=wait)
+                    batch, wait = self._next_batch()
+
+            items = [item for _, item, _ in batch]
+            futures = [future for _, _, future in batch]
+            self.batch_sizes.append(len(items))
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(items)} requests")
+            except BaseException as error:
+                for future in futures:
+                    future.set_exception(error)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
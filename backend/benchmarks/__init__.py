@@ -0,0 +1,3 @@
+# Offline benchmarks for the music generation backend.
+# They use stub models, so they run on any machine without a GPU, Modal or AWS.
+# Run them from the backend folder, e.g. `python -m benchmarks.pipeline_overlap`
@@ -0,0 +1,130 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import io
+import random
+import sys
+import threading
+import time
+
+from admission import INTERACTIVE, AdmissionController, Overloaded, PriorityClass
+from benchmarks.harness import build_service, percentile
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubSettings
+from music_service import MAX_CONCURRENT_REQUESTS
+from schemas import GenerateWithCustomLyricsRequest
+
+# --------------------------------------------- Overload Simulation ---------------------------------------------
+
+# A burst of more songs than the GPU can make, with the stub models and a local S3: requests arrive at random
+# (Poisson) at --rate per second for --seconds, each on its own thread, like a container with many accepted inputs.
+# It runs twice:
+# - "unbounded": every request is admitted at the quality it asked for, so the queue and the latency keep growing
+# - "admission": the admission controller degrades to fewer steps (down to --min-infer-step) as the projected wait
+#   nears the SLO (--slo), and rejects requests past it with a retry-after
+# Exits with 1 if the p95 latency of the admitted requests is not bounded (--max-p95, default SLO + 2 songs)
+# or not clearly better than without admission control.
+#
+# Run from backend/: python -m benchmarks.admission --rate 8 --seconds 10
+
+
+def simulate(settings: StubSettings, args, admission: bool) -> dict:
+    request_args = {"prompt": "lofi, chill, piano", "lyrics": "[instrumental]", "audio_duration": args.audio_duration, "infer_step": args.infer_step}
+    arrivals = []
+    clock = 0.0
+    generator = random.Random(args.seed)
+    while clock < args.seconds:
+        arrivals.append(clock)
+        clock += generator.expovariate(args.rate)
+
+    outcomes = []
+    lock = threading.Lock()
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(settings, s3)
+        service.admission = AdmissionController(
+            slots=MAX_CONCURRENT_REQUESTS,
+            classes={INTERACTIVE: PriorityClass(
+                INTERACTIVE, rank=0,
+                max_wait_seconds=args.slo if admission else None,
+                min_infer_step=args.min_infer_step if admission else None
+            )},
+            # the cost of one song alone, the controller learns what batching saves as the batches run
+            seconds_per_step_second=settings.diffusion_seconds_per_step / args.audio_duration
+        )
+
+        def user():
+            request = GenerateWithCustomLyricsRequest(**request_args)
+            started = time.perf_counter()
+            try:
+                response = service.run_admitted("generate_with_lyrics", request, INTERACTIVE)
+                outcome = {"latency": time.perf_counter() - started, "infer_step": response.infer_step}
+            except Overloaded as error:
+                outcome = {"rejected": True, "retry_after": error.retry_after}
+            with lock:
+                outcomes.append(outcome)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(arrivals)) as users:
+            for arrival in arrivals:
+                time.sleep(max(0.0, arrival - (time.perf_counter() - started)))
+                users.submit(user)
+        seconds = time.perf_counter() - started
+        service.music_batcher.close()
+
+    served = [outcome for outcome in outcomes if not outcome.get("rejected")]
+    latencies = [outcome["latency"] for outcome in served]
+    rejected = [outcome for outcome in outcomes if outcome.get("rejected")]
+    return {
+        "requests": len(arrivals),
+        "served": len(served),
+        "rejected": len(rejected),
+        "degraded": sum(1 for outcome in served if outcome["infer_step"] < args.infer_step),
+        "mean_infer_step": sum(outcome["infer_step"] for outcome in served) / max(1, len(served)),
+        "p50": percentile(latencies, 50) if latencies else 0.0,
+        "p95": percentile(latencies, 95) if latencies else 0.0,
+        "max": max(latencies, default=0.0),
+        "max_retry_after": max((outcome["retry_after"] for outcome in rejected), default=0),
+        "songs_per_second": len(served) / seconds
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=8, help="requests per second")
+    parser.add_argument("--seconds", type=float, default=10, help="how long the burst lasts")
+    parser.add_argument("--audio-duration", type=float, default=30)
+    parser.add_argument("--infer-step", type=int, default=60)
+    parser.add_argument("--slo", type=float, default=3, help="the highest projected wait in seconds")
+    parser.add_argument("--min-infer-step", type=int, default=30)
+    parser.add_argument("--max-p95", type=float, default=None, help="seconds, default: the SLO + 2 songs alone")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    settings = StubSettings(diffusion_seconds_per_step=0.01)
+    song_seconds = settings.diffusion_seconds_per_step * args.infer_step
+    max_p95 = args.max_p95 if args.max_p95 is not None else args.slo + 2 * song_seconds
+
+    results = {"unbounded": simulate(settings, args, admission=False), "admission": simulate(settings, args, admission=True)}
+
+    print(f"{args.rate:g} requests/s for {args.seconds:g}s, one song alone takes {song_seconds:.2f}s of GPU, SLO {args.slo:g}s\n")
+    print(f"{'':<10} {'served':>7} {'rejected':>9} {'degraded':>9} {'mean steps':>11} {'p50 s':>7} {'p95 s':>7} {'max s':>7} {'songs/s':>8}")
+    for name, result in results.items():
+        print(f"{name:<10} {result['served']:>7} {result['rejected']:>9} {result['degraded']:>9} {result['mean_infer_step']:>11.1f} "
+              f"{result['p50']:>7.2f} {result['p95']:>7.2f} {result['max']:>7.2f} {result['songs_per_second']:>8.2f}")
+    print(f"\nlongest retry-after: {results['admission']['max_retry_after']}s")
+
+    failures = []
+    admitted, unbounded = results["admission"], results["unbounded"]
+    if admitted["p95"] > max_p95:
+        failures.append(f"p95 with admission control is {admitted['p95']:.2f}s (allowed: {max_p95:.2f}s)")
+    if admitted["p95"] > unbounded["p95"] / 2:
+        failures.append(f"p95 with admission control ({admitted['p95']:.2f}s) is not clearly below the unbounded one ({unbounded['p95']:.2f}s)")
+    if admitted["served"] == 0:
+        failures.append("every request was rejected")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
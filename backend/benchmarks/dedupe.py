@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import io
+import sys
+
+from benchmarks.harness import build_service, make_request
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubSettings
+
+# --------------------------------------------- Result Dedupe Check ---------------------------------------------
+
+# Sends the same fixed-seed request several times through MusicGenService with the stub models and a local S3,
+# and checks the result index (result_index.py):
+# - identical requests at the same time run ONE diffusion, and each one still gets S3 keys of its own
+#   (the frontend saves every song under a unique s3 key), copied inside S3 from the stored song
+# - the same request later is answered from the index: no diffusion, only a copy of the song and its cover
+# - if the stored song was deleted from S3, it is generated again
+# - random seeds (-1) are never deduplicated
+# Exits with 1 if any check fails, so it can be used as a test.
+#
+# Run from backend/: python -m benchmarks.dedupe
+CONCURRENT = 4
+
+
+def fixed_seed_request(seed: int = 42):
+    request = make_request("generate_with_lyrics", 0, audio_duration=10, infer_step=20, output_format="wav")
+    return request.model_copy(update={"seed": seed})
+
+
+def main() -> int:
+    failures = []
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(StubSettings(), s3)
+        diffusion = service.music_model
+        s3_client = s3.client()
+
+        def objects() -> int:
+            return s3_client.list_objects_v2(Bucket=s3.bucket_name).get("KeyCount", 0)
+
+        # identical requests at the same time
+        with ThreadPoolExecutor(max_workers=CONCURRENT) as users:
+            responses = list(users.map(lambda _: service.run_generate_with_lyrics(fixed_seed_request()), range(CONCURRENT)))
+        concurrent = {"diffusion_runs": diffusion.calls, "distinct_keys": len({response.s3_key for response in responses}), "objects": objects()}
+
+        # the same request again, later
+        again = service.run_generate_with_lyrics(fixed_seed_request())
+        earlier_keys = {response.s3_key for response in responses}
+        repeated = {"diffusion_runs": diffusion.calls, "new_key": again.s3_key not in earlier_keys, "objects": objects()}
+
+        # the stored song was deleted from S3 (with every copy, one of them is the one in the index)
+        for s3_key in earlier_keys | {again.s3_key}:
+            s3_client.delete_object(Bucket=s3.bucket_name, Key=s3_key)
+        regenerated = service.run_generate_with_lyrics(fixed_seed_request())
+        stale = {"diffusion_runs": diffusion.calls, "new_key": regenerated.s3_key not in earlier_keys | {again.s3_key}}
+
+        # random seeds
+        for _ in range(2):
+            service.run_generate_with_lyrics(fixed_seed_request(seed=-1))
+        random_runs = diffusion.calls - stale["diffusion_runs"]
+        service.music_batcher.close()
+        stats = service.result_index.stats()
+
+    print(f"{CONCURRENT} identical requests at once: {concurrent['diffusion_runs']} diffusion run(s), {concurrent['distinct_keys']} distinct s3 key(s), {concurrent['objects']} objects in s3")
+    print(f"same request later:          diffusion runs {repeated['diffusion_runs']}, new key {repeated['new_key']}, objects in s3 {repeated['objects']}")
+    print(f"after deleting the song:     diffusion runs {stale['diffusion_runs']}, new key {stale['new_key']}")
+    print(f"2 requests with seed -1:     {random_runs} diffusion run(s)")
+    print(f"result index: {stats}")
+
+    if concurrent["diffusion_runs"] != 1:
+        failures.append("identical requests at the same time were not coalesced")
+    if concurrent["distinct_keys"] != CONCURRENT:
+        failures.append("identical requests at the same time got the same s3 key")
+    if repeated["diffusion_runs"] != 1:
+        failures.append("a repeated request generated again")
+    if not repeated["new_key"] or repeated["objects"] != concurrent["objects"] + 2:
+        failures.append("a repeated request did not get its own copy of the song and the cover")
+    if stale["diffusion_runs"] != 2 or not stale["new_key"]:
+        failures.append("a deleted song was not generated again")
+    if random_runs != 2:
+        failures.append("requests with a random seed were deduplicated")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
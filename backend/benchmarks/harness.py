@@ -0,0 +1,296 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubACEStepPipeline, StubImagePipeline, StubLLM, StubSettings, StubTokenizer
+from llm_cache import LLMResponseCache
+from metrics import Metrics
+from model_loader import ModelLoader
+from music_service import S3_POOL_CONNECTIONS, MusicGenService
+from schemas import GenerateFromDescriptionRequest, GenerateWithCustomLyricsRequest, GenerateWithDescribedLyricsRequest
+from storage import create_s3_client
+
+# --------------------------------------------- Offline Benchmark Harness ---------------------------------------------
+
+# Runs the real request flow of MusicGenServer (music_service.MusicGenService: LLM batching and cache,
+# micro-batched diffusion, pipelined stages, encoding, S3 uploads) with stub models (benchmarks/stub_models.py)
+# and a local S3 (benchmarks/local_s3.py), so it needs no GPU, Modal or AWS.
+#
+# It sends `--requests` requests of the three endpoint kinds (`--mix`) from `--concurrency` users at once and reports:
+# - latency p50/p95/p99 of a whole request, and throughput in songs/minute
+# - every stage (from the metrics histograms): mean seconds, and how much of that is NOT the stub model ("overhead")
+#
+# Baselines catch regressions:
+#   python -m benchmarks.harness --save-baseline default     # benchmarks/baselines/default.json
+#   python -m benchmarks.harness --compare-baseline default  # exits with 1 if anything got slower than --tolerance
+# A baseline also records the work of the run (LLM cache counts, how often every stage ran): if that changed,
+# the comparison fails too, the baseline is out of date and has to be saved again. The timings depend on the
+# host, so a baseline records the machine and the commit it was made on: save your own before comparing.
+#
+# Run from backend/: python -m benchmarks.harness --concurrency 8 --requests 32
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+REQUEST_KINDS = ("generate_from_description", "generate_with_lyrics", "generate_with_described_lyrics")
+
+DESCRIPTIONS = (
+    "a sad piano ballad about leaving home",
+    "an upbeat 80s synth pop song about summer love",
+    "a chill lofi hip-hop beat for studying",
+    "an energetic rock anthem about winning"
+)
+
+# Which stub model runs inside which stage span.
+MODEL_STAGES = {"audio_diffusion": "music_model", "llm_generate": "llm_model", "image_generate": "image_pipe"}
+
+# The LLM cache counts that only depend on the requests (the hits can depend on timing).
+CACHE_COUNTS = ("misses", "uncacheable", "memory_entries")
+# Stages whose count depends on timing (how the micro-batcher groups the songs), every other count must match.
+TIMING_DEPENDENT_STAGES = ("audio_diffusion",)
+
+
+# Builds the request of one kind, like the body a user would send to that endpoint.
+def make_request(kind: str, index: int, audio_duration: float, infer_step: int, output_format: str):
+    description = DESCRIPTIONS[index % len(DESCRIPTIONS)]
+    settings = {"audio_duration": audio_duration, "infer_step": infer_step, "output_format": output_format}
+    if kind == "generate_from_description":
+        return GenerateFromDescriptionRequest(full_described_song=description, **settings)
+    if kind == "generate_with_lyrics":
+        return GenerateWithCustomLyricsRequest(prompt="pop, synth, upbeat, 120 bpm", lyrics="[verse]\n" + description, **settings)
+    return GenerateWithDescribedLyricsRequest(prompt="rock, guitar, energetic", described_lyrics=description, **settings)
+
+
+# "generate_from_description=2,generate_with_lyrics=1" -> the kind of every request, in a fixed shuffled order
+def request_kinds(mix: str, count: int, seed: int) -> List[str]:
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in REQUEST_KINDS:
+            raise SystemExit(f"unknown request kind in --mix: {kind} (use {', '.join(REQUEST_KINDS)})")
+        weights[kind] = float(weight or 1)
+    return random.Random(seed).choices(list(weights), weights=list(weights.values()), k=count)
+
+
+# MusicGenService with the stub models, talking to the local S3.
+def build_service(settings: StubSettings, s3: LocalS3) -> MusicGenService:
+    service = MusicGenService()
+    service.metrics = Metrics(track_gpu_memory=False)
+    service.llm_model_id = "stub-llm"
+    models = ModelLoader(service.metrics)
+    models.register("ace_step", lambda: StubACEStepPipeline(settings))
+    models.register("qwen", lambda: (StubTokenizer(), StubLLM(settings)))
+    models.register("sdxl_turbo", lambda: StubImagePipeline(settings))
+    service.init_runtime(
+        models,
+        create_s3_client(max_pool_connections=S3_POOL_CONNECTIONS, **s3.client_kwargs),
+        s3.bucket_name,
+        metrics_store={},
+        llm_cache=LLMResponseCache(disk_dir=None), # in memory only, every run starts cold
+        llm_prefix_cache=False # the stub LLM has no KV cache, benchmarks/prefix_cache.py measures it with a real model
+    )
+    models.wait() # measure warm requests, benchmarks/model_loading.py is about the cold start
+    return service
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+# Mean seconds of every stage span, and the part of it that was not spent inside the stub model.
+def stage_report(service: MusicGenService) -> Dict[str, dict]:
+    stages = {}
+    for histogram in service.metrics.snapshot()["histograms"]:
+        if not histogram["name"].endswith("_seconds") or not histogram["count"]:
+            continue
+        stage = histogram["name"][:-len("_seconds")]
+        name = stage + "".join(f"[{value}]" for _, value in sorted(histogram["labels"].items()))
+        mean = histogram["sum"] / histogram["count"]
+        model = getattr(service, MODEL_STAGES[stage]) if stage in MODEL_STAGES else None
+        model_mean = model.model_seconds / model.calls if model and model.calls else 0.0
+        stages[name] = {"count": histogram["count"], "mean": mean, "overhead": mean - model_mean}
+    return stages
+
+
+def run(args) -> dict:
+    settings = StubSettings(
+        diffusion_seconds_per_step=args.diffusion_step_seconds,
+        llm_seconds_per_token=args.llm_token_seconds,
+        image_seconds=args.image_seconds,
+        audio_sample_rate=args.audio_sample_rate
+    )
+    kinds = request_kinds(args.mix, args.requests, args.seed)
+
+    # the stages print a lot (span logs, timings), hide it unless asked
+    with LocalS3() as s3, nullcontext() if args.verbose else redirect_stdout(io.StringIO()):
+        service = build_service(settings, s3)
+        handlers = {kind: getattr(service, f"run_{kind}") for kind in REQUEST_KINDS}
+
+        def send(index: int) -> float:
+            request = make_request(kinds[index], index, args.audio_duration, args.infer_step, args.output_format)
+            started = time.perf_counter()
+            handlers[kinds[index]](request)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as users:
+            latencies = list(users.map(send, range(args.requests)))
+        seconds = time.perf_counter() - started
+        service.music_batcher.close()
+
+        return {
+            "latency": {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+            "songs_per_minute": args.requests / seconds * 60,
+            "average_batch": sum(service.music_batcher.batch_sizes) / len(service.music_batcher.batch_sizes),
+            "llm_cache": service.llm_cache.stats(),
+            "stages": stage_report(service)
+        }
+
+
+def print_report(result: dict):
+    latency = result["latency"]
+    print(f"latency  p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  p99 {latency['p99']:.3f}s")
+    print(f"throughput {result['songs_per_minute']:.1f} songs/min, average diffusion batch {result['average_batch']:.2f}")
+    print(f"llm cache {result['llm_cache']}")
+    print(f"\n{'stage':<24} {'count':>6} {'mean s':>8} {'overhead s':>11}")
+    for name, stage in sorted(result["stages"].items()):
+        print(f"{name:<24} {stage['count']:>6} {stage['mean']:>8.4f} {stage['overhead']:>11.4f}")
+
+
+# Every number that got worse than the baseline by more than `tolerance` (0.2 = 20%).
+# Timings also have to be `min_seconds` slower, so the millisecond stages (uploads to the local S3) don't flake.
+def find_regressions(result: dict, baseline: dict, tolerance: float, min_seconds: float) -> List[str]:
+    regressions = []
+
+    def slower(name: str, value: float, before: float):
+        if value > before * (1 + tolerance) and value - before > min_seconds:
+            regressions.append(f"{name}: {value:.4f}s (baseline {before:.4f}s, +{value - before:.4f}s)")
+
+    for key, before in baseline["latency"].items():
+        slower(f"latency {key}", result["latency"][key], before)
+    for name, stage in baseline["stages"].items():
+        if name in result["stages"]:
+            slower(f"stage {name}", result["stages"][name]["mean"], stage["mean"])
+    if result["songs_per_minute"] < baseline["songs_per_minute"] * (1 - tolerance):
+        regressions.append(f"throughput: {result['songs_per_minute']:.1f} songs/min (baseline {baseline['songs_per_minute']:.1f})")
+    return regressions
+
+
+# Everything about the work of the run that differs from the baseline (not the timings).
+def find_work_changes(result: dict, baseline: dict) -> List[str]:
+    changes = []
+    for key in CACHE_COUNTS:
+        if result["llm_cache"][key] != baseline["llm_cache"][key]:
+            changes.append(f"llm cache {key}: {result['llm_cache'][key]} (baseline {baseline['llm_cache'][key]})")
+    for name in sorted(set(result["stages"]) | set(baseline["stages"])):
+        if name.split("[")[0] in TIMING_DEPENDENT_STAGES:
+            continue
+        count = result["stages"].get(name, {}).get("count", 0)
+        before = baseline["stages"].get(name, {}).get("count", 0)
+        if count != before:
+            changes.append(f"stage {name}: ran {count} times (baseline {before})")
+    return changes
+
+
+# Where a baseline was made, its timings only compare with runs on the same kind of machine.
+def machine_info() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "commit": commit
+    }
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+# The settings that change the numbers, a baseline is only comparable with a run of the same settings.
+def run_config(args) -> dict:
+    return {
+        key: getattr(args, key)
+        for key in ("concurrency", "requests", "mix", "seed", "audio_duration", "infer_step", "output_format",
+                    "diffusion_step_seconds", "llm_token_seconds", "image_seconds", "audio_sample_rate")
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the music generation request flow with stub models.")
+    parser.add_argument("--concurrency", type=int, default=4, help="users sending requests at the same time")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--mix", default="generate_from_description=2,generate_with_lyrics=1,generate_with_described_lyrics=1",
+                        help="kind=weight,... of the requests")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the request mix")
+    parser.add_argument("--audio-duration", type=float, default=30)
+    parser.add_argument("--infer-step", type=int, default=60)
+    parser.add_argument("--output-format", default="wav", choices=["wav", "flac", "opus", "mp3"], help="anything but wav needs ffmpeg")
+    parser.add_argument("--diffusion-step-seconds", type=float, default=0.005, help="stub ACE-Step time per step")
+    parser.add_argument("--llm-token-seconds", type=float, default=0.002, help="stub Qwen time per generated token")
+    parser.add_argument("--image-seconds", type=float, default=0.1, help="stub SDXL time per image")
+    parser.add_argument("--audio-sample-rate", type=int, default=4000, help="sample rate of the stub songs (sets the WAV size)")
+    parser.add_argument("--save-baseline", metavar="NAME", help="save the results as benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare-baseline", metavar="NAME", help="compare with benchmarks/baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.02, help="smallest slowdown of a timing that counts as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the logs of the stages")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare_baseline:
+        with open(baseline_path(args.compare_baseline)) as file:
+            baseline = json.load(file)
+        if baseline["config"] != run_config(args):
+            print(f"baseline '{args.compare_baseline}' was made with other settings: {baseline['config']}", file=sys.stderr)
+            return 2
+
+    result = run(args)
+    print_report(result)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(args.save_baseline), "w") as file:
+            json.dump({"config": run_config(args), "machine": machine_info(), **result}, file, indent=2)
+        print(f"\nsaved baseline {baseline_path(args.save_baseline)}")
+
+    if baseline is not None:
+        machine = {key: value for key, value in machine_info().items() if key != "commit"}
+        recorded = {key: value for key, value in baseline.get("machine", {}).items() if key != "commit"}
+        if machine != recorded:
+            print(f"\nnote: baseline '{args.compare_baseline}' was made on another machine ({recorded or 'unknown'}), its timings may not compare")
+        changes = find_work_changes(result, baseline)
+        if changes:
+            print(f"\nbaseline '{args.compare_baseline}' is out of date, the run did other work (save it again):", file=sys.stderr)
+            for change in changes:
+                print(f"  {change}", file=sys.stderr)
+            return 1
+        regressions = find_regressions(result, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"\nREGRESSION against baseline '{args.compare_baseline}' (tolerance {args.tolerance:.0%}):", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print(f"\nno regression against baseline '{args.compare_baseline}' (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import sys
+import threading
+import time
+import uuid
+
+from admission import BACKGROUND
+from benchmarks.harness import build_service
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubSettings
+from jobs import DONE, FAILED, JOB_STAGES, RUNNING, SUCCEEDED, in_memory_job_manager
+from progressive import manifest_key
+from schemas import JOB_REQUEST_MODELS, GenerateMusicResponseS3
+
+# --------------------------------------------- Background Job Check ---------------------------------------------
+
+# Drives background jobs through an in-memory job manager (jobs.in_memory_job_manager) the way the endpoints
+# and the worker do (submit_job -> MusicGenServer.process_next_job -> job_status/job_result), with the real
+# MusicGenService, the stub models and a local S3:
+# - a song job: succeeded, every stage done, its result is a GenerateMusicResponseS3 (a progressive one too,
+#   with the stream id picked at submit time)
+# - a job whose cover fails: failed with the error, the audio stage still done
+# - a long job: stays running while its worker's heartbeat goes on
+# - a job whose worker dies after taking it: failed once its heartbeat is stale, instead of running forever
+# Exits with 1 if any check fails.
+#
+# Run from backend/: python -m benchmarks.jobs
+
+HEARTBEAT_SECONDS = 0.05
+STALE_AFTER_SECONDS = 0.3
+
+SONG = {"prompt": "lofi, chill, piano", "lyrics": "[instrumental]", "audio_duration": 10, "infer_step": 10}
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+def main() -> int:
+    failures = []
+    manager = in_memory_job_manager(heartbeat_seconds=HEARTBEAT_SECONDS, stale_after_seconds=STALE_AFTER_SECONDS)
+
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(StubSettings(), s3)
+
+        # what submit_job saves, and what MusicGenServer.run_job does with it
+        def submit(kind: str, body: dict) -> str:
+            request = JOB_REQUEST_MODELS[kind](**body)
+            stream_id = str(uuid.uuid4()) if request.progressive else None
+            return manager.submit(kind, {**request.model_dump(), "stream_id": stream_id})
+
+        def run_job(kind: str, payload: dict, progress) -> dict:
+            request = JOB_REQUEST_MODELS[kind](**payload)
+            return service.run_admitted(kind, request, BACKGROUND, progress=progress, stream_id=payload.get("stream_id")).model_dump()
+
+        # a song, and a progressive one
+        song = submit("generate_with_lyrics", SONG)
+        manager.run_next(run_job, timeout=1)
+        progressive = submit("generate_with_lyrics", {**SONG, "progressive": True, "segment_seconds": 5})
+        manager.run_next(run_job, timeout=1)
+
+        # a job whose cover fails
+        def generate_thumbnail(*args, **kwargs):
+            raise InjectedFailure("cover failed")
+
+        service.generate_thumbnail = generate_thumbnail
+        broken = submit("generate_with_lyrics", SONG)
+        with redirect_stderr(io.StringIO()): # the expected traceback of the failed job
+            manager.run_next(run_job, timeout=1)
+        del service.generate_thumbnail
+        service.music_batcher.close()
+
+    for name, job_id in (("song", song), ("progressive song", progressive)):
+        job = manager.get(job_id)
+        print(f"{name}: {job['status']}, stages {job['stages']}")
+        if job["status"] != SUCCEEDED or any(job["stages"][stage] != DONE for stage in JOB_STAGES):
+            failures.append(f"the {name} job did not succeed with every stage done: {job}")
+            continue
+        result = GenerateMusicResponseS3(**job["result"])
+        if not result.s3_key or not result.cover_image_s3_key:
+            failures.append(f"the {name} job has an incomplete result: {result}")
+        if name == "progressive song" and result.manifest_s3_key != manifest_key(job["payload"]["stream_id"]):
+            failures.append(f"the progressive song is not in the stream picked at submit time: {result.manifest_s3_key}")
+
+    job = manager.get(broken)
+    print(f"failing job: {job['status']}, error {job['error']!r}, stages {job['stages']}")
+    if job["status"] != FAILED or "cover failed" not in (job["error"] or "") or job["result"] is not None:
+        failures.append(f"the failing job was not failed with its error: {job}")
+    if job["stages"]["audio"] != DONE:
+        failures.append("the audio of the failing job was not done")
+
+    # a long job, its worker alive: the heartbeat keeps it running
+    started = threading.Event()
+
+    def long_job(kind, payload, progress):
+        started.set()
+        time.sleep(3 * STALE_AFTER_SECONDS)
+        return {"done": True}
+
+    long = manager.submit("generate_with_lyrics", {})
+    worker = threading.Thread(target=manager.run_next, args=(long_job, 1))
+    worker.start()
+    started.wait()
+    statuses = []
+    while worker.is_alive():
+        statuses.append(manager.get(long)["status"])
+        time.sleep(HEARTBEAT_SECONDS)
+    worker.join()
+    final = manager.get(long)["status"]
+    print(f"long job: {len(statuses)} polls while it ran, statuses {sorted(set(statuses))}, then {final}")
+    if set(statuses) != {RUNNING} or final != SUCCEEDED:
+        failures.append(f"the long job was not running until it succeeded: {sorted(set(statuses))}, then {final}")
+
+    # a worker that takes a job and dies (what run_next does before the handler, then nothing)
+    lost = manager.submit("generate_with_lyrics", {})
+    manager.queue.get(block=False)
+    now = time.time()
+    manager.store.update(lost, status=RUNNING, started_at=now, heartbeat_at=now)
+    before = manager.get(lost)["status"]
+    time.sleep(2 * STALE_AFTER_SECONDS)
+    job = manager.get(lost)
+    print(f"job of a dead worker: {before}, then {job['status']} ({job['error']})")
+    if before != RUNNING or job["status"] != FAILED:
+        failures.append(f"the job of a dead worker was not failed: {before}, then {job['status']}")
+
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import logging
+
+import boto3
+
+# --------------------------------------------- Local S3 Stand-In ---------------------------------------------
+
+# Starts a local fake S3 server (moto) so uploads can be tried without AWS.
+# Needs the dev-only dependency: pip install "moto[server]"
+#
+# Example:
+#   with LocalS3() as s3:
+#       client = s3.client()
+#       upload_buffer(client, buffer, s3.bucket_name, "song.wav", "audio/wav")
+class LocalS3:
+    def __init__(self, bucket_name: str = "local-music-bucket", port: int = 0):
+        self.bucket_name = bucket_name
+        self.port = port # 0 -> pick any free port
+        self._server = None
+
+    def __enter__(self):
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR) # hide the per-request log lines of the fake server
+        self._server = ThreadedMotoServer(ip_address="127.0.0.1", port=self.port, verbose=False)
+        self._server.start()
+        self.port = self._server._server.server_port # the port that was actually picked
+        self.client().create_bucket(Bucket=self.bucket_name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.stop()
+
+    @property
+    def endpoint_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    # The boto3.client arguments that point a client at the local server,
+    # e.g. storage.create_s3_client(**s3.client_kwargs)
+    @property
+    def client_kwargs(self) -> dict:
+        return {
+            "endpoint_url": self.endpoint_url,
+            "region_name": "us-east-1",
+            "aws_access_key_id": "local",
+            "aws_secret_access_key": "local"
+        }
+
+    # A plain boto3 s3 client pointing at the local server (any extra boto3.client arguments can be passed).
+    def client(self, **kwargs):
+        return boto3.client("s3", **self.client_kwargs, **kwargs)
@@ -0,0 +1,57 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from batching import AudioRequest, MicroBatcher, audio_bucket
+
+# --------------------------------------------- Micro-Batching Throughput Benchmark ---------------------------------------------
+
+# Measures songs/minute for different max batch sizes, with a stub ACE-Step pipeline.
+# On a GPU, a batch of N songs takes much less than N times as long as a single song:
+# the stub models that with `seconds = song_seconds * (1 + batch_cost * (N - 1))`.
+#
+# Run: python -m benchmarks.micro_batching --clients 8 --songs 48
+
+
+class StubMusicPipeline:
+    def __init__(self, song_seconds: float, batch_cost: float):
+        self.song_seconds = song_seconds
+        self.batch_cost = batch_cost
+
+    def run_batch(self, requests):
+        time.sleep(self.song_seconds * (1 + self.batch_cost * (len(requests) - 1)))
+        return [(b"RIFF", request.seed) for request in requests]
+
+
+def run(max_batch_size: int, clients: int, songs: int, song_seconds: float, batch_cost: float, max_wait_ms: float) -> dict:
+    pipeline = StubMusicPipeline(song_seconds, batch_cost)
+    batcher = MicroBatcher(pipeline.run_batch, bucket_key=audio_bucket, max_batch_size=max_batch_size, max_wait_seconds=max_wait_ms / 1000)
+    request = AudioRequest(prompt="pop", lyrics="[instrumental]", audio_duration=180, infer_step=60, guidance_scale=15, seed=-1)
+
+    started = time.perf_counter()
+    # `clients` users sending songs at the same time, `songs` songs in total
+    with ThreadPoolExecutor(max_workers=clients) as users:
+        list(users.map(lambda _: batcher.submit(request), range(songs)))
+    seconds = time.perf_counter() - started
+    batcher.close()
+
+    return {
+        "songs_per_minute": songs / seconds * 60,
+        "average_batch": sum(batcher.batch_sizes) / len(batcher.batch_sizes)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--songs", type=int, default=32)
+    parser.add_argument("--song-seconds", type=float, default=0.1, help="stub time of one song alone")
+    parser.add_argument("--batch-cost", type=float, default=0.15, help="extra time per extra song in a batch")
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{'max batch':>9} {'avg batch':>9} {'songs/min':>10}")
+    for max_batch_size in args.batch_sizes:
+        result = run(max_batch_size, args.clients, args.songs, args.song_seconds, args.batch_cost, args.max_wait_ms)
+        print(f"{max_batch_size:>9} {result['average_batch']:>9.2f} {result['songs_per_minute']:>10.1f}")
@@ -0,0 +1,80 @@
+import sys
+import time
+
+from model_loader import LOADED, NOT_STARTED, ModelLoader
+
+# --------------------------------------------- Model Loading Benchmark ---------------------------------------------
+
+# Cold start of a container with stub loaders that only sleep (scaled down, roughly shaped like the real ones:
+# Qwen2-7B is the biggest read from the volumes, SDXL-turbo the smallest).
+# Checks that the loads overlap and that a request only waits for the model it uses;
+# exits with 1 if they don't, so it can be used as a test.
+#
+# Run: python -m benchmarks.model_loading
+LOAD_SECONDS = {"ace_step": 0.6, "qwen": 0.8, "sdxl_turbo": 0.4}
+
+
+def stub_loader(name: str):
+    def load():
+        time.sleep(LOAD_SECONDS[name])
+        return name
+    return load
+
+
+# The old load_model: every model one after the other, before any request.
+def run_sequential() -> float:
+    started = time.perf_counter()
+    for name in LOAD_SECONDS:
+        stub_loader(name)()
+    return time.perf_counter() - started
+
+
+def make_loader(lazy=()) -> ModelLoader:
+    models = ModelLoader(lazy=lazy)
+    for name in LOAD_SECONDS:
+        models.register(name, stub_loader(name))
+    models.start()
+    return models
+
+
+# Every model loading at the same time.
+def run_parallel() -> dict:
+    started = time.perf_counter()
+    models = make_loader()
+    models.get("ace_step") # a request that only needs the music model (e.g. generate_with_lyrics, before its categories)
+    audio_ready = time.perf_counter() - started
+    models.wait()
+    return {"total": time.perf_counter() - started, "audio_ready": audio_ready, "load_times": models.load_times()}
+
+
+# SDXL-turbo only loads when the first thumbnail needs it.
+def run_lazy() -> dict:
+    models = make_loader(lazy=["sdxl_turbo"])
+    models.get("ace_step")
+    models.get("qwen")
+    not_started = models.states()["sdxl_turbo"] == NOT_STARTED
+    models.get("sdxl_turbo")
+    return {"not_started_before_use": not_started, "loaded_after_use": models.states()["sdxl_turbo"] == LOADED}
+
+
+if __name__ == "__main__":
+    sequential = run_sequential()
+    parallel = run_parallel()
+    lazy = run_lazy()
+    print(f"load times:            {', '.join(f'{name} {seconds:.2f}s' for name, seconds in parallel['load_times'].items())}")
+    print(f"sequential:            {sequential:.2f}s")
+    print(f"parallel:              {parallel['total']:.2f}s")
+    print(f"ace_step usable after: {parallel['audio_ready']:.2f}s")
+    print(f"lazy sdxl_turbo:       not loaded until used: {lazy['not_started_before_use']}, loaded on use: {lazy['loaded_after_use']}")
+
+    failures = []
+    # overlapping loads take about as long as the slowest one, not the sum
+    if parallel["total"] > max(LOAD_SECONDS.values()) + 0.25 * min(LOAD_SECONDS.values()):
+        failures.append("the loads did not overlap")
+    if parallel["audio_ready"] > LOAD_SECONDS["ace_step"] + 0.1:
+        failures.append("getting ace_step waited for other models")
+    if not (lazy["not_started_before_use"] and lazy["loaded_after_use"]):
+        failures.append("the lazy model did not load on first use")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,74 @@
+import argparse
+from contextlib import redirect_stdout
+import io
+import sys
+import time
+
+from audio_encoding import AUDIO_FORMATS
+from benchmarks.harness import DESCRIPTIONS, build_service
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubSettings
+
+# --------------------------------------------- Stage Overlap Benchmark ---------------------------------------------
+
+# generate_and_upload_to_s3 runs the thumbnail, the categories and the uploads at the same time as the audio,
+# so a song should take about as long as its audio and the audio upload alone. This runs the real
+# MusicGenService flow with the stub models and a local S3, against the same stages one after the other
+# (the old flow), and times the audio + its upload on their own.
+# Exits with 1 if the pipelined song takes more than --max-overhead longer than the audio + its upload.
+#
+# Run from backend/: python -m benchmarks.pipeline_overlap
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio-duration", type=float, default=30)
+    parser.add_argument("--infer-step", type=int, default=60)
+    parser.add_argument("--output-format", default="wav")
+    parser.add_argument("--max-overhead", type=float, default=0.15, help="allowed extra time of the pipelined song, relative to the audio + its upload")
+    args = parser.parse_args(argv)
+
+    # a slow enough cover next to the audio to see it overlap
+    settings = StubSettings(diffusion_seconds_per_step=0.02, image_seconds=0.4)
+    # not comma-separated tags, so its categories come from the LLM
+    description = DESCRIPTIONS[0]
+    audio_format = AUDIO_FORMATS[args.output_format]
+    song = dict(prompt="piano, ballad, sad", lyrics="[instrumental]", audio_duration=args.audio_duration, infer_step=args.infer_step, guidance_scale=15, seed=-1)
+
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(settings, s3)
+        upload = (service.s3_client, service.bucket_name)
+
+        # the old flow: every stage one after the other
+        started = time.perf_counter()
+        wav = service.generate_audio(**song)
+        service.upload_to_s3(service.encode_audio(wav, args.output_format, 192), *upload, audio_format["extension"], audio_format["content_type"])
+        audio_seconds = time.perf_counter() - started
+        service.upload_to_s3(service.generate_thumbnail(song["prompt"]), *upload, "png", "image/png")
+        service.generate_categories(description)
+        sequential = time.perf_counter() - started
+
+        # the flow of generate_and_upload_to_s3
+        started = time.perf_counter()
+        response = service.generate_and_upload_to_s3(
+            **song, instrumental=True, description_for_categorization=description, output_format=args.output_format
+        )
+        pipelined = time.perf_counter() - started
+        service.music_batcher.close()
+
+    print(f"audio + its upload alone: {audio_seconds:.2f}s")
+    print(f"sequential:               {sequential:.2f}s")
+    print(f"pipelined:                {pipelined:.2f}s ({pipelined / audio_seconds - 1:+.0%} over the audio + its upload)")
+
+    failures = []
+    if pipelined > audio_seconds * (1 + args.max_overhead):
+        failures.append(f"the pipelined song takes {pipelined:.2f}s, more than {1 + args.max_overhead:.2f}x the audio + its upload ({audio_seconds:.2f}s)")
+    if not response.s3_key or not response.cover_image_s3_key or not response.categories:
+        failures.append(f"incomplete response: {response}")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
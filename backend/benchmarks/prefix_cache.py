@@ -0,0 +1,149 @@
+import argparse
+import statistics
+import sys
+import time
+
+import torch
+
+from llm_prefix_cache import PrefixKVCache, render_prefix
+from prompts import (
+    CATEGORIES_GENERATOR_INSTRUCTIONS,
+    CATEGORIES_GENERATOR_PROMPT,
+    LYRICS_GENERATOR_INSTRUCTIONS,
+    LYRICS_GENERATOR_PROMPT,
+    PROMPT_GENERATOR_INSTRUCTIONS,
+    PROMPT_GENERATOR_PROMPT,
+)
+
+# --------------------------------------------- Prefix KV Cache Benchmark ---------------------------------------------
+
+# Time to first token of the prompt templates with and without the prefix KV cache (llm_prefix_cache.py),
+# with a small LLM on the CPU standing in for Qwen2-7B on the GPU. Also checks that both ways generate
+# exactly the same tokens (greedy decoding), and exits with 1 if they don't.
+#
+# Run: python -m benchmarks.prefix_cache                                # Qwen/Qwen2-0.5B-Instruct from the HF hub
+#      python -m benchmarks.prefix_cache --random-weights              # offline: a tiny random Qwen2, same shapes of work
+# Needs transformers (see benchmarks/requirements.txt)
+
+DESCRIPTION = "a melancholic indie folk song about a long train ride home, soft female vocal, acoustic guitar"
+
+TEMPLATES = {
+    "tags": (PROMPT_GENERATOR_INSTRUCTIONS, PROMPT_GENERATOR_PROMPT.format(user_prompt=DESCRIPTION)),
+    "lyrics": (LYRICS_GENERATOR_INSTRUCTIONS, LYRICS_GENERATOR_PROMPT.format(description=DESCRIPTION)),
+    "categories": (CATEGORIES_GENERATOR_INSTRUCTIONS, CATEGORIES_GENERATOR_PROMPT.format(description=DESCRIPTION))
+}
+
+# How the Qwen2 tokenizer splits text into words before BPE (for the offline tokenizer).
+# Runs of newlines stay one piece, so the text after a template's instructions never changes their tokens.
+QWEN2_SPLIT_PATTERN = r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+
+# ChatML, the chat format of Qwen2 (for the offline tokenizer)
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+def load_pretrained(model_id: str):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id, padding_side="left")
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32).eval()
+    return tokenizer, model
+
+
+# A tiny Qwen2 with random weights and a tokenizer trained on the templates: no download needed.
+# Its answers are nonsense, but the prefill work grows with the prompt length just like the real model's.
+def load_random(hidden_size: int, layers: int):
+    from tokenizers import Regex, Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    special_tokens = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.Split(Regex(QWEN2_SPLIT_PATTERN), behavior="isolated"),
+        pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False)
+    ])
+    bpe.decoder = decoders.ByteLevel()
+    corpus = [instructions for instructions, _ in TEMPLATES.values()] + [DESCRIPTION]
+    bpe.train_from_iterator(corpus, trainers.BpeTrainer(vocab_size=2000, special_tokens=special_tokens, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe, pad_token="<|endoftext|>", eos_token="<|im_end|>", padding_side="left", chat_template=CHAT_TEMPLATE
+    )
+
+    torch.manual_seed(0)
+    config = Qwen2Config(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, intermediate_size=hidden_size * 3,
+        num_hidden_layers=layers, num_attention_heads=8, num_key_value_heads=2, max_position_embeddings=4096,
+        pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id
+    )
+    return tokenizer, Qwen2ForCausalLM(config).eval()
+
+
+def chat(tokenizer, question: str) -> str:
+    return tokenizer.apply_chat_template([{"role": "user", "content": question}], tokenize=False, add_generation_prompt=True)
+
+
+# Generates from the texts the way MusicGenService.generate_llm_batch does, with or without the prefix cache.
+def generate(tokenizer, model, texts, prefix_cache, max_new_tokens: int):
+    if prefix_cache is None:
+        inputs = tokenizer(texts, return_tensors="pt", padding=True)
+        input_ids, attention_mask, past_key_values = inputs.input_ids, inputs.attention_mask, None
+    else:
+        input_ids, attention_mask, past_key_values, _ = prefix_cache.build_inputs(texts)
+    with torch.no_grad():
+        output = model.generate(
+            input_ids, attention_mask=attention_mask, past_key_values=past_key_values,
+            max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.pad_token_id
+        )
+    return output[:, input_ids.shape[1]:]
+
+
+# Median seconds until the first token, over `repeats` runs.
+def time_to_first_token(tokenizer, model, texts, prefix_cache, repeats: int) -> float:
+    generate(tokenizer, model, texts, prefix_cache, 1) # warm-up
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        generate(tokenizer, model, texts, prefix_cache, 1)
+        seconds.append(time.perf_counter() - started)
+    return statistics.median(seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="Qwen/Qwen2-0.5B-Instruct")
+    parser.add_argument("--random-weights", action="store_true", help="use a tiny random Qwen2 instead (offline)")
+    parser.add_argument("--hidden-size", type=int, default=512, help="size of the random model")
+    parser.add_argument("--layers", type=int, default=12, help="layers of the random model")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--check-tokens", type=int, default=16, help="greedy tokens compared between both ways")
+    args = parser.parse_args()
+
+    tokenizer, model = load_random(args.hidden_size, args.layers) if args.random_weights else load_pretrained(args.model)
+
+    started = time.perf_counter()
+    prefix_cache = PrefixKVCache(tokenizer, model)
+    for name, (instructions, _) in TEMPLATES.items():
+        prefix_cache.add(name, render_prefix(tokenizer, instructions))
+    print(f"prefix cache built in {time.perf_counter() - started:.2f}s, cached tokens: {prefix_cache.cached_tokens()}")
+
+    # every template alone, then all three in one batch (like generate_from_description)
+    cases = {name: [chat(tokenizer, question)] for name, (_, question) in TEMPLATES.items()}
+    cases["batch of 3"] = [chat(tokenizer, question) for _, question in TEMPLATES.values()]
+
+    print(f"\n{'prompt':<12} {'tokens':>7} {'ttft full':>10} {'ttft cached':>12} {'speedup':>8}")
+    mismatches = []
+    for name, texts in cases.items():
+        tokens = int(tokenizer(texts, return_tensors="pt", padding=True).attention_mask.sum())
+        full = time_to_first_token(tokenizer, model, texts, None, args.repeats)
+        cached = time_to_first_token(tokenizer, model, texts, prefix_cache, args.repeats)
+        print(f"{name:<12} {tokens:>7} {full * 1000:>8.1f}ms {cached * 1000:>10.1f}ms {full / cached:>7.1f}x")
+
+        if not torch.equal(generate(tokenizer, model, texts, None, args.check_tokens), generate(tokenizer, model, texts, prefix_cache, args.check_tokens)):
+            mismatches.append(name)
+
+    if mismatches:
+        print(f"FAILED: the prefix cache changed the generated tokens of: {', '.join(mismatches)}", file=sys.stderr)
+        sys.exit(1)
+    print(f"\nsame {args.check_tokens} greedy tokens with and without the prefix cache")
@@ -0,0 +1,176 @@
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import sys
+import threading
+import time
+from typing import Optional
+import uuid
+
+from benchmarks.harness import DESCRIPTIONS, build_service
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import LATENT_FRAMES_PER_SECOND, StubSettings
+from progressive import manifest_key, playlist_key
+from schemas import GenerateFromDescriptionRequest
+
+# --------------------------------------------- Progressive Audio Benchmark ---------------------------------------------
+
+# How long a user waits before a song can start playing: the full file of a normal request against the first
+# segment of a progressive one, with the stub models and a local S3. A thread polls the stream's manifest.json
+# like a client would. The segments are decoded from the finished latents, so they can only start once every
+# diffusion step is done: progressive mode can at most save the tail after the diffusion (decode, encode,
+# upload), which is what this reports. The stub decoder costs nothing by default (ACE-Step's decoder is a small
+# part of the diffusion), give it a measured cost with --decode-speed. Also checks that the stream ends complete,
+# with a gap-free run of segments that add up to the song and an HLS playlist with an ENDLIST, and that a stream
+# whose song fails (its encoding, after the segments) still ends, with the error in the manifest.
+# Exits with 1 if the first segment arrives later than the full file would have, or the stream is broken.
+#
+# Run from backend/: python -m benchmarks.progressive --audio-duration 60 --segment-seconds 10
+
+# Polls the manifest of the stream until its first segment is listed, like a player waiting to start.
+class ManifestPoller(threading.Thread):
+    def __init__(self, s3: LocalS3, stream_id: str, started: float, interval: float = 0.02):
+        super().__init__(daemon=True)
+        self.client = s3.client()
+        self.stream_id = stream_id
+        self.bucket_name = s3.bucket_name
+        self.started = started
+        self.interval = interval
+        self.first_segment_seconds: Optional[float] = None
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                body = self.client.get_object(Bucket=self.bucket_name, Key=manifest_key(self.stream_id))["Body"].read()
+                if json.loads(body)["segments"]:
+                    self.first_segment_seconds = time.perf_counter() - self.started
+                    return
+            except self.client.exceptions.NoSuchKey:
+                pass
+            time.sleep(self.interval)
+
+
+def read_json(s3: LocalS3, key: str) -> dict:
+    return json.loads(s3.client().get_object(Bucket=s3.bucket_name, Key=key)["Body"].read())
+
+
+def measure(request: GenerateFromDescriptionRequest, settings: StubSettings) -> dict:
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(settings, s3)
+        diffusion = service.music_model
+        diffusion_done = []
+        run_diffusion = diffusion.text2music_diffusion_process
+
+        def timed_diffusion(*args, **kwargs):
+            latents = run_diffusion(*args, **kwargs)
+            diffusion_done.append(time.perf_counter() - started)
+            return latents
+
+        diffusion.text2music_diffusion_process = timed_diffusion
+        # a new stream every run: the local S3 keeps its files between servers of the same process
+        stream_id = str(uuid.uuid4()) if request.progressive else None
+        started = time.perf_counter()
+        poller = ManifestPoller(s3, stream_id, started)
+        if request.progressive:
+            poller.start()
+        response = service.run_generate_from_description(request, stream_id=stream_id)
+        seconds = time.perf_counter() - started
+        poller.stop.set()
+        service.music_batcher.close()
+
+        result = {"seconds": seconds, "diffusion_seconds": diffusion_done[-1], "first_audio_seconds": poller.first_segment_seconds or seconds}
+        if request.progressive:
+            manifest = read_json(s3, response.manifest_s3_key)
+            playlist = s3.client().get_object(Bucket=s3.bucket_name, Key=playlist_key(stream_id))["Body"].read().decode("utf-8")
+            result.update(
+                manifest=manifest,
+                playlist_complete=playlist.rstrip().endswith("#EXT-X-ENDLIST"),
+                full_file_matches=manifest.get("s3_key") == response.s3_key
+            )
+        return result
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+# A progressive song whose full file fails to encode: the request fails, the stream must still end.
+def measure_failure(request: GenerateFromDescriptionRequest, settings: StubSettings, stream_id: str) -> dict:
+    def encode_audio(*args, **kwargs):
+        raise InjectedFailure("encoding failed")
+
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(settings, s3)
+        service.encode_audio = encode_audio
+        try:
+            service.run_generate_from_description(request, stream_id=stream_id)
+            raised = False
+        except InjectedFailure:
+            raised = True
+        service.music_batcher.close()
+        playlist = s3.client().get_object(Bucket=s3.bucket_name, Key=playlist_key(stream_id))["Body"].read().decode("utf-8")
+        return {"raised": raised, "manifest": read_json(s3, manifest_key(stream_id)), "playlist_complete": playlist.rstrip().endswith("#EXT-X-ENDLIST")}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio-duration", type=float, default=60)
+    parser.add_argument("--segment-seconds", type=float, default=10)
+    parser.add_argument("--infer-step", type=int, default=60)
+    parser.add_argument("--output-format", default="wav")
+    parser.add_argument("--decode-speed", type=float, default=StubSettings.decode_seconds_per_audio_second, help="stub decoder seconds per second of song")
+    parser.add_argument("--audio-sample-rate", type=int, default=48000, help="sample rate of the stub songs, the real one by default (sets the size of what is encoded and uploaded)")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="allowed extra first-audio time, relative to the full file")
+    args = parser.parse_args(argv)
+
+    settings = StubSettings(decode_seconds_per_audio_second=args.decode_speed, audio_sample_rate=args.audio_sample_rate)
+    song = {
+        "full_described_song": DESCRIPTIONS[0], "audio_duration": args.audio_duration,
+        "infer_step": args.infer_step, "output_format": args.output_format
+    }
+    full = measure(GenerateFromDescriptionRequest(**song), settings)
+    progressive = measure(GenerateFromDescriptionRequest(**song, progressive=True, segment_seconds=args.segment_seconds), settings)
+    failed = measure_failure(GenerateFromDescriptionRequest(**song, progressive=True, segment_seconds=args.segment_seconds), settings, str(uuid.uuid4()))
+
+    print(f"{args.audio_duration:.0f}s song, {args.segment_seconds:.0f}s segments, {args.output_format}, decoder {args.decode_speed:g}s per second of song\n")
+    print(f"{'':<12} {'diffusion done s':>17} {'first audio s':>14} {'full file s':>12}")
+    for name, result in (("full file", full), ("progressive", progressive)):
+        print(f"{name:<12} {result['diffusion_seconds']:>17.2f} {result['first_audio_seconds']:>14.2f} {result['seconds']:>12.2f}")
+    tail = full["seconds"] - full["diffusion_seconds"]
+    saved = full["first_audio_seconds"] - progressive["first_audio_seconds"]
+    print(f"\nafter the diffusion, the full file takes another {tail:.2f}s (decode, encode, upload): "
+          f"progressive playback starts {saved:.2f}s earlier ({saved / full['seconds']:.0%} of the wait), "
+          f"its full file {progressive['seconds'] - full['seconds']:+.2f}s later")
+
+    manifest = progressive["manifest"]
+    segments = manifest["segments"]
+    streamed = sum(segment["duration"] for segment in segments)
+    print(f"{len(segments)} segments, {streamed:.2f}s of audio, complete: {manifest['complete']}")
+    print(f"failed song: complete {failed['manifest']['complete']}, error {failed['manifest'].get('error')!r}, playlist ended {failed['playlist_complete']}")
+
+    failures = []
+    if progressive["first_audio_seconds"] > full["first_audio_seconds"] * (1 + args.tolerance):
+        failures.append(f"the first segment arrives after {progressive['first_audio_seconds']:.2f}s, later than the full file ({full['first_audio_seconds']:.2f}s)")
+    if not manifest["complete"] or not progressive["full_file_matches"]:
+        failures.append("the manifest is not complete with the key of the full file")
+    if [segment["index"] for segment in segments] != list(range(len(segments))):
+        failures.append("the segments are not a gap-free run")
+    if abs(streamed - args.audio_duration) > 1.5 / LATENT_FRAMES_PER_SECOND: # the latents have whole frames (~0.09s each)
+        failures.append(f"the segments add up to {streamed:.2f}s, the song is {args.audio_duration:.2f}s")
+    if not progressive["playlist_complete"]:
+        failures.append("the playlist has no #EXT-X-ENDLIST")
+    if not failed["raised"]:
+        failures.append("the failed song did not fail the request")
+    if not failed["manifest"]["complete"] or not failed["manifest"].get("error") or "s3_key" in failed["manifest"]:
+        failures.append("the stream of the failed song did not end with its error")
+    if not failed["playlist_complete"]:
+        failures.append("the playlist of the failed song has no #EXT-X-ENDLIST")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import argparse
+import io
+import os
+import time
+
+from benchmarks.local_s3 import LocalS3
+from storage import connection_stats, create_s3_client, upload_buffer
+
+# --------------------------------------------- S3 Client Pool Benchmark ---------------------------------------------
+
+# Compares making a new boto3 client for every request (the old generate_and_upload_to_s3)
+# with one client shared for the whole container (create_s3_client in load_model).
+# Each "request" uploads one audio file and one cover image, like a real song generation.
+#
+# Run: python -m benchmarks.s3_client_pool --requests 50
+
+
+def fake_request(s3_client, bucket_name: str, audio_bytes: bytes, image_bytes: bytes, index: int):
+    upload_buffer(s3_client, io.BytesIO(audio_bytes), bucket_name, f"song-{index}.wav", "audio/wav")
+    upload_buffer(s3_client, io.BytesIO(image_bytes), bucket_name, f"cover-{index}.png", "image/png")
+
+
+def run_per_request_clients(s3: LocalS3, requests: int, audio_bytes: bytes, image_bytes: bytes) -> dict:
+    started = time.perf_counter()
+    totals = {"requests": 0, "connections_opened": 0, "connections_reused": 0}
+    for index in range(requests):
+        s3_client = create_s3_client(**s3.client_kwargs) # a brand new client (and connection pool) every time
+        fake_request(s3_client, s3.bucket_name, audio_bytes, image_bytes, index)
+        for name, value in connection_stats(s3_client).items():
+            totals[name] += value
+    return {"seconds": time.perf_counter() - started, **totals}
+
+
+def run_pooled_client(s3: LocalS3, requests: int, audio_bytes: bytes, image_bytes: bytes) -> dict:
+    started = time.perf_counter()
+    s3_client = create_s3_client(**s3.client_kwargs) # made once, like in load_model
+    for index in range(requests):
+        fake_request(s3_client, s3.bucket_name, audio_bytes, image_bytes, index)
+    return {"seconds": time.perf_counter() - started, **connection_stats(s3_client)}
+
+
+def print_result(name: str, result: dict, requests: int):
+    print(
+        f"{name:<20} {result['seconds'] / requests * 1000:8.1f} ms/request   "
+        f"requests={result['requests']} opened={result['connections_opened']} reused={result['connections_reused']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--audio-kb", type=int, default=512)
+    parser.add_argument("--image-kb", type=int, default=128)
+    args = parser.parse_args()
+
+    audio_bytes = os.urandom(args.audio_kb * 1024)
+    image_bytes = os.urandom(args.image_kb * 1024)
+
+    with LocalS3() as s3:
+        print_result("client per request", run_per_request_clients(s3, args.requests, audio_bytes, image_bytes), args.requests)
+        print_result("pooled client", run_pooled_client(s3, args.requests, audio_bytes, image_bytes), args.requests)
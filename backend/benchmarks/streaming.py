@@ -0,0 +1,92 @@
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import sys
+import time
+from typing import List, Tuple
+
+from benchmarks.harness import DESCRIPTIONS, build_service
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubSettings
+from llm_cache import LLMResponseCache
+from schemas import GenerateFromDescriptionRequest
+
+# --------------------------------------------- Streaming Benchmark ---------------------------------------------
+
+# Time to first content: when the user first sees something of their song. The blocking endpoint shows
+# nothing until the response, the streaming endpoint (MusicGenService.stream_job) sends the tags and lyrics
+# token by token, the stages, then the response. Both run with the stub models and a local S3.
+# Also checks the events: tokens before the answer of their field, the stages, and the result last.
+# Exits with 1 if the first token takes longer than --max-first-content or the stream is broken.
+#
+# Run from backend/: python -m benchmarks.streaming --audio-duration 60
+
+
+# Reads the SSE text back into (seconds since start, event, data).
+def read_events(chunks, started: float) -> List[Tuple[float, str, dict]]:
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            continue # keep-alive
+        lines = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        events.append((time.perf_counter() - started, lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio-duration", type=float, default=60)
+    parser.add_argument("--infer-step", type=int, default=60)
+    parser.add_argument("--max-first-content", type=float, default=1.0, help="seconds")
+    args = parser.parse_args(argv)
+
+    settings = StubSettings(llm_output_tokens=256) # long enough lyrics to see them stream
+    request = GenerateFromDescriptionRequest(full_described_song=DESCRIPTIONS[0], audio_duration=args.audio_duration, infer_step=args.infer_step)
+
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(settings, s3)
+        started = time.perf_counter()
+        service.run_generate_from_description(request)
+        blocking_seconds = time.perf_counter() - started
+
+        service.llm_cache = LLMResponseCache(disk_dir=None) # the streamed request has to decode its answers too
+        started = time.perf_counter()
+        events = read_events(service.stream_job("generate_from_description", request), started)
+        service.music_batcher.close()
+
+    first_token = next((seconds for seconds, event, _ in events if event == "token"), None)
+    print(f"blocking:  first content after {blocking_seconds:.2f}s (the response)")
+    print(f"streaming: first token after {first_token if first_token is not None else float('nan'):.3f}s, response after {events[-1][0]:.2f}s\n")
+    for seconds, event, data in events:
+        if event == "token":
+            continue
+        summary = {key: value for key, value in data.items() if key in ("field", "stage", "state", "s3_key", "detail")}
+        print(f"{seconds:>7.3f}s  {event:<7} {summary}")
+    tokens = {}
+    for _, event, data in events:
+        if event == "token":
+            tokens[data["field"]] = tokens.get(data["field"], 0) + 1
+    print(f"\ntoken events per field: {tokens}")
+
+    failures = []
+    if first_token is None or first_token > args.max_first_content:
+        failures.append(f"the first token took {first_token}s (allowed: {args.max_first_content}s)")
+    if not events or events[-1][1] != "result":
+        failures.append("the stream does not end with the result")
+    for field in ("tags", "lyrics"):
+        answer_at = next((index for index, (_, event, data) in enumerate(events) if event == "answer" and data["field"] == field), None)
+        token_at = next((index for index, (_, event, data) in enumerate(events) if event == "token" and data["field"] == field), None)
+        if answer_at is None or token_at is None or token_at > answer_at:
+            failures.append(f"no {field} tokens before the {field} answer")
+    stages = {(data["stage"], data["state"]) for _, event, data in events if event == "stage"}
+    for stage in ("audio", "image", "upload"):
+        if (stage, "done") not in stages:
+            failures.append(f"no event for the end of the {stage} stage")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+from dataclasses import dataclass
+import hashlib
+import json
+import threading
+import time
+from types import SimpleNamespace
+from typing import List, Optional
+
+import torch
+
+# --------------------------------------------- Stub Models ---------------------------------------------
+
+# CPU stand-ins for the three models of MusicGenServer, with the same methods/attributes the
+# server uses (see music_service.MusicGenService). They sleep instead of computing, so the
+# orchestration around them (batching, caching, threads, encoding, uploads) can be measured
+# on any machine. Every stub adds up the time it "computed" in `model_seconds`, so the
+# benchmarks can tell the model time apart from our own overhead.
+
+
+# How slow the stubs are, and how big their outputs are.
+@dataclass
+class StubSettings:
+    diffusion_seconds_per_step: float = 0.005 # ACE-Step, for a single song
+    diffusion_batch_cost: float = 0.15 # extra time per extra song in a batch (a GPU batch is almost free)
+    audio_sample_rate: int = 4000 # the real model makes 48kHz stereo, lower it to keep the WAVs small
+    llm_seconds_per_token: float = 0.002
+    llm_output_tokens: int = 64 # tokens per answer (capped by max_new_tokens)
+    image_seconds: float = 0.1 # SDXL-turbo, 2 steps
+    image_bytes: int = 400_000 # about a 512x512 PNG
+    decode_seconds_per_audio_second: float = 0.0 # ACE-Step's latent -> audio decoder (DCAE + vocoder), per second of song
+
+
+# Adds up how long a stub "computed", safe to use from several threads.
+class ModelClock:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.model_seconds = 0.0
+        self.calls = 0
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+        with self._lock:
+            self.model_seconds += seconds
+            self.calls += 1
+
+
+# ------------------------------------------------ ACE-Step ------------------------------------------------
+
+# ACE-Step latents: 44.1kHz audio, 512 samples per mel frame, 8 mel frames per latent frame
+LATENT_FRAMES_PER_SECOND = 44100 / 512 / 8
+
+
+# Stand-in for ACEStepPipeline.music_dcae, the decoder from latents to audio (its own clock, so the
+# diffusion numbers of the pipeline stay the diffusion only).
+class StubDCAE(ModelClock):
+    def __init__(self, settings: StubSettings):
+        super().__init__()
+        self.settings = settings
+
+    def run(self, audio_seconds: float):
+        if self.settings.decode_seconds_per_audio_second > 0:
+            self.sleep(self.settings.decode_seconds_per_audio_second * audio_seconds)
+
+    # Returns (sample rate, [audio of every latent, shape [2, samples]]), like MusicDCAE.decode.
+    def decode(self, latents, audio_lengths=None, sr=None):
+        frames = latents.shape[-1]
+        self.run(latents.shape[0] * frames / LATENT_FRAMES_PER_SECOND)
+        samples = int(frames / LATENT_FRAMES_PER_SECOND * self.settings.audio_sample_rate)
+        return self.settings.audio_sample_rate, [torch.rand(2, samples) * 0.2 - 0.1 for _ in range(latents.shape[0])]
+
+
+# Stand-in for acestep.pipeline_ace_step.ACEStepPipeline.
+class StubACEStepPipeline(ModelClock):
+    def __init__(self, settings: StubSettings):
+        super().__init__()
+        self.settings = settings
+        self.music_dcae = StubDCAE(settings)
+        self.device = torch.device("cpu")
+        self.dtype = torch.float32
+
+    def set_seeds(self, batch_size: int, manual_seeds: Optional[str] = None):
+        seeds = [int(seed) for seed in manual_seeds.split(",")] if manual_seeds else [int(torch.randint(0, 2**31, (1,))) for _ in range(batch_size)]
+        seeds = (seeds * batch_size)[:batch_size]
+        return [torch.Generator().manual_seed(seed) for seed in seeds], seeds
+
+    def get_text_embeddings(self, texts: List[str], device=None):
+        return torch.zeros(len(texts), 8, 16), torch.ones(len(texts), 8, dtype=torch.long)
+
+    def get_text_embeddings_null(self, texts: List[str], device=None):
+        return torch.zeros(len(texts), 8, 16)
+
+    def tokenize_lyrics(self, lyrics: str) -> List[int]:
+        return [len(word) for word in lyrics.split()] or [0]
+
+    def text2music_diffusion_process(self, duration: float, infer_steps: int, random_generators: list, **kwargs):
+        batch_size = len(random_generators)
+        self.sleep(self.settings.diffusion_seconds_per_step * infer_steps * (1 + self.settings.diffusion_batch_cost * (batch_size - 1)))
+        return torch.zeros(batch_size, 8, 16, int(duration * LATENT_FRAMES_PER_SECOND)) # the real latents have this many frames
+
+    def latents2audio(self, latents, target_wav_duration_second: float, save_path: str = None, format: str = "wav"):
+        self.music_dcae.run(latents.shape[0] * target_wav_duration_second)
+        samples = int(target_wav_duration_second * self.settings.audio_sample_rate)
+        for index in range(latents.shape[0]):
+            target_wav = torch.rand(2, samples) * 0.2 - 0.1
+            # MusicGenService swaps this method with its in-memory version
+            self.save_wav_file(target_wav, index, save_path=save_path, sample_rate=self.settings.audio_sample_rate, format=format)
+        return [save_path]
+
+    def save_wav_file(self, target_wav, idx, save_path=None, sample_rate=48000, format="wav"):
+        raise RuntimeError("the stub never writes files, MusicGenService.init_runtime replaces this method")
+
+    # The single song path (ACEStepPipeline.__call__), including the params json it writes next to the song.
+    def __call__(self, prompt: str, lyrics: str, audio_duration: float, infer_step: int, guidance_scale: float, save_path: str, format: str = "wav", manual_seeds: Optional[str] = None, **kwargs):
+        random_generators, seeds = self.set_seeds(1, manual_seeds)
+        latents = self.text2music_diffusion_process(duration=audio_duration, infer_steps=infer_step, random_generators=random_generators)
+        output_paths = self.latents2audio(latents, audio_duration, save_path=save_path, format=format)
+        with open(save_path.replace(f".{format}", "_input_params.json"), "w") as file:
+            json.dump({"prompt": prompt, "lyrics": lyrics, "actual_seeds": seeds}, file)
+        return output_paths
+
+
+# ------------------------------------------------ Qwen ------------------------------------------------
+
+# Words the stub LLM answers with (it answers "word, word, word, ..."), so categories can be parsed as usual.
+STUB_WORDS = ("Pop", "Rock", "Electronic", "Sad", "Happy", "80s", "Chill", "Dance", "Ballad", "Hip-Hop", "Jazz", "Ambient")
+
+
+# Inputs of the stub LLM, like the BatchEncoding the real tokenizer returns.
+class StubEncoding(SimpleNamespace):
+    def to(self, device):
+        return self
+
+
+# Stand-in for the Qwen AutoTokenizer (left padded, like load_model sets it up).
+class StubTokenizer:
+    pad_token_id = 0
+
+    def apply_chat_template(self, messages: list, tokenize: bool = False, add_generation_prompt: bool = True) -> str:
+        text = "".join(f"<|im_start|>{message['role']}\n{message['content']}<|im_end|>\n" for message in messages)
+        return text + ("<|im_start|>assistant\n" if add_generation_prompt else "")
+
+    def encode(self, text: str) -> List[int]:
+        # any stable word -> id mapping will do, ids above len(STUB_WORDS) decode to nothing
+        return [int(hashlib.md5(word.encode()).hexdigest()[:6], 16) % 50_000 + 100 for word in text.split()]
+
+    def __call__(self, texts: List[str], return_tensors: str = "pt", padding: bool = True) -> StubEncoding:
+        tokens = [self.encode(text) for text in texts]
+        longest = max(len(ids) for ids in tokens)
+        input_ids = torch.full((len(texts), longest), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros(len(texts), longest, dtype=torch.long)
+        for row, ids in enumerate(tokens):
+            if ids:
+                input_ids[row, longest - len(ids):] = torch.tensor(ids)
+                attention_mask[row, longest - len(ids):] = 1
+        return StubEncoding(input_ids=input_ids, attention_mask=attention_mask)
+
+    def decode(self, sequence, skip_special_tokens: bool = True) -> str:
+        tokens = sequence.tolist() if hasattr(sequence, "tolist") else sequence
+        return ", ".join(STUB_WORDS[token - 1] for token in tokens if 0 < token <= len(STUB_WORDS))
+
+    def batch_decode(self, sequences, skip_special_tokens: bool = True) -> List[str]:
+        return [self.decode(sequence, skip_special_tokens) for sequence in sequences]
+
+
+# Stand-in for the Qwen AutoModelForCausalLM. The answer only depends on the prompt, like greedy decoding.
+class StubLLM(ModelClock):
+    def __init__(self, settings: StubSettings):
+        super().__init__()
+        self.settings = settings
+        self.device = torch.device("cpu")
+        # Qwen2-Instruct's defaults (it samples)
+        self.generation_config = SimpleNamespace(do_sample=True, temperature=0.7, top_p=0.8, top_k=20, repetition_penalty=1.05)
+
+    # Honors `stopping_criteria` like transformers does: the call ends (and only costs the tokens so far) once every row is done.
+    # A `streamer` gets the prompt, then the new token of every row after each step, in real time.
+    def generate(self, input_ids, attention_mask=None, pad_token_id: int = 0, max_new_tokens: int = 512, stopping_criteria=None, streamer=None, **kwargs):
+        new_tokens = min(max_new_tokens, self.settings.llm_output_tokens)
+        generated = torch.empty(input_ids.shape[0], new_tokens, dtype=torch.long)
+        for row in range(input_ids.shape[0]):
+            seed = int(hashlib.md5(str(input_ids[row].tolist()).encode()).hexdigest()[:8], 16)
+            generated[row] = torch.randint(1, len(STUB_WORDS) + 1, (new_tokens,), generator=torch.Generator().manual_seed(seed))
+
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool)
+        steps = new_tokens
+        if streamer is not None:
+            streamer.put(input_ids)
+        for step in range(new_tokens):
+            generated[done, step] = pad_token_id # finished rows are padded, like transformers does
+            if streamer is not None:
+                self.sleep(self.settings.llm_seconds_per_token)
+                streamer.put(generated[:, step].clone())
+            if stopping_criteria:
+                sequences = torch.cat([input_ids, generated[:, :step + 1]], dim=1)
+                for criteria in stopping_criteria:
+                    done |= criteria(sequences, None)
+                if bool(done.all()):
+                    steps = step + 1
+                    break
+        if streamer is not None:
+            streamer.end()
+        else:
+            self.sleep(self.settings.llm_seconds_per_token * steps)
+        return torch.cat([input_ids, generated[:, :steps]], dim=1)
+
+
+# ------------------------------------------------ SDXL-turbo ------------------------------------------------
+
+class StubImage:
+    def __init__(self, size: int):
+        self.size = size
+
+    def save(self, buffer, format: str = "PNG"):
+        buffer.write(b"\x89PNG\r\n\x1a\n" + bytes(self.size - 8))
+
+
+# Stand-in for the diffusers AutoPipelineForText2Image.
+class StubImagePipeline(ModelClock):
+    def __init__(self, settings: StubSettings):
+        super().__init__()
+        self.settings = settings
+
+    # The images of one call are made in one batch on the GPU, which costs about as much as a single image.
+    def __call__(self, prompt: str, num_inference_steps: int = 2, guidance_scale: float = 0.0, num_images_per_prompt: int = 1, **kwargs):
+        self.sleep(self.settings.image_seconds)
+        return SimpleNamespace(images=[StubImage(self.settings.image_bytes) for _ in range(num_images_per_prompt)])
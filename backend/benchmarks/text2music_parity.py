@@ -0,0 +1,114 @@
+import argparse
+from contextlib import redirect_stdout
+import io
+import os
+import sys
+
+import numpy as np
+
+from batching import AudioRequest
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubImagePipeline, StubLLM, StubSettings, StubTokenizer
+from metrics import Metrics
+from model_loader import ModelLoader
+from music_service import ACE_STEP_VERSION, MusicGenService, supports_text2music_batch
+from storage import create_s3_client
+
+# --------------------------------------------- Batched text2music Parity Check ---------------------------------------------
+
+# MusicGenService.run_text2music_batch copies what ACEStepPipeline.__call__ does for text2music, so a batch can hold
+# DIFFERENT songs. This checks the copy against the real thing, with the real ACE-Step model: one song with a fixed seed
+# through the stock `music_model(...)`, then the same song with the same seed through the batched path, alone and in a
+# batch next to another song (with longer lyrics, so its lyrics get padded). The songs must sound the same (the GPU
+# kernels of a batch are not bit for bit those of a single song, so this compares the waveforms, not the bytes).
+# Exits with 1 if they don't, or if the installed ACE-Step is not ACE_STEP_VERSION.
+# Run it before bumping ACE_STEP_VERSION (and the release main.py installs).
+#
+# Run from backend/: python -m benchmarks.text2music_parity --checkpoint-dir /models
+# Needs ACE-Step (see main.py) and its checkpoint, on a GPU (or a lot of patience on the CPU).
+
+SONG = AudioRequest(
+    prompt="lofi, chill, piano, mellow, 80 bpm",
+    lyrics="[verse]\nRain on the window\nCoffee gone cold\n[chorus]\nStay a little longer",
+    audio_duration=10, infer_step=20, guidance_scale=15.0, seed=1234
+)
+NEIGHBOUR = AudioRequest(
+    prompt="synthwave, driving bass, female vocal, 120 bpm",
+    lyrics="[verse]\nNeon on the highway, engines in the night\nChasing every signal till the morning light\n[chorus]\nWe run, we run, we never look behind",
+    audio_duration=10, infer_step=20, guidance_scale=15.0, seed=99
+)
+
+
+def build_service(checkpoint_dir: str, dtype: str, s3: LocalS3) -> MusicGenService:
+    def load_ace_step():
+        from acestep.pipeline_ace_step import ACEStepPipeline
+
+        music_model = ACEStepPipeline(checkpoint_dir=checkpoint_dir, dtype=dtype, torch_compile=False, cpu_offload=False, overlapped_decode=False)
+        music_model.load_checkpoint(music_model.checkpoint_dir)
+        return music_model
+
+    service = MusicGenService()
+    service.metrics = Metrics(track_gpu_memory=False)
+    service.llm_model_id = "stub-llm"
+    models = ModelLoader(service.metrics)
+    models.register("ace_step", load_ace_step)
+    # only ACE-Step is real here
+    models.register("qwen", lambda: (StubTokenizer(), StubLLM(StubSettings())))
+    models.register("sdxl_turbo", lambda: StubImagePipeline(StubSettings()))
+    service.init_runtime(models, create_s3_client(**s3.client_kwargs), s3.bucket_name, metrics_store={}, llm_prefix_cache=False)
+    models.wait()
+    return service
+
+
+# The samples of one of our in-memory WAVs (audio_encoding.write_wav: 44 byte header, interleaved float32).
+def read_wav(buffer: io.BytesIO) -> np.ndarray:
+    return np.frombuffer(buffer.getvalue()[44:], dtype="<f4")
+
+
+def compare(stock: np.ndarray, batched: np.ndarray) -> dict:
+    lengths = (len(stock), len(batched))
+    stock, batched = stock[:min(lengths)], batched[:min(lengths)]
+    return {
+        "samples": lengths,
+        "max_difference": float(np.abs(stock - batched).max()),
+        "correlation": float(np.corrcoef(stock, batched)[0, 1])
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint-dir", default="/models")
+    parser.add_argument("--dtype", default="bfloat16", help="bfloat16 like the server, float32 on the CPU")
+    parser.add_argument("--min-correlation", type=float, default=0.99, help="how alike the waveforms have to be")
+    args = parser.parse_args()
+
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(args.checkpoint_dir, args.dtype, s3)
+        music_model = service.music_model
+        supported = supports_text2music_batch(music_model)
+
+        service.run_text2music(music_model, SONG, SONG.seed, "/dev/shm/stock.wav")
+        stock = read_wav(service.audio_buffers.pop(("/dev/shm/stock.wav", 0)))
+        os.remove("/dev/shm/stock_input_params.json") # what __call__ writes next to the song
+        service.run_text2music_batch([SONG], [SONG.seed], "/dev/shm/alone.wav")
+        alone = read_wav(service.audio_buffers.pop(("/dev/shm/alone.wav", 0)))
+        service.run_text2music_batch([SONG, NEIGHBOUR], [SONG.seed, NEIGHBOUR.seed], "/dev/shm/pair.wav")
+        paired = read_wav(service.audio_buffers.pop(("/dev/shm/pair.wav", 0)))
+        service.audio_buffers.pop(("/dev/shm/pair.wav", 1))
+        service.music_batcher.close()
+
+    failures = []
+    if not supported:
+        failures.append(f"the installed ACE-Step is not {ACE_STEP_VERSION}, the server would not use the batched path")
+    for name, batched in (("batched, alone", alone), ("batched, next to another song", paired)):
+        result = compare(stock, batched)
+        print(f"{name:30} samples {result['samples']}, max difference {result['max_difference']:.4f}, correlation {result['correlation']:.4f}")
+        if result["samples"][0] != result["samples"][1] or result["correlation"] < args.min_correlation:
+            failures.append(f"the {name} song is not the song of music_model(...) with the same seed")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import io
+import sys
+import threading
+
+from benchmarks.local_s3 import LocalS3
+from storage import MB, create_s3_client, object_exists, upload_buffer
+
+# --------------------------------------------- Failed Upload Cleanup Check ---------------------------------------------
+
+# An upload that fails halfway must not leave unfinished multipart uploads behind (S3 keeps charging for their
+# parts until they are aborted). This uploads a 20 MB buffer (3 parts) to a local S3 and makes part 2 fail:
+# - "part fails": boto3 aborts the multipart upload itself, upload_buffer double-checks
+# - "part and boto3's abort fail": only upload_buffer's own cleanup (abort_incomplete_uploads) is left to do it,
+#   a plain upload_fileobj leaves the multipart upload behind here
+# Each case checks that the error reaches the caller, the buffer is released, no object was created and no
+# multipart upload is left. Exits with 1 if any check fails.
+#
+# Run from backend/: python -m benchmarks.upload_failure
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+# Makes UploadPart #2 fail, and with `fail_abort` also the first AbortMultipartUpload (the one boto3 sends).
+def inject_failures(s3_client, fail_abort: bool):
+    aborts = {"failed": 0}
+    lock = threading.Lock()
+
+    def before_upload_part(params, **kwargs):
+        if params.get("PartNumber") == 2:
+            raise InjectedFailure("UploadPart #2 failed")
+
+    def before_abort(params, **kwargs):
+        with lock:
+            if fail_abort and aborts["failed"] == 0:
+                aborts["failed"] += 1
+                raise InjectedFailure("AbortMultipartUpload failed")
+
+    s3_client.meta.events.register("before-parameter-build.s3.UploadPart", before_upload_part)
+    s3_client.meta.events.register("before-parameter-build.s3.AbortMultipartUpload", before_abort)
+
+
+def check(s3: LocalS3, name: str, s3_key: str, fail_abort: bool) -> list:
+    s3_client = create_s3_client(**s3.client_kwargs)
+    inject_failures(s3_client, fail_abort)
+    buffer = io.BytesIO(bytes(20 * MB))
+
+    failures = []
+    try:
+        upload_buffer(s3_client, buffer, s3.bucket_name, s3_key, "audio/wav")
+        failures.append("the upload did not fail")
+    except Exception as error:
+        print(f"{name}: upload failed as expected ({type(error).__name__}: {error})")
+
+    checker = s3.client() # without the injected failures
+    leftover = [upload for upload in checker.list_multipart_uploads(Bucket=s3.bucket_name).get("Uploads", []) if upload["Key"] == s3_key]
+    if leftover:
+        failures.append(f"{len(leftover)} unfinished multipart upload(s) left behind")
+    if object_exists(checker, s3.bucket_name, s3_key):
+        failures.append("an object was created")
+    if not buffer.closed:
+        failures.append("the buffer was not released")
+    print(f"{name}: unfinished uploads left {len(leftover)}, buffer closed {buffer.closed}")
+    return [f"{name}: {failure}" for failure in failures]
+
+
+def main() -> int:
+    failures = []
+    with LocalS3() as s3:
+        failures += check(s3, "part fails", "failed-upload.wav", fail_abort=False)
+        failures += check(s3, "part and boto3's abort fail", "failed-upload-and-abort.wav", fail_abort=True)
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import io
+import sys
+import time
+
+from benchmarks.harness import DESCRIPTIONS, build_service
+from benchmarks.local_s3 import LocalS3
+from benchmarks.stub_models import StubSettings
+from schemas import GenerateFromDescriptionRequest, GenerateVariationsRequest
+
+# --------------------------------------------- Variations Benchmark ---------------------------------------------
+
+# The cost of N takes of one song description: N separate generate_from_description requests (sent at the same time)
+# against ONE generate_variations request, with the stub models and a local S3.
+# "model seconds" is the time the stub models computed (LLM + diffusion + cover), the GPU time the takes cost.
+# Exits with 1 if a take from the variations endpoint does not cost clearly less than a separate request.
+#
+# Run from backend/: python -m benchmarks.variations --takes 4
+
+
+def count_objects(s3: LocalS3) -> int:
+    return s3.client().list_objects_v2(Bucket=s3.bucket_name).get("KeyCount", 0)
+
+
+def measure(run, settings: StubSettings) -> dict:
+    with LocalS3() as s3, redirect_stdout(io.StringIO()):
+        service = build_service(settings, s3)
+        objects_before = count_objects(s3) # the fake S3 keeps its files between servers of the same process
+        started = time.perf_counter()
+        responses = run(service)
+        seconds = time.perf_counter() - started
+        service.music_batcher.close()
+        models = (service.llm_model, service.music_model, service.image_pipe)
+        return {
+            "seconds": seconds,
+            "model_seconds": sum(model.model_seconds for model in models),
+            "llm_seconds": service.llm_model.model_seconds,
+            "diffusion_runs": service.music_model.calls,
+            "covers": service.image_pipe.calls,
+            "objects": count_objects(s3) - objects_before,
+            "takes": len({response.s3_key for response in responses})
+        }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--takes", type=int, default=4)
+    parser.add_argument("--audio-duration", type=float, default=30)
+    parser.add_argument("--infer-step", type=int, default=60)
+    parser.add_argument("--max-cost", type=float, default=0.6, help="highest allowed cost of a take, relative to a separate request")
+    args = parser.parse_args(argv)
+
+    settings = StubSettings()
+    song = {"full_described_song": DESCRIPTIONS[0], "audio_duration": args.audio_duration, "infer_step": args.infer_step}
+
+    def separate(service):
+        requests = [GenerateFromDescriptionRequest(**song, seed=take) for take in range(args.takes)]
+        with ThreadPoolExecutor(max_workers=args.takes) as users:
+            return list(users.map(service.run_generate_from_description, requests))
+
+    def variations(service):
+        return service.run_generate_variations(GenerateVariationsRequest(**song, seeds=list(range(args.takes))))
+
+    results = {"separate": measure(separate, settings), "variations": measure(variations, settings)}
+
+    print(f"{args.takes} takes of one description\n")
+    print(f"{'':<11} {'wall s':>7} {'model s':>8} {'llm s':>6} {'model s/take':>13} {'diffusion runs':>15} {'covers':>7} {'s3 objects':>11}")
+    for name, result in results.items():
+        print(f"{name:<11} {result['seconds']:>7.2f} {result['model_seconds']:>8.2f} {result['llm_seconds']:>6.2f} "
+              f"{result['model_seconds'] / args.takes:>13.3f} {result['diffusion_runs']:>15} {result['covers']:>7} {result['objects']:>11}")
+    cost = results["variations"]["model_seconds"] / results["separate"]["model_seconds"]
+    print(f"\na take from the variations endpoint costs {cost:.0%} of a separate request")
+
+    failures = []
+    if results["variations"]["takes"] != args.takes:
+        failures.append(f"expected {args.takes} different songs, got {results['variations']['takes']}")
+    if cost > args.max_cost:
+        failures.append(f"a take costs {cost:.0%} of a separate request (allowed: {args.max_cost:.0%})")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
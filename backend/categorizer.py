@@ -0,0 +1,239 @@
+from dataclasses import dataclass
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# --------------------------------------------- Tag Categorizer ---------------------------------------------
+
+# The categories of a song (the `categories` of GenerateMusicResponseS3, saved in the frontend's
+# songCategory table) used to always come from a full LLM generation. When the input is already a
+# comma-separated list of tags ("synthwave, 80s, female vocal, 118 bpm"), most of them name a genre
+# or a mood directly, so a lookup table answers in microseconds instead.
+#
+# Every tag is looked up, in this order:
+# 1. the whole tag in CATEGORY_TAGS (via an inverted index: tag/synonym -> categories)
+# 2. tags that carry no category (bpm, key, vocals, instruments, ...) are skipped, they don't lower the confidence
+# 3. the words (and word pairs) of a short tag, e.g. "melodic techno" -> "techno" -> Electronic
+# 4. optional: the nearest known tag by embedding similarity (see use_embeddings / load_embedder)
+#
+# If too few tags were understood, or too few categories came out, the result is not `confident` and
+# the LLM should categorize instead (see MusicGenService.fast_categories).
+#
+# Example:
+#   categorizer = TagCategorizer()
+#   categorizer.categorize("synthwave, 80s, female vocal, 118 bpm").categories  # ["80s", "Electronic"]
+
+# category -> the tags that mean it (lowercase, written like people write them; spaces, hyphens and case don't matter)
+CATEGORY_TAGS: Dict[str, Tuple[str, ...]] = {
+    # genres
+    "Pop": ("pop", "pop music", "synth pop", "electropop", "dance pop", "indie pop", "dream pop", "teen pop", "power pop",
+            "bubblegum pop", "j-pop", "k-pop", "latin pop", "country pop", "art pop", "bedroom pop", "pop ballad"),
+    "Rock": ("rock", "rock and roll", "rock n roll", "hard rock", "soft rock", "alternative rock", "alt rock", "classic rock",
+             "indie rock", "punk rock", "garage rock", "psychedelic rock", "progressive rock", "prog rock", "grunge",
+             "arena rock", "stadium rock", "blues rock", "folk rock", "post-rock", "rock anthem"),
+    "Metal": ("metal", "heavy metal", "thrash metal", "death metal", "black metal", "metalcore", "nu metal", "doom metal",
+              "power metal", "symphonic metal", "djent"),
+    "Punk": ("punk", "punk rock", "pop punk", "hardcore", "post-punk", "emo", "skate punk"),
+    "Hip-Hop": ("hip hop", "rap", "trap", "boom bap", "drill", "gangsta rap", "conscious rap", "grime", "lofi hip hop",
+                "old school hip hop", "hip hop beat", "rap beat", "mumble rap", "phonk"),
+    "R&B": ("r&b", "rnb", "rhythm and blues", "contemporary r&b", "neo soul", "alternative r&b", "new jack swing"),
+    "Soul": ("soul", "neo soul", "motown", "soulful", "northern soul"),
+    "Funk": ("funk", "funky", "p-funk", "funk rock", "g-funk"),
+    "Disco": ("disco", "nu disco", "italo disco"),
+    "Electronic": ("electronic", "electronica", "edm", "techno", "house", "deep house", "tech house", "progressive house",
+                   "trance", "dubstep", "drum and bass", "dnb", "synthwave", "retrowave", "outrun", "electro", "idm",
+                   "downtempo", "breakbeat", "future bass", "hardstyle", "uk garage", "chiptune", "8-bit", "glitch",
+                   "synth", "synths", "synthesizer", "synthesizers", "electro pop", "vaporwave", "trip hop", "big room"),
+    "Dance": ("dance", "edm", "house", "club", "disco", "dance pop", "eurodance", "four on the floor", "dancefloor",
+              "dance music", "club banger", "reggaeton"),
+    "Jazz": ("jazz", "smooth jazz", "bebop", "swing", "big band", "jazz fusion", "acid jazz", "jazzy", "cool jazz",
+             "bossa nova", "jazz hop", "lounge"),
+    "Blues": ("blues", "delta blues", "blues rock", "chicago blues", "bluesy"),
+    "Classical": ("classical", "orchestral", "orchestra", "symphony", "symphonic", "baroque", "opera", "chamber music",
+                  "string quartet", "neoclassical", "piano sonata", "romantic era"),
+    "Country": ("country", "country pop", "americana", "bluegrass", "honky tonk", "outlaw country", "country rock"),
+    "Folk": ("folk", "indie folk", "folk rock", "singer-songwriter", "acoustic folk", "celtic", "americana", "folk pop"),
+    "Reggae": ("reggae", "dub", "dancehall", "ska", "roots reggae"),
+    "Latin": ("latin", "reggaeton", "salsa", "bachata", "cumbia", "bossa nova", "samba", "latin pop", "tango", "flamenco",
+              "merengue", "latin trap"),
+    "K-Pop": ("k-pop",),
+    "Afrobeats": ("afrobeats", "afrobeat", "amapiano", "afropop", "afro house"),
+    "Lo-Fi": ("lofi", "lofi hip hop", "chillhop", "lofi beat", "bedroom pop"),
+    "Ambient": ("ambient", "drone", "new age", "soundscape", "meditation", "atmospheric", "space ambient", "dark ambient"),
+    "Indie": ("indie", "indie rock", "indie pop", "indie folk", "bedroom pop", "alternative", "shoegaze"),
+    "Soundtrack": ("soundtrack", "cinematic", "film score", "score", "movie soundtrack", "video game", "game music",
+                   "trailer music", "epic orchestral"),
+    "Gospel": ("gospel", "worship", "christian", "spiritual", "hymn"),
+    "Acoustic": ("acoustic", "unplugged", "acoustic guitar", "acoustic ballad", "fingerstyle"),
+    "Ballad": ("ballad", "power ballad", "piano ballad", "acoustic ballad", "pop ballad", "love ballad"),
+    "Experimental": ("experimental", "avant-garde", "noise", "glitch", "art rock"),
+    # moods
+    "Happy": ("happy", "joyful", "cheerful", "uplifting", "feel good", "bright", "positive", "fun", "playful", "upbeat",
+              "sunny", "carefree"),
+    "Sad": ("sad", "melancholic", "melancholy", "sorrowful", "heartbreak", "heartbroken", "somber", "mournful", "tearful",
+            "depressing", "emotional", "bittersweet", "lonely", "grief"),
+    "Chill": ("chill", "chillout", "relaxed", "relaxing", "calm", "mellow", "laid back", "soothing", "peaceful",
+              "easy listening", "smooth", "chillhop", "lounge", "gentle", "soft"),
+    "Energetic": ("energetic", "high energy", "upbeat", "powerful", "intense", "driving", "aggressive", "hype", "fast",
+                  "explosive", "pumping", "anthemic"),
+    "Romantic": ("romantic", "love", "love song", "sensual", "intimate", "tender", "sexy", "passionate", "love ballad"),
+    "Dark": ("dark", "moody", "brooding", "ominous", "sinister", "haunting", "gloomy", "eerie", "menacing", "dark ambient"),
+    "Epic": ("epic", "anthemic", "anthem", "triumphant", "heroic", "grand", "majestic", "epic orchestral", "rock anthem"),
+    "Dreamy": ("dreamy", "ethereal", "dream pop", "shoegaze", "hazy", "floaty"),
+    "Nostalgic": ("nostalgic", "nostalgia", "retro", "vintage", "throwback"),
+    # eras
+    "60s": ("60s", "1960s", "sixties"),
+    "70s": ("70s", "1970s", "seventies"),
+    "80s": ("80s", "1980s", "eighties", "synthwave", "retrowave", "new wave"),
+    "90s": ("90s", "1990s", "nineties", "grunge", "eurodance", "new jack swing"),
+    "2000s": ("2000s", "00s", "y2k"),
+}
+
+# Tags that describe the sound but not a category: they are skipped instead of counting as not understood.
+NEUTRAL_TAG_PATTERNS = (
+    r"\d+(\.\d+)?\s*bpm",
+    r"(very )?(fast|slow|mid|medium|moderate|steady|half|double)([ -]?time|[ -]?tempo)",
+    r"[a-g]( ?(#|b|sharp|flat))? ?(major|minor)( key)?",
+    r"(major|minor)( key| scale)?",
+    r"(\w+ )?(male|female|deep|soft|raspy|breathy|clean|harmonized|layered|lead|backing|falsetto|whispered|spoken|"
+    r"auto-?tuned?|powerful|soulful)? ?(vocals?|voices?|singers?|singing|choir|harmonies|rapper|rapping|vocalist)",
+    r"(\w+ )?(electric|acoustic|bass|rhythm|lead|distorted|clean|grand|upright|electric|heavy|punchy|deep|warm|analog)? ?"
+    r"(guitars?|pianos?|keys|keyboards?|bass|basslines?|drums?|drum machine|percussion|strings|violins?|cellos?|"
+    r"saxophones?|sax|trumpets?|horns?|brass|flutes?|organs?|808s?|kicks?|snares?|hi-?hats?|claps?|pads?|arpeggios?|"
+    r"ukulele|banjo|harmonica|bells|plucks?|riffs?|solos?|breakdown|drops?)",
+    r"(song|music|track|tune|beat|beats|vibes?|instrumental|duet|intro|outro|chorus|verse|hook|"
+    r"catchy|melodic|rhythmic|groovy|groove|minimal|lush|reverb|distortion|studio|live|radio|hit|loop)",
+)
+
+MAX_TAG_WORDS = 4 # longer "tags" are sentences (a free-text description), they are left to the LLM
+
+
+# Spaces, hyphens, dots and case don't matter: "Hip-Hop", "hip hop" and "hiphop" are the same tag.
+def _key(text: str) -> str:
+    return re.sub(r"[^a-z0-9&+#]", "", text.lower())
+
+
+# An inverted index: the key of every tag -> the categories it means, in CATEGORY_TAGS order.
+def build_index(category_tags: Dict[str, Tuple[str, ...]]) -> Dict[str, List[str]]:
+    index: Dict[str, List[str]] = {}
+    for category, tags in category_tags.items():
+        for tag in (category,) + tags:
+            categories = index.setdefault(_key(tag), [])
+            if category not in categories:
+                categories.append(category)
+    return index
+
+
+@dataclass
+class Categorization:
+    categories: List[str]
+    coverage: float # the share of the tags that were understood (matched or neutral)
+    unknown: List[str] # the tags that were not understood
+    confident: bool # good enough to use instead of asking the LLM
+
+
+class TagCategorizer:
+    def __init__(
+        self,
+        category_tags: Dict[str, Tuple[str, ...]] = CATEGORY_TAGS,
+        min_coverage: float = 0.6,
+        min_categories: int = 2,
+        max_categories: int = 5,
+        min_similarity: float = 0.7
+    ):
+        self.index = build_index(category_tags)
+        self.neutral = re.compile("|".join(f"(?:{pattern})" for pattern in NEUTRAL_TAG_PATTERNS))
+        self.min_coverage = min_coverage
+        self.min_categories = min_categories
+        self.max_categories = max_categories
+        self.min_similarity = min_similarity
+        # optional nearest-neighbour fallback, see use_embeddings
+        self.embed: Optional[Callable[[List[str]], Any]] = None
+        self.tag_texts: List[str] = []
+        self.tag_vectors = None
+
+    # Turns on the embedding fallback: unknown tags get the categories of the most similar known tag.
+    # `embed(texts)` returns one L2-normalized vector per text (see load_embedder).
+    def use_embeddings(self, embed: Callable[[List[str]], Any]):
+        tag_texts = sorted({tag for tags in CATEGORY_TAGS.values() for tag in tags} | set(CATEGORY_TAGS))
+        self.tag_vectors = embed(tag_texts)
+        self.tag_texts = tag_texts
+        self.embed = embed
+
+    def categorize(self, tags: str) -> Categorization:
+        parts = [part.strip().strip("\"'.").strip() for part in tags.split(",")]
+        parts = [part for part in parts if part]
+        scores: Dict[str, float] = {} # category -> score (insertion order = first seen)
+        understood = 0
+        unknown = []
+
+        def add(categories: List[str], weight: float):
+            for category in categories:
+                scores[category] = scores.get(category, 0.0) + weight
+
+        for part in parts:
+            words = part.lower().split()
+            if len(words) > MAX_TAG_WORDS:
+                unknown.append(part)
+                continue
+            if _key(part) in self.index:
+                add(self.index[_key(part)], 1.0)
+                understood += 1
+                continue
+            if self.neutral.fullmatch(part.lower()):
+                understood += 1
+                continue
+            # the word pairs and single words of the tag
+            found: List[str] = []
+            for size in (2, 1):
+                for start in range(len(words) - size + 1):
+                    for category in self.index.get(_key(" ".join(words[start:start + size])), ()):
+                        if category not in found:
+                            found.append(category)
+            if found:
+                add(found, 0.5)
+                understood += 1
+            else:
+                unknown.append(part)
+
+        # the tags nothing else understood, by their nearest known tag
+        if unknown and self.embed is not None:
+            for part, (similarity, nearest) in zip(list(unknown), self._nearest([part for part in unknown])):
+                if similarity >= self.min_similarity:
+                    add(self.index[_key(nearest)], 0.5 * similarity)
+                    understood += 1
+                    unknown.remove(part)
+
+        ranked = sorted(scores, key=lambda category: -scores[category])[:self.max_categories] # sorted() keeps the first seen first on ties
+        coverage = understood / len(parts) if parts else 0.0
+        return Categorization(
+            categories=ranked,
+            coverage=coverage,
+            unknown=unknown,
+            confident=len(ranked) >= self.min_categories and coverage >= self.min_coverage
+        )
+
+    # (similarity, nearest known tag) for every text
+    def _nearest(self, texts: List[str]) -> List[Tuple[float, str]]:
+        similarities = self.embed(texts) @ self.tag_vectors.T
+        best, positions = similarities.max(dim=1)
+        return [(float(value), self.tag_texts[int(position)]) for value, position in zip(best, positions)]
+
+
+# A small sentence embedding model on the CPU (e.g. sentence-transformers/all-MiniLM-L6-v2, ~90MB) as `embed` for
+# TagCategorizer.use_embeddings: mean of the token vectors, L2-normalized. Only needs transformers.
+def load_embedder(model_id: str, cache_dir: Optional[str] = None) -> Callable[[List[str]], Any]:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id, cache_dir=cache_dir)
+    model = AutoModel.from_pretrained(model_id, cache_dir=cache_dir).eval()
+
+    def embed(texts: List[str]) -> torch.Tensor:
+        inputs = tokenizer(texts, padding=True, truncation=True, max_length=32, return_tensors="pt")
+        with torch.no_grad():
+            tokens = model(**inputs).last_hidden_state
+        mask = inputs.attention_mask.unsqueeze(-1).to(tokens.dtype)
+        vectors = (tokens * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return torch.nn.functional.normalize(vectors, dim=-1)
+
+    return embed
@@ -0,0 +1,186 @@
+from dataclasses import dataclass, field
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# --------------------------------------------- Decoding Profiles ---------------------------------------------
+
+# Every LLM task has its own decoding profile: how many tokens it may generate, when its answer is
+# complete (a stop string such as a newline, or enough list items), how to sample, and how to parse
+# the answer. Categories need a handful of tokens, tags one line, lyrics a few hundred; the stopping
+# criteria end every answer of a batch as soon as it is complete instead of running to the longest budget.
+#
+# A parser raises ValueError when the answer is unusable. The caller then asks again if the question allows
+# retries, and otherwise uses the question's fallback (see MusicGenService.prompt_qwen_batch). A question
+# without a usable fallback (the lyrics of a vocal song: "[instrumental]" would change what the user asked for)
+# fails the request instead.
+
+
+@dataclass(frozen=True)
+class DecodingProfile:
+    name: str
+    max_new_tokens: int
+    stop_strings: Tuple[str, ...] = () # the answer is complete once one of these appears (after some text)
+    max_items: Optional[int] = None # for comma-separated lists: complete once this many items are written
+    do_sample: Optional[bool] = None # None = the model's default (Qwen samples)
+    temperature: Optional[float] = None # None = the model's default
+    top_p: Optional[float] = None
+    repetition_penalty: Optional[float] = None
+    parse: Callable[[str], Any] = field(default=lambda text: text.strip(), compare=False)
+
+    # The generate() settings of this profile on top of the model's defaults (its generation_config).
+    # They are also part of the LLM cache key.
+    def decoding(self, defaults) -> dict:
+        do_sample = bool(defaults.do_sample) if self.do_sample is None else self.do_sample
+        settings = {
+            "profile": self.name,
+            "max_new_tokens": self.max_new_tokens,
+            "stop_strings": list(self.stop_strings),
+            "max_items": self.max_items,
+            "do_sample": do_sample,
+            "repetition_penalty": self.repetition_penalty if self.repetition_penalty is not None else defaults.repetition_penalty
+        }
+        if do_sample:
+            settings["temperature"] = self.temperature if self.temperature is not None else defaults.temperature
+            settings["top_p"] = self.top_p if self.top_p is not None else defaults.top_p
+            settings["top_k"] = defaults.top_k
+        return settings
+
+    # Is this (partial) answer structurally complete?
+    def is_complete(self, text: str) -> bool:
+        text = text.lstrip()
+        if any(stop in text for stop in self.stop_strings):
+            return True
+        return self.max_items is not None and text.count(",") >= self.max_items
+
+
+# One question for the LLM: the prompt, its profile, and what to do if the answer can't be parsed.
+@dataclass
+class LLMQuestion:
+    text: str
+    profile: DecodingProfile
+    fallback: Any = None
+    retries: int = 0 # how many times to ask again before giving up
+    required: bool = False # giving up fails the request, instead of using the fallback
+
+# ------------------------------------------------ Parsers ------------------------------------------------
+
+def _first_line(text: str) -> str:
+    return next((line for line in text.strip().splitlines() if line.strip()), "")
+
+
+# "1. Pop, **Rock**, pop, 'Sad'." -> ["Pop", "Rock", "Sad"]
+def _split_list(line: str) -> List[str]:
+    items, seen = [], set()
+    for item in line.split(","):
+        item = re.sub(r"^\s*(\d+[.)]|[-*•])\s*", "", item) # list numbering / bullets
+        item = item.strip().strip("\"'*`.").strip()
+        if item and item.lower() not in seen:
+            seen.add(item.lower())
+            items.append(item)
+    return items
+
+
+# Tags for ACE-Step: one line of comma-separated tags.
+def parse_tags(text: str) -> str:
+    line = re.sub(r"^\s*(formatted\s+)?tags\s*:\s*", "", _first_line(text), flags=re.IGNORECASE)
+    tags = _split_list(line)
+    if not tags:
+        raise ValueError(f"no tags in the answer: {text!r}")
+    return ", ".join(tags)
+
+
+# 3-5 categories, e.g. ["Pop", "Electronic", "Sad"]
+def parse_categories(text: str) -> List[str]:
+    line = re.sub(r"^\s*(categories|genres)\s*:\s*", "", _first_line(text), flags=re.IGNORECASE)
+    categories = _split_list(line)[:5]
+    if not categories:
+        raise ValueError(f"no categories in the answer: {text!r}")
+    return categories
+
+
+# Lyrics structured with [verse]/[chorus]/... tags (ACE-Step needs them to place the sections).
+def parse_lyrics(text: str) -> str:
+    lyrics = re.sub(r"^\s*lyrics\s*:\s*", "", text.strip(), flags=re.IGNORECASE).strip()
+    if not lyrics:
+        raise ValueError("empty lyrics")
+    if not re.search(r"\[[a-z][a-z -]*\]", lyrics, flags=re.IGNORECASE):
+        lyrics = "[verse]\n" + lyrics
+    return lyrics
+
+# ------------------------------------------------ Profiles ------------------------------------------------
+
+# Tags and categories decode greedily: structured output, and the same question always gets the same (cacheable) answer.
+TAGS = DecodingProfile("tags", max_new_tokens=96, stop_strings=("\n",), do_sample=False, parse=parse_tags)
+CATEGORIES = DecodingProfile("categories", max_new_tokens=32, stop_strings=("\n",), max_items=5, do_sample=False, parse=parse_categories)
+# Lyrics keep the model's sampling, so the same description can give different songs.
+LYRICS = DecodingProfile("lyrics", max_new_tokens=512, parse=parse_lyrics)
+
+# ------------------------------------------------ generate() helpers ------------------------------------------------
+
+# Splits the rows of a batch into as few generate() calls as possible.
+# Rows can share a call when they use the same repetition penalty and, if they sample, the same sampling settings.
+# Greedy rows can join a sampling call: GreedyRowsProcessor makes them pick the best token anyway.
+# Returns [(row indices, generate() settings of the call)].
+def group_rows(decodings: List[dict]) -> List[Tuple[List[int], dict]]:
+    groups: List[Dict[str, Any]] = []
+    for index, decoding in enumerate(decodings):
+        sampling = {key: decoding[key] for key in ("temperature", "top_p", "top_k")} if decoding["do_sample"] else None
+        for group in groups:
+            if group["repetition_penalty"] != decoding["repetition_penalty"]:
+                continue
+            if sampling is not None and group["sampling"] not in (None, sampling):
+                continue
+            break
+        else:
+            group = {"repetition_penalty": decoding["repetition_penalty"], "sampling": None, "rows": []}
+            groups.append(group)
+        if sampling is not None:
+            group["sampling"] = sampling
+        group["rows"].append(index)
+
+    calls = []
+    for group in groups:
+        settings = {
+            "max_new_tokens": max(decodings[index]["max_new_tokens"] for index in group["rows"]),
+            "repetition_penalty": group["repetition_penalty"],
+            "do_sample": group["sampling"] is not None,
+            **(group["sampling"] or {})
+        }
+        calls.append((group["rows"], settings))
+    return calls
+
+
+# Stopping criteria for generate(): ends every row once its own profile says the answer is complete
+# (or its own token budget is used up). generate() pads finished rows until the whole batch is done.
+class ProfileStoppingCriteria:
+    def __init__(self, tokenizer, prompt_length: int, profiles: List[DecodingProfile]):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.profiles = profiles
+        self._done = [False] * len(profiles)
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        import torch
+
+        generated = input_ids[:, self.prompt_length:]
+        for row, profile in enumerate(self.profiles):
+            if self._done[row]:
+                continue
+            if generated.shape[1] >= profile.max_new_tokens:
+                self._done[row] = True
+            elif profile.stop_strings or profile.max_items:
+                text = self.tokenizer.decode(generated[row], skip_special_tokens=True)
+                self._done[row] = profile.is_complete(text)
+        return torch.tensor(self._done, dtype=torch.bool, device=input_ids.device)
+
+
+# Logits processor for generate(): in a sampling call, makes the greedy rows pick their best token.
+class GreedyRowsProcessor:
+    def __init__(self, rows: List[int]):
+        self.rows = rows
+
+    def __call__(self, input_ids, scores):
+        rows = scores[self.rows]
+        best = rows.argmax(dim=-1, keepdim=True)
+        scores[self.rows] = rows.new_full(rows.shape, float("-inf")).scatter(1, best, 0.0)
+        return scores
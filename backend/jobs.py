@@ -0,0 +1,191 @@
+import queue # The in-memory queue used as a local stand-in for the Modal queue.
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+# --------------------------------------------- Background Jobs ---------------------------------------------
+
+# A song takes minutes to make, so instead of keeping one HTTP request open the whole time:
+# 1. submit: the job is saved in the job store, put on the job queue, and its id is returned right away
+# 2. a worker takes the job from the queue and runs it, reporting the progress of every stage
+# 3. status/result: the caller polls the job store with the job id until the song is ready
+#
+# While a job runs, its worker writes a heartbeat into the job every HEARTBEAT_SECONDS. A container that dies or
+# is preempted stops writing it: once the heartbeat is older than STALE_AFTER_SECONDS, reading the job marks it
+# failed, so the caller stops polling a job that nobody works on anymore (it can submit it again).
+#
+# The store and the queue are passed in, so the same code works with:
+# - modal.Dict + modal.Queue in the cloud (shared by every container)
+# - a plain dict + queue.Queue locally (see in_memory_job_manager)
+
+# The stages every job goes through, reported by the status endpoint.
+JOB_STAGES = ("llm", "audio", "image", "upload")
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Stage states
+PENDING = "pending"
+DONE = "done"
+
+HEARTBEAT_SECONDS = 30.0 # how often a worker tells the store it is still running its job
+STALE_AFTER_SECONDS = 4 * HEARTBEAT_SECONDS # a running job without a heartbeat for this long has lost its worker
+
+
+# Saves job records in any dict-like storage (a plain dict, or a modal.Dict).
+class DictJobStore:
+    def __init__(self, storage=None):
+        self._storage = storage if storage is not None else {}
+        self._lock = threading.Lock() # only protects this container, every job is updated by a single worker anyway
+
+    def create(self, job: Dict[str, Any]):
+        self._storage[job["job_id"]] = job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._storage.get(job_id)
+
+    # Changes some fields of a job and returns the updated job.
+    def update(self, job_id: str, **fields) -> Dict[str, Any]:
+        with self._lock:
+            job = dict(self._storage[job_id])
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._storage[job_id] = job
+            return job
+
+    # Changes the state of a single stage of a job.
+    def update_stage(self, job_id: str, stage: str, state: str):
+        with self._lock:
+            job = dict(self._storage[job_id])
+            job["stages"] = {**job["stages"], stage: state}
+            job["updated_at"] = time.time()
+            self._storage[job_id] = job
+
+
+# Submits jobs and runs them.
+class JobManager:
+    def __init__(self, store: DictJobStore, job_queue, heartbeat_seconds: float = HEARTBEAT_SECONDS, stale_after_seconds: float = STALE_AFTER_SECONDS):
+        self.store = store
+        self.queue = job_queue # anything with put(item) and get(block, timeout): queue.Queue or modal.Queue
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_after_seconds = stale_after_seconds
+
+    # Saves a new job, puts it on the queue and returns its id.
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self.store.create({
+            "job_id": job_id,
+            "kind": kind, # which generation to run, e.g. "generate_from_description"
+            "payload": payload, # the request body of that generation
+            "status": QUEUED,
+            "stages": {stage: PENDING for stage in JOB_STAGES},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None, # when a worker took the job
+            "heartbeat_at": None # the last sign of life of that worker
+        })
+        self.queue.put(job_id)
+        return job_id
+
+    # Returns the job, after marking it failed if it is running without a heartbeat (its worker is gone).
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        if job is not None and job["status"] == RUNNING:
+            last_seen = job.get("heartbeat_at") or job["updated_at"]
+            if time.time() - last_seen > self.stale_after_seconds:
+                job = self.store.update(job_id, status=FAILED, error=f"the worker stopped responding {time.time() - last_seen:.0f}s ago (e.g. its container was preempted), submit the job again")
+        return job
+
+    # Takes the next job from the queue and runs it with `handler(kind, payload, progress)`.
+    # `progress(stage, state)` lets the handler report its stages, whatever it returns is saved as the result.
+    # Returns the id of the job that was run, or None if the queue stayed empty for `timeout` seconds.
+    def run_next(self, handler: Callable[[str, Dict[str, Any], Callable[[str, str], None]], Any], timeout: Optional[float] = None) -> Optional[str]:
+        try:
+            job_id = self.queue.get(block=True, timeout=timeout)
+        except queue.Empty:
+            return None
+        if job_id is None: # modal.Queue returns None when the timeout runs out
+            return None
+
+        now = time.time()
+        job = self.store.update(job_id, status=RUNNING, started_at=now, heartbeat_at=now)
+
+        def progress(stage: str, state: str):
+            if stage in JOB_STAGES:
+                self.store.update_stage(job_id, stage, state)
+
+        # the heartbeat, until the job is done
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.heartbeat_seconds):
+                try:
+                    self.store.update(job_id, heartbeat_at=time.time())
+                except Exception as error:
+                    print(f"heartbeat of job {job_id} failed: {error}")
+
+        beating = threading.Thread(target=heartbeat, name=f"job-heartbeat-{job_id}", daemon=True)
+        beating.start()
+        try:
+            result = handler(job["kind"], job["payload"], progress)
+        except Exception as error:
+            traceback.print_exc()
+            outcome = {"status": FAILED, "error": f"{type(error).__name__}: {error}"}
+        else:
+            outcome = {"status": SUCCEEDED, "result": result}
+        finally:
+            stop.set()
+            beating.join()
+        self.store.update(job_id, **outcome)
+        return job_id
+
+
+# A job manager that keeps everything in this process, for local runs and benchmarks (see benchmarks/jobs.py).
+def in_memory_job_manager(**kwargs) -> JobManager:
+    return JobManager(DictJobStore({}), queue.Queue(), **kwargs)
+
+
+# --------------------------------------------- Stage Progress ---------------------------------------------
+
+# Turns the events of the pipeline stages (see pipeline_executor.PipelinedExecutor) into job stage progress.
+# Several pipeline stages can belong to one job stage (e.g. the audio and the image upload both belong
+# to "upload"): the job stage is only done once all of them are done.
+class StageTracker:
+    def __init__(self, report: Callable[[str, str], None], job_stage_of: Dict[str, str]):
+        self._report = report
+        self._job_stage_of = job_stage_of # pipeline stage name -> job stage name
+        self._states: Dict[str, str] = {} # pipeline stage name -> its latest state
+        self._reported: Dict[str, str] = {} # job stage name -> the state that was last reported
+        self._lock = threading.Lock()
+
+    # Listener for PipelinedExecutor: called with ("audio", "running"), ("audio", "done"), ...
+    def __call__(self, pipeline_stage: str, state: str):
+        job_stage = self._job_stage_of.get(pipeline_stage)
+        if job_stage is None:
+            return
+        with self._lock:
+            self._states[pipeline_stage] = state
+            parts = [
+                self._states[name] for name, stage in self._job_stage_of.items()
+                if stage == job_stage and name in self._states
+            ]
+            if FAILED in parts:
+                combined = FAILED
+            elif all(part == DONE for part in parts):
+                combined = DONE
+            elif any(part in (RUNNING, DONE) for part in parts):
+                combined = RUNNING
+            else:
+                combined = PENDING
+            if self._reported.get(job_stage) == combined:
+                return
+            self._reported[job_stage] = combined
+        self._report(job_stage, combined)
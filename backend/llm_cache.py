@@ -0,0 +1,171 @@
+from collections import OrderedDict # A dict that remembers order, used as the LRU (least recently used) list.
+import hashlib # Makes the cache keys (a fingerprint of the prompt + settings).
+import json
+import os
+import threading
+from typing import Optional
+
+# --------------------------------------------- LLM Response Cache ---------------------------------------------
+
+# Remembers the answers of the LLM so the exact same question (same rendered prompt AND same decoding
+# settings) does not run the 7B model again, e.g. on Inngest retries or when a user submits the same song twice.
+#
+# Two tiers:
+# - memory: the newest `max_entries` answers of this container (fastest)
+# - disk (optional): json files in `disk_dir`, e.g. on the persisted qwen-hf-cache volume,
+#   so answers survive container restarts. The oldest files are deleted once the folder
+#   grows above `max_disk_bytes`.
+#
+# Whether an answer may be cached is decided by the decoding settings: greedy decoding always gives
+# the same answer, so it is always cached. A sampled answer is only one of many possible answers, so it is
+# not cached by default: the key is the prompt text alone, and every user who types the same description
+# (also with seed=-1, "give me something new") would get the same lyrics forever. `cache_sampled` turns it on anyway.
+class LLMResponseCache:
+    def __init__(self, max_entries: int = 1024, disk_dir: Optional[str] = None, max_disk_bytes: int = 256 * 1024 * 1024, cache_sampled: bool = False):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_sampled = cache_sampled
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "uncacheable": 0, "evictions": 0}
+
+        # how many bytes the disk tier currently uses
+        self._disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    # The cache key: a sha256 of everything that changes the answer.
+    def make_key(self, model_id: str, rendered_prompt: str, decoding: dict) -> str:
+        payload = json.dumps({"model": model_id, "prompt": rendered_prompt, "decoding": decoding}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Greedy decoding (or a temperature of 0) is deterministic, sampling is not.
+    def is_cacheable(self, decoding: dict) -> bool:
+        sampled = decoding.get("do_sample", False) and decoding.get("temperature", 1.0) > 0
+        return self.cache_sampled or not sampled
+
+    # Returns the remembered answer, or None if this question was never answered before.
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key) # mark it as the most recently used
+                self._stats["memory_hits"] += 1
+                return self._memory[key]
+
+        answer = self._read_disk(key)
+        with self._lock:
+            if answer is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, answer)
+            return answer
+
+    # Stores an answer in both tiers.
+    def put(self, key: str, answer: str):
+        with self._lock:
+            self._remember(key, answer)
+        self._write_disk(key, answer)
+
+    # Counts an answer that could not be cached because of its decoding settings.
+    def record_uncacheable(self, count: int = 1):
+        with self._lock:
+            self._stats["uncacheable"] += count
+
+    # hit/miss counters plus the current size of each tier
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes
+            }
+
+    # ------------------------------------------------ Internals ------------------------------------------------
+
+    # must be called while holding self._lock
+    def _remember(self, key: str, answer: str):
+        self._memory[key] = answer
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False) # drop the least recently used answer
+            self._stats["evictions"] += 1
+
+    # answers are spread over 256 sub folders (by the first 2 characters of the key) to keep folders small
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                answer = json.load(f)["answer"]
+            os.utime(path) # refresh its time, so eviction sees it as recently used
+            return answer
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key: str, answer: str):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first, then rename, so a reader never sees half a file
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"answer": answer}, f)
+            size = os.path.getsize(temp_path)
+            with self._lock:
+                # the same key can be written again (e.g. two requests missed it at once): count only the difference
+                try:
+                    replaced = os.path.getsize(path)
+                except OSError:
+                    replaced = 0
+                os.replace(temp_path, path)
+                self._disk_bytes += size - replaced
+                over_limit = self._disk_bytes > self.max_disk_bytes
+            if over_limit:
+                self._evict_disk()
+        except OSError as error:
+            # the disk tier is only an extra, never fail the request because of it
+            print(f"could not write llm cache entry {key}: {error}")
+
+    # (path, size, last used time) of every cached answer on disk
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                yield path, info.st_size, info.st_mtime
+
+    # deletes the least recently used files until the disk tier is back under 90% of its limit
+    def _evict_disk(self):
+        files = sorted(self._disk_files(), key=lambda file: file[2])
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_disk_bytes * 0.9)
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self._stats["evictions"] += 1
+        with self._lock:
+            self._disk_bytes = total
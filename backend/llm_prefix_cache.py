@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional, Tuple
+
+# --------------------------------------------- Prefix KV Cache ---------------------------------------------
+
+# The prompt templates (prompts.py) start with a long fixed block of instructions, and only the end
+# changes between requests. Before generating, the LLM runs over the whole prompt ("prefill") and keeps
+# what it computed for every token (the KV cache). This computes the KV cache of every fixed block
+# ONCE per container, so a request only has to prefill its own part.
+#
+# Several questions still go to the model as one batch (see MusicGenService.prompt_qwen_batch), every row
+# laid out as  [pad | cached prefix | pad | own tokens]:  the cached prefixes are stacked into one KV cache,
+# padded on the left to the longest one, and the attention mask hides every pad. The model counts
+# positions from the attention mask, so each row sees exactly what it would have seen without padding.
+# A row whose text has no cached prefix gets an all-padding prefix and is prefilled completely.
+#
+# Example:
+#   prefix_cache = PrefixKVCache(tokenizer, llm_model)
+#   prefix_cache.add("lyrics", rendered_lyrics_instructions)
+#   input_ids, attention_mask, past_key_values, cached_tokens = prefix_cache.build_inputs(texts)
+#   llm_model.generate(input_ids, attention_mask=attention_mask, past_key_values=past_key_values, ...)
+
+
+class PrefixKVCache:
+    def __init__(self, tokenizer, model):
+        self.tokenizer = tokenizer
+        self.model = model
+        # name -> (prefix text, its token ids, [(keys, values) of every layer])
+        self.prefixes: Dict[str, Tuple[str, List[int], list]] = {}
+
+    # Runs the model over `text` once and keeps its KV cache. Texts that start with `text` will reuse it.
+    def add(self, name: str, text: str):
+        import torch
+        from transformers import DynamicCache
+
+        ids = self.tokenizer(text, add_special_tokens=False).input_ids
+        with torch.no_grad():
+            output = self.model(
+                input_ids=torch.tensor([ids], device=self.model.device),
+                past_key_values=DynamicCache(),
+                use_cache=True
+            )
+        self.prefixes[name] = (text, ids, _cache_layers(output.past_key_values))
+
+    def cached_tokens(self) -> Dict[str, int]:
+        return {name: len(ids) for name, (_, ids, _) in self.prefixes.items()}
+
+    # The longest cached prefix `text` starts with, or None.
+    def match(self, text: str) -> Optional[str]:
+        best = None
+        for name, (prefix, _, _) in self.prefixes.items():
+            if text.startswith(prefix) and (best is None or len(prefix) > len(self.prefixes[best][0])):
+                best = name
+        return best
+
+    # Tokenizes a batch of texts and returns (input_ids, attention_mask, past_key_values, number of cached tokens).
+    # past_key_values is None when no text starts with a cached prefix (then it is the usual left padded batch).
+    def build_inputs(self, texts: List[str]):
+        import torch
+        from transformers import DynamicCache
+
+        # Split the tokens of every text into its cached prefix and the rest. A text only uses a cached prefix
+        # if its own tokens start with exactly the prefix's tokens (a word can be tokenized differently where
+        # the prefix ends), and if at least one token is left for the model to run over.
+        matches: List[Optional[str]] = []
+        prefix_ids: List[List[int]] = []
+        suffix_ids: List[List[int]] = []
+        for text in texts:
+            ids = self.tokenizer(text, add_special_tokens=False).input_ids
+            name = self.match(text)
+            cached = self.prefixes[name][1] if name else []
+            if not cached or len(ids) <= len(cached) or ids[:len(cached)] != cached:
+                name, cached = None, []
+            matches.append(name)
+            prefix_ids.append(cached)
+            suffix_ids.append(ids[len(cached):])
+
+        if all(name is None for name in matches):
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
+            return inputs.input_ids.to(self.model.device), inputs.attention_mask.to(self.model.device), None, 0
+
+        pad = self.tokenizer.pad_token_id
+        prefix_length = max(len(ids) for ids in prefix_ids)
+        suffix_length = max(len(ids) for ids in suffix_ids)
+        rows, masks = [], []
+        for prefix, suffix in zip(prefix_ids, suffix_ids):
+            prefix_pad, suffix_pad = prefix_length - len(prefix), suffix_length - len(suffix)
+            rows.append([pad] * prefix_pad + prefix + [pad] * suffix_pad + suffix)
+            masks.append([0] * prefix_pad + [1] * len(prefix) + [0] * suffix_pad + [1] * len(suffix))
+
+        # stack the cached prefixes of the rows into one cache, left padded with zeros (hidden by the mask)
+        cache = DynamicCache()
+        reference = next(self.prefixes[name][2] for name in matches if name)
+        for layer, (reference_keys, reference_values) in enumerate(reference):
+            keys, values = [], []
+            for name in matches:
+                if name:
+                    layer_keys, layer_values = self.prefixes[name][2][layer]
+                else:
+                    layer_keys, layer_values = reference_keys[:, :, :0], reference_values[:, :, :0]
+                padding = prefix_length - layer_keys.shape[2]
+                keys.append(torch.nn.functional.pad(layer_keys, (0, 0, padding, 0)))
+                values.append(torch.nn.functional.pad(layer_values, (0, 0, padding, 0)))
+            cache.update(torch.cat(keys), torch.cat(values), layer)
+
+        device = self.model.device
+        input_ids = torch.tensor(rows, dtype=torch.long, device=device)
+        attention_mask = torch.tensor(masks, dtype=torch.long, device=device)
+        cached = sum(len(ids) for ids in prefix_ids)
+        return input_ids, attention_mask, cache, cached
+
+
+# [(keys, values) of every layer] of a transformers cache, each of shape [batch, kv heads, tokens, head dim].
+# Older transformers versions keep them in key_cache/value_cache lists, newer ones in `layers`.
+def _cache_layers(cache) -> list:
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+# The chat-formatted text a prompt template starts with: everything the model sees before the user's part.
+# `instructions` is the fixed block of the template (e.g. prompts.LYRICS_GENERATOR_INSTRUCTIONS).
+def render_prefix(tokenizer, instructions: str) -> str:
+    marker = "\x00" # stands for the user's part
+    rendered = tokenizer.apply_chat_template(
+        [{"role": "user", "content": instructions + marker}],
+        tokenize=False,
+        add_generation_prompt=True
+    )
+    return rendered[:rendered.index(marker)]
@@ -1,14 +1,31 @@
 import base64 # Used for encoding/decoding binary data (like audio) to/from text.
-from typing import List
-import uuid # Generates unique IDs, useful for unique filenames.
+from typing import Callable, List
 import modal
 import os # Helps interact with the operating system, like creating folders or deleting files.
-import boto3
 
-from pydantic import BaseModel # Used to define data structures for API requests/responses.
-import requests
+from pydantic import ValidationError
+import requests # Used to make HTTP requests, like calling our cloud endpoint.
+import uuid # Names the segment streams of progressive jobs.
 
-from prompts import LYRICS_GENERATOR_PROMPT, PROMPT_GENERATOR_PROMPT # Used to make HTTP requests, like calling our cloud endpoint.
+from jobs import DictJobStore, JobManager # Background jobs: submit now, poll for the result later.
+from metrics import Metrics, live_snapshots, merge_snapshots, to_prometheus # Stage timings and histograms.
+from model_loader import ModelLoader # Loads the models on background threads.
+from admission import BACKGROUND, INTERACTIVE, Overloaded # Load-aware admission control of the requests.
+from music_service import ACE_STEP_VERSION, MAX_ACCEPTED_REQUESTS, MAX_CONCURRENT_REQUESTS, S3_POOL_CONNECTIONS, MusicGenService # What the server does with its models (no Modal in there).
+from progressive import manifest_key # Where the segments of a progressive song are listed.
+from schemas import ( # Data structures of the API requests/responses.
+    JOB_REQUEST_MODELS,
+    GenerateFromDescriptionRequest,
+    GenerateMusicResponse,
+    GenerateMusicResponseS3,
+    GenerateVariationsRequest,
+    GenerateWithCustomLyricsRequest,
+    GenerateWithDescribedLyricsRequest,
+    JobStatusResponse,
+    SubmitJobRequest,
+    SubmitJobResponse,
+)
+from storage import create_s3_client # S3 client shared by all requests.
 
 # --------------------------------------------- Modal App Setup ---------------------------------------------
 
@@ -18,32 +35,49 @@ app = modal.App("music-generator")
 
 # --------------------------------------------- Cloud Environment (Docker Image) Setup ---------------------------------------------
 
+# Our own python files next to main.py that the cloud containers need.
+local_modules = ("prompts", "pipeline_executor", "storage", "llm_cache", "jobs", "batching", "audio_encoding", "metrics", "schemas", "music_service", "model_loader", "llm_prefix_cache", "decoding_profiles", "categorizer", "result_index", "progressive", "streaming", "admission")
+
 # We're building a custom virtual computer image for our code.
 # It starts with a basic, lightweight Linux (Debian) OS.
 image = (
     modal.Image.debian_slim()
-    .apt_install("git") 
+    .apt_install("git", "ffmpeg") 
     # Install 'git' on our virtual computer. Needed to download code
+    # and 'ffmpeg', used to encode the songs to flac/opus/mp3
     
     .pip_install_from_requirements("requirements.txt")
      # Install all Python libraries listed in the 'requirements.txt' file.
     # These are the tools the Python code needs to run.
     
-    .run_commands(["git clone https://github.com/ace-step/ACE-Step.git /tmp/ACE-Step", "cd /tmp/ACE-Step && pip install ."]) 
+    .run_commands([
+        "git clone https://github.com/ace-step/ACE-Step.git /tmp/ACE-Step",
+        "cd /tmp/ACE-Step && pip install .",
+        f"python -c \"import importlib.metadata as m; v = m.version('ace-step'); assert v == '{ACE_STEP_VERSION}', 'ACE-Step ' + v + ' is not {ACE_STEP_VERSION}'\""
+    ])
     # Run commands *inside* the virtual computer during setup:
     # 1. Download the ACE-Step AI code from GitHub into a temporary folder.
     # 2. Go into that folder and install its specific Python requirements.
+    # 3. Refuse to build with any other release than ACE_STEP_VERSION, the one the batched diffusion of
+    #    music_service.run_text2music_batch copies (run benchmarks/text2music_parity.py before bumping it).
     
     .env({"HF_HOME": "/.cache/huggingFace"})
     # Set an environment variable. This tells Hugging Face (a common AI library)
     # to store downloaded models in a specific cache location.
     # This helps avoid re-downloading large models every time.
     
-    .add_local_python_source("prompts")
-    # Copy your local 'prompts' folder into the cloud environment.
+    .add_local_python_source(*local_modules)
+    # Copy our local python files (like 'prompts') into the cloud environment.
     # Your AI will use these prompts to guide music generation.
 )
 
+# A small image without the AI libraries, for the job endpoints that only talk to the job store (no GPU needed).
+api_image = (
+    modal.Image.debian_slim()
+    .pip_install("fastapi[standard]", "pydantic", "boto3", "requests")
+    .add_local_python_source(*local_modules)
+)
+
 # --------------------------------------------- Persistent Storage (Volumes) ---------------------------------------------
 
 model_volume = modal.Volume.from_name("ace-step-models", create_if_missing=True)
@@ -55,53 +89,28 @@ hf_volume = modal.Volume.from_name("qwen-hf-cache", create_if_missing=True)
 # Create another storage area for Hugging Face's cache.
 # This prevents re-downloading of models used by the LLM.
 
-# --------------------------------------------- Secure Information (Secrets) ---------------------------------------------
-
-music_gen_secrets = modal.Secret.from_name("music-gen-secret")
-# Get a "secret" named "music-gen-secret" from Modal dashboard.
-# Secrets store sensitive info (like API keys) securely, so they aren't exposed directly in your code.
-
-# --------------------------------------------- Music Generation Server Class (Runs in Cloud) ---------------------------------------------
-
-# Base configuration options for audio generation.
-class AudioGenerationBase(BaseModel):
-    audio_duration: float = 180.0
-    seed: int = -1
-    guidance_scale: float = 15.0
-    infer_step: int = 60
-    instrumental: bool = False
-    
-# Request model for generating music from a user-provided song description.
-class GenerateFromDescriptionRequest(AudioGenerationBase):
-    full_described_song: str # generates lyrics from the given song description by user
-    
-# Request model for generating music with custom lyrics provided directly by the user.
-class GenerateWithCustomLyricsRequest(AudioGenerationBase):
-    prompt: str
-    lyrics: str # passed lyrics by the user
-    
-# Request model for generating music with user-defined style and LLM-generated lyrics.
-class GenerateWithDescribedLyricsRequest(AudioGenerationBase):
-    prompt: str
-    described_lyrics: str # lyrics coming from LLM
-    
-
+job_dict = modal.Dict.from_name("music-gen-jobs", create_if_missing=True)
+# Shared key-value storage where every background job (its status, stage progress and result) is saved.
 
+job_queue = modal.Queue.from_name("music-gen-job-queue", create_if_missing=True)
+# Shared queue of job ids waiting to be run by a MusicGenServer container.
 
+job_manager = JobManager(DictJobStore(job_dict), job_queue)
+# Submits and runs the background jobs (see jobs.py).
 
-# Defines the expected structure of the response when music generation is integrated with S3 for storage.
-class GenerateMusicResponseS3(BaseModel):
-    s3_key: str # The key (path) to the generated audio file in the S3 bucket.
-    cover_image_s3_key: str # The key (path) to the generated cover image in the S3 bucket.
-    categories: List[str] # A list of categories/tags describing the generated music.
-
-# Defines the expected structure of the response when audio data is returned directly (base64 encoded).
-class GenerateMusicResponse(BaseModel):
-    audio_data: str # The generated audio, encoded as a base64 string.
+metrics_dict = modal.Dict.from_name("music-gen-metrics", create_if_missing=True)
+# Shared storage where every MusicGenServer container saves its latest metrics (see metrics.py).
 
+result_dict = modal.Dict.from_name("music-gen-results", create_if_missing=True)
+# Shared index of the songs made with a fixed seed: generation inputs -> their S3 keys (see result_index.py).
 
+# --------------------------------------------- Secure Information (Secrets) ---------------------------------------------
 
+music_gen_secrets = modal.Secret.from_name("music-gen-secret")
+# Get a "secret" named "music-gen-secret" from Modal dashboard.
+# Secrets store sensitive info (like API keys) securely, so they aren't exposed directly in your code.
 
+# --------------------------------------------- Music Generation Server Class (Runs in Cloud) ---------------------------------------------
 
 # This sets up a "server class" where our AI models will run.
 # `@app.cls` means it's a class that Modal manages in the cloud.
@@ -115,218 +124,100 @@ class GenerateMusicResponse(BaseModel):
     secrets=[music_gen_secrets], # Attach our secrets to this cloud server.
     scaledown_window=15 # If unused for 15 seconds, this server will shut down to save costs.
 )
-class MusicGenServer:
+@modal.concurrent(max_inputs=MAX_ACCEPTED_REQUESTS, target_inputs=MAX_CONCURRENT_REQUESTS)
+# Let one container work on several requests at once, so their songs can share a batch. Modal scales out at
+# MAX_CONCURRENT_REQUESTS per container, a burst above it waits in the container's admission queue (see admission.py).
+class MusicGenServer(MusicGenService):
     # This method runs *once* when a new cloud server (container) starts up.
-    # It's perfect for loading big AI models into memory.
+    # It starts loading the big AI models, all at the same time on background threads (see model_loader.ModelLoader).
+    # Requests can come in right away, each one only waits for the models it actually uses.
+    # Models listed in LAZY_MODELS (e.g. "sdxl_turbo,qwen") are only loaded the first time a request needs them.
     @modal.enter()
     def load_model(self):
-        # Import the necessary AI pipeline and model loaders.
+        # Records how long every stage takes, see metrics.Metrics (and the metrics endpoint).
+        self.metrics = Metrics()
+
+        self.llm_model_id = "Qwen/Qwen2-7B-Instruct" # Specify which LLM to use.
+
+        models = ModelLoader(self.metrics, lazy=os.environ.get("LAZY_MODELS", "").split(","))
+        models.register("ace_step", self.load_ace_step)
+        models.register("qwen", self.load_qwen)
+        models.register("sdxl_turbo", self.load_sdxl_turbo)
+        # Optional: a small CPU embedding model (e.g. sentence-transformers/all-MiniLM-L6-v2) that lets the
+        # tag categorizer understand tags missing from its table (see categorizer.TagCategorizer).
+        if os.environ.get("TAG_EMBEDDING_MODEL"):
+            models.register("tag_embedder", self.load_tag_embedder)
+
+        # Everything around the models: batching, LLM cache, S3 client, stage threads, CUDA streams (see MusicGenService).
+        # Connect with aws using boto3, once for the whole container (with a connection for every upload thread).
+        self.init_runtime(models, create_s3_client(max_pool_connections=S3_POOL_CONNECTIONS), os.environ["S3_BUCKET_NAME"], metrics_dict, result_store=result_dict)
+
+    # The loaders below run on the threads of the ModelLoader.
+
+    def load_ace_step(self):
         from acestep.pipeline_ace_step import ACEStepPipeline
-        from transformers import AutoModelForCausalLM, AutoTokenizer
-        from diffusers import AutoPipelineForText2Image # For generating images from text.
-        import torch # PyTorch library, essential for deep learning.
-        
+
         # Load the main music generation AI model.
-        self.music_model = ACEStepPipeline(
+        music_model = ACEStepPipeline(
             checkpoint_dir="/models", # Tells the model where to find its saved files.
             dtype="bfloat16",         # Data type for calculations (faster, less memory).
             torch_compile=False,      # Don't use Torch compilation (optional optimization).
             cpu_offload=False,        # Don't move parts of model to CPU (keep on GPU).
             overlapped_decode=False   # Specific optimization for decoding.
         )
-        
+        # The constructor only remembers where the checkpoint is, the weights are read here
+        # (otherwise the first song would do it, and the batched path expects a loaded model).
+        music_model.load_checkpoint(music_model.checkpoint_dir)
+        return music_model
+
+    def load_qwen(self):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
         # Load the Large Language Model (LLM) for understanding text prompts.
-        model_id="Qwen/Qwen2-7B-Instruct" # Specify which LLM to use.
-        self.tokenizer = AutoTokenizer.from_pretrained(model_id) # Load its text-to-token converter.
-        
-        self.llm_model = AutoModelForCausalLM.from_pretrained(
-            model_id,
+        # Load its text-to-token converter. Padding goes on the left so several prompts can be
+        # batched into one generate call and every answer starts right after its own prompt.
+        tokenizer = AutoTokenizer.from_pretrained(self.llm_model_id, padding_side="left")
+
+        llm_model = AutoModelForCausalLM.from_pretrained(
+            self.llm_model_id,
             torch_dtype="auto", # Automatically select best data type for PyTorch.
             device_map="auto",  # Automatically distribute model across available devices (e.g., GPU).
             cache_dir="/.cache/huggingFace" # Use our persistent cache for this model.
         )
-        
-       # Load a Stable Diffusion model to generate images from text (for thumbnails).
-        self.image_pipe = AutoPipelineForText2Image.from_pretrained("stabilityai/sdxl-turbo", torch_dtype=torch.float16, variant="fp16", cache_dir="/.cache/huggingFace")
-        self.image_pipe.to("cuda") # Move the image model to the GPU for faster processing.
-        
-    # ------------------------------------------------ Helper Functions ------------------------------------------------
-     
-    # Helper method to interact with the Qwen LLM.
-    def prompt_qwen(self, question:str):
-        # Format the user's question into a chat-like format for the LLM
-        messages = [
-            {"role": "user", "content": question}
-        ]
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        # Prepare the input for the LLM and send it to the GPU.
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.llm_model.device)
+        return tokenizer, llm_model
 
-        # Generate a response from the LLM.
-        generated_ids = self.llm_model.generate(
-            model_inputs.input_ids,
-            max_new_tokens=512
-        )
-        
-        # Extract the generated response part from the full output.
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
+    def load_tag_embedder(self):
+        from categorizer import load_embedder
 
-        # Decode the generated IDs back into human-readable text.
-        response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        
-        return response
-        
-    # Generates music tags/attributes using the LLM based on a song description.
-    def generate_prompt(self, description:str):
-        # Format the description into the prompt template for tag generation.
-        full_prompt = PROMPT_GENERATOR_PROMPT.format(user_prompt=description)
-        
-        # Run the LLM to get the comma-separated tags.
-        return self.prompt_qwen(full_prompt)
-    
-    # Generates song lyrics using the LLM based on a song description.
-    def generate_lyrics(self, description:str):
-       # Format the description into the prompt template for lyrics generation
-        full_prompt = LYRICS_GENERATOR_PROMPT.format(description=description)
-        
-        # Run the LLM to get the generated lyrics.
-        return self.prompt_qwen(full_prompt)
-    
-    # Generates categories based on music description
-    def generate_categories(self, description:str) -> List[str]:
-        prompt = f"Based on the following music description, list 3-5 relevant genres or categories as a comma-separated list. For example: Pop, Electronic, Sad, 80s. Description: '{description}'"
-        
-        response_text = self.prompt_qwen(prompt)
-        categories = [cat.strip() for cat in response_text.split(",") if cat.strip()]
-        
-        return categories
-    
-    def generate_and_upload_to_s3(
-        self,
-        prompt: str,
-        lyrics: str,
-        instrumental: bool,
-        audio_duration: float,
-        infer_step: int,
-        guidance_scale: float,
-        seed: int,
-        description_for_categorization: str
-    ) -> GenerateMusicResponseS3:
-        final_lyrics = "[instrumental]" if instrumental else lyrics
-        print(f"song description: {description_for_categorization}")
-        print(f"user prompt: {prompt}")
-        print(f"generated lyrics: {final_lyrics}")
-        
-        s3_client = boto3.client("s3") # connect with aws using boto3
-        bucket_name = os.environ["S3_BUCKET_NAME"] # from modal secrets 
-        
-        # ? CREATE AUDIO AND STORE IT IN S3
-        
-        # create where the audio will be stored in os
-        output_dir = "/tmp/outputs" 
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"{uuid.uuid4()}.wav")
-
-        # let the AceStep instance model generate audio based on prompt, lyrics, and settings
-        self.music_model(
-            prompt = prompt, 
-            lyrics = final_lyrics,
-            audio_duration = audio_duration, # audio duration to be generated, 3 mins by default
-            infer_step = infer_step, # the quality of the audio
-            guidance_scale = guidance_scale, # the creativity of the audio
-            save_path=output_path, # location where the output will be stored
-            manual_seeds = str(seed) # make the output different each run even input is the same cause seed is equal to -1 based on props
-        )
-        
-        # ? AUDIO CREATED
-        
-        # create the name of generated audio
-        audio_s3_key = f"{uuid.uuid4()}.wav"
-        # store it in s3
-        s3_client.upload_file(output_path, bucket_name, audio_s3_key) # what we want to upload, where to upload, name of uploaded file
-        
-        # remove it in os
-        os.remove(output_path)
-        
-        # ? AUDIO SAVED TO S3
-        
-        
-        
-        # ? CREATE IMAGE FROM PROMPT AND SAVE TO S3
-        
-        # * THUMBNAIL GENERATION
-        thumbnail_prompt = f"{prompt}, album cover art" # create the prompt
-        
-        # image_pipi is instance of stabilityai/sdxl-turbo (our text to image generator model)
-        image = self.image_pipe(prompt=thumbnail_prompt, num_inference_steps=2, guidance_scale=0.0).images[0]
-        
-        # ? IMAGE GENERATED
-        
-        # save image generated to modal container in the cloud's os first 
-        image_output_path = os.path.join(output_dir, f"{uuid.uuid4()}.png")
-        image.save(image_output_path)
-        
-        # ? SAVED TO MODAL OS
-        
-        # save the generate image to s3 bucket
-        image_s3_key = f"{uuid.uuid4()}.png"
-        s3_client.upload_file(image_output_path, bucket_name, image_s3_key)
-        os.remove(image_output_path)
-        
-        # ? IMAGE SAVED TO S3
-        
-        
-        
-        # ? CREATE CATEGORIES BASED ON SONG DESCRIPTION PROVIDED
-        
-        # * CATEGORY GENERATION -> [hip-hop, rap, etc.]
-        description_for_categorization: str
-        categories = self.generate_categories(description=description_for_categorization)
-        
-        # ? CATEGORIES GENERATED
-        
-        return GenerateMusicResponseS3(
-            s3_key=audio_s3_key,
-            cover_image_s3_key=image_s3_key,
-            categories=categories
-        )
-        
+        return load_embedder(os.environ["TAG_EMBEDDING_MODEL"], cache_dir="/.cache/huggingFace")
+
+    def load_sdxl_turbo(self):
+        from diffusers import AutoPipelineForText2Image # For generating images from text.
+        import torch # PyTorch library, essential for deep learning.
+
+        # Load a Stable Diffusion model to generate images from text (for thumbnails).
+        image_pipe = AutoPipelineForText2Image.from_pretrained("stabilityai/sdxl-turbo", torch_dtype=torch.float16, variant="fp16", cache_dir="/.cache/huggingFace")
+        image_pipe.to("cuda") # Move the image model to the GPU for faster processing.
+        return image_pipe
         
     # ------------------------------------------------ End Points ------------------------------------------------
 
     # This makes the 'generate' method callable as an API endpoint (HTTP POST request).
     @modal.fastapi_endpoint(method="POST", requires_proxy_auth=True) # ? -> this is just used for testing
     def generate(self) -> GenerateMusicResponse: # will return a str format of audio
-        output_dir = "/tmp/outputs" # Temporary directory to save the generated audio.
-        os.makedirs(output_dir, exist_ok=True) # Create the output directory if it doesn't exist.
-        output_path = os.path.join(output_dir, f"{uuid.uuid4()}.wav") # Create a unique path for the audio file.
-
-        
         # Run the music generation model instance of ACEStepPipeline with specified prompt, lyrics, and settings.
-        self.music_model(
+        # The generated audio is kept in memory (see generate_audio).
+        audio_buffer = self.generate_audio(
             prompt="electronic rap", # High-level description of the music style.
             lyrics="[verse]\nWaves on the bass, pulsing in the speakers,\nTurn the dial up, we chasing six-figure features,\nGrinding on the beats, codes in the creases,\nDigital hustler, midnight in sneakers.\n\n[chorus]\nElectro vibes, hearts beat with the hum,\nUrban legends ride, we ain't ever numb,\nCircuits sparking live, tapping on the drum,\nLiving on the edge, never succumb.\n\n[verse]\nSynthesizers blaze, city lights a glow,\nRhythm in the haze, moving with the flow,\nSwagger on stage, energy to blow,\nFrom the blocks to the booth, you already know.\n\n[bridge]\nNight's electric, streets full of dreams,\nBass hits collective, bursting at seams,\nHustle perspective, all in the schemes,\nRise and reflective, ain't no in-betweens.\n\n[verse]\nVibin' with the crew, sync in the wire,\nGot the dance moves, fire in the attire,\nRhythm and blues, soul's our supplier,\nRun the digital zoo, higher and higher.\n\n[chorus]\nElectro vibes, hearts beat with the hum,\nUrban legends ride, we ain't ever numb,\nCircuits sparking live, tapping on the drum,\nLiving on the edge, never succumb.",
             audio_duration=180, # Desired length of the generated audio in seconds (180s = 3 minutes).
             infer_step=60,      # Number of inference steps for quality - the higher the more quality and resources consumed.
             guidance_scale=15,  # How closely the generation follows the prompt - the higher the more creative.
-            save_path=output_path # Where to save the generated audio file.
-            # manual_seed="" -> uncomment this if you want to receive the same audio if the same props were passed
+            seed=-1 # -> change this if you want to receive the same audio if the same props were passed
         )
-        
-        # Read the generated audio file into memory.
-        with open(output_path, "rb") as f:
-            audio_bytes = f.read()
             
         # Encode the audio bytes into a base64 string, so it can be sent over an API.
-        audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
-        
-        os.remove(output_path) # Delete the temporary audio file to clean up.
+        audio_b64 = base64.b64encode(audio_buffer.getvalue()).decode("utf-8")
         
         # Return the base64 encoded audio in the defined response format (str format).
         return GenerateMusicResponse(audio_data=audio_b64)
@@ -336,20 +227,7 @@ class MusicGenServer:
     # ? -> Gamitin kung and user ay meron nang description ng song an gagamitin for creation ng prompt at lyrics
     @modal.fastapi_endpoint(method="POST", requires_proxy_auth=True) 
     def generate_from_description(self, request: GenerateFromDescriptionRequest) -> GenerateMusicResponseS3:
-        # Generates a comma-separated list of music tags (genre, mood, tempo, etc.) from the user's description.
-        prompt = self.generate_prompt(request.full_described_song)
-        
-        # Generates lyrics using the LLM based on the user's full song description.
-        lyrics = ""
-        if not request.instrumental:
-            lyrics = self.generate_lyrics(request.full_described_song)
-            
-        return self.generate_and_upload_to_s3(
-            prompt=prompt, # (e.g. value: melodic techno, male vocal, electronic, emotional, minor key, 124 bpm, synthesizer, driving, atmospheric)
-            lyrics=lyrics, # (e.g. value: the lyrics generated by qwen based on song description provided by user)
-            description_for_categorization=request.full_described_song, # (e.g. value: the song description itself provided by user)
-            **request.model_dump(exclude={"full_described_song"}) # kinuha lahat ng props ng parent class, excluding its own property
-        )
+        return self.run_interactive("generate_from_description", request)
         
         
     
@@ -357,12 +235,7 @@ class MusicGenServer:
     # ? -> gamitin kung ang user ay may provided na prompt at lyrics na agad
     @modal.fastapi_endpoint(method="POST", requires_proxy_auth=True)
     def generate_with_lyrics(self, request: GenerateWithCustomLyricsRequest) -> GenerateMusicResponseS3:
-        return self.generate_and_upload_to_s3(
-            prompt=request.prompt, # dapat ang prompt input from user is comma separated na
-            lyrics=request.lyrics, # ginawa na din ni user yung lyrics
-            description_for_categorization=request.prompt, # same dito, comma separated na yung prompt na ibibigay ni user
-            **request.model_dump(exclude={"prompt", "lyrics"}) # kinuha lahat ng props ng parent class
-        )
+        return self.run_interactive("generate_with_lyrics", request)
     
     
     
@@ -370,18 +243,138 @@ class MusicGenServer:
     # ? -> Gamitin kung an user ay may provided na lyrics description to be passed to the LLM to generate lyrics
     @modal.fastapi_endpoint(method="POST", requires_proxy_auth=True)
     def generate_with_described_lyrics(self, request: GenerateWithDescribedLyricsRequest) -> GenerateMusicResponseS3:
-        # Generates lyrics using the LLM based on the user's full song description.
-        lyrics = ""
-        if not request.instrumental:
-            lyrics = self.generate_lyrics(request.described_lyrics) # yung lyrics description will be used to let LLM create a lyrics
-            
-        return self.generate_and_upload_to_s3(
-            prompt=request.prompt,  # prompt na ibibigay ni user dito is comma separated na
-            lyrics=lyrics, # AI generated lyrics
-            description_for_categorization=request.prompt, # comma separated prompt
-            **request.model_dump(exclude={"described_lyrics", "prompt"})
+        return self.run_interactive("generate_with_described_lyrics", request)
+
+
+
+    # ? -> several takes of the same song description (num_variations, or a list of seeds), one song per seed.
+    # ? -> The tags, lyrics and categories are made once, the songs share diffusion runs, and by default one cover.
+    @modal.fastapi_endpoint(method="POST", requires_proxy_auth=True)
+    def generate_variations(self, request: GenerateVariationsRequest) -> List[GenerateMusicResponseS3]:
+        return self.run_interactive("generate_variations", request)
+
+
+
+    # ? -> same body as submit_job (kind + request), but the answer is a Server-Sent Events stream:
+    # ? -> the tags and lyrics token by token while the LLM writes them, the stage events, then the GenerateMusicResponseS3.
+    # ? -> see streaming.py for the events
+    @modal.fastapi_endpoint(method="POST", requires_proxy_auth=True)
+    def generate_stream(self, body: SubmitJobRequest):
+        from fastapi import HTTPException
+        from fastapi.responses import StreamingResponse
+
+        # check the request before the stream starts, so a bad body is still a plain 422
+        try:
+            request = JOB_REQUEST_MODELS[body.kind](**body.request)
+        except ValidationError as error:
+            raise HTTPException(status_code=422, detail=error.errors())
+
+        try:
+            events = self.stream_job(body.kind, request, INTERACTIVE)
+        except Overloaded as error:
+            raise overloaded_error(error)
+        return StreamingResponse(
+            events,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # no proxy may hold the events back
         )
 
+    # ------------------------------------------------ Background Jobs ------------------------------------------------
+
+    # Runs ONE job from the job queue. The submit_job endpoint spawns one call of this per submitted job.
+    @modal.method()
+    def process_next_job(self):
+        job_manager.run_next(self.run_job, timeout=60)
+
+    # Runs a job with the handler of its kind and returns the result as a plain dict (to save it in the job store).
+    def run_job(self, kind: str, payload: dict, progress: Callable[[str, str], None]) -> dict:
+        request = JOB_REQUEST_MODELS[kind](**payload) # the stream id of submit_job is not a field, the model ignores it
+        # jobs are never turned away (the user is already polling), they wait behind the endpoint requests
+        return self.run_admitted(kind, request, BACKGROUND, progress=progress, stream_id=payload.get("stream_id")).model_dump()
+
+    # Runs the request of an endpoint through admission control (see admission.py): an overloaded server
+    # answers 503 with a Retry-After right away, instead of making everyone wait longer.
+    def run_interactive(self, kind: str, request):
+        try:
+            return self.run_admitted(kind, request, INTERACTIVE)
+        except Overloaded as error:
+            raise overloaded_error(error)
+
+
+def overloaded_error(error: Overloaded):
+    from fastapi import HTTPException
+
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+# ------------------------------------------------ Background Job End Points ---------------------------------------------
+# Instead of waiting minutes for a song: submit a job, then poll its status until it is done and fetch the result.
+# These run on small CPU containers, polling never wakes up a GPU.
+
+# ? -> returns a job id right away, the song is made in the background by MusicGenServer.process_next_job
+@app.function(image=api_image)
+@modal.fastapi_endpoint(method="POST", requires_proxy_auth=True)
+def submit_job(body: SubmitJobRequest) -> SubmitJobResponse:
+    from fastapi import HTTPException
+
+    # check the request now, so a bad body fails here and not minutes later in the worker
+    try:
+        request = JOB_REQUEST_MODELS[body.kind](**body.request)
+    except ValidationError as error:
+        raise HTTPException(status_code=422, detail=error.errors())
+
+    # a progressive song gets its stream id now, so the client knows where to poll for segments right away.
+    # It is not part of the request model (a client could pick someone else's stream), it goes next to the request.
+    stream_id = str(uuid.uuid4()) if request.progressive else None
+
+    job_id = job_manager.submit(body.kind, {**request.model_dump(), "stream_id": stream_id})
+    MusicGenServer().process_next_job.spawn() # wake up a worker for this job
+    return SubmitJobResponse(job_id=job_id, manifest_s3_key=manifest_key(stream_id) if stream_id else None)
+
+
+# ? -> status ng job and ng bawat stage (llm, audio, image, upload)
+@app.function(image=api_image)
+@modal.fastapi_endpoint(method="GET", requires_proxy_auth=True)
+def job_status(job_id: str) -> JobStatusResponse:
+    from fastapi import HTTPException
+
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+    return JobStatusResponse(job_id=job_id, status=job["status"], stages=job["stages"], error=job["error"])
+
+
+# ? -> the finished song, same response as the blocking endpoints
+@app.function(image=api_image)
+@modal.fastapi_endpoint(method="GET", requires_proxy_auth=True)
+def job_result(job_id: str) -> GenerateMusicResponseS3:
+    from fastapi import HTTPException
+
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"job {job_id} is still {job['status']}")
+    return GenerateMusicResponseS3(**job["result"])
+
+    
+# ------------------------------------------------ Metrics End Point ---------------------------------------------
+
+# ? -> histograms of every stage (llm, audio diffusion, thumbnail, uploads, model loading) of all containers together
+# ? -> format=prometheus (default, for a metrics scraper) or format=json
+@app.function(image=api_image)
+@modal.fastapi_endpoint(method="GET", requires_proxy_auth=True)
+def metrics(format: str = "prometheus"):
+    from fastapi.responses import PlainTextResponse
+
+    # only the containers that are still running (the entries of gone ones are deleted here)
+    snapshot = merge_snapshots(live_snapshots(metrics_dict))
+    if format == "json":
+        return snapshot
+    return PlainTextResponse(to_prometheus(snapshot))
+
     
 # ------------------------------------------------Local Entrypoint (How we start the app) ---------------------------------------------
 
@@ -0,0 +1,219 @@
+from bisect import bisect_left # Finds the histogram bucket of a value.
+from contextlib import contextmanager
+import json
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# --------------------------------------------- Metrics ---------------------------------------------
+
+# Bucket upper bounds of the histograms (like Prometheus: every value lands in the first bucket it fits in).
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+RATE_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000) # tokens/s, steps/s, MB/s, ...
+COUNT_BUCKETS = (1, 8, 32, 128, 256, 512, 1024, 2048, 4096) # token counts
+MEGABYTE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2000, 5000, 10000, 20000, 40000) # file sizes and GPU memory in MB
+
+# Every container publishes its snapshot at least this often (also when idle), see MusicGenService.publish_metrics.
+PUBLISH_SECONDS = 30.0
+# A snapshot older than this belongs to a container that is gone (scaled down, preempted, crashed).
+STALE_AFTER_SECONDS = 3 * PUBLISH_SECONDS
+
+
+# Counts how many values fell in each bucket, plus their sum and count.
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # the last one is for values above every bucket (+Inf)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# A stage being measured, see Metrics.span.
+class Span:
+    def __init__(self, metrics: "Metrics", name: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.fields: Dict[str, object] = {} # extra details written to the log line
+
+    # Adds details to the log line of this span, e.g. span.set(prompt_tokens=120)
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    # Records a value in the histogram `<span name>_<metric>` (with the labels of this span) and in the log line.
+    def observe(self, metric: str, value: float, buckets: Iterable[float] = RATE_BUCKETS):
+        self.fields[metric] = round(value, 4)
+        self.metrics.observe(f"{self.name}_{metric}", value, self.labels, buckets)
+
+
+# Records how long every stage takes (and how much GPU memory it needs) into histograms, and writes
+# every measured stage as one JSON line to the logs. Gauges hold the latest value of something this
+# container counts itself (e.g. the S3 connections it opened).
+#
+# Example:
+#   with metrics.span("s3_upload", kind="audio") as span:
+#       upload(...)
+#       span.observe("mb_per_second", megabytes / seconds)
+class Metrics:
+    def __init__(self, track_gpu_memory: bool = True):
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+        self._active_spans = 0
+        self.track_gpu_memory = track_gpu_memory and _cuda_available()
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, buckets: Iterable[float] = SECONDS_BUCKETS):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        with self._lock:
+            self._gauges[(name, tuple(sorted((labels or {}).items())))] = value
+
+    # Measures the code inside the `with` block as the stage `name`.
+    # Records `<name>_seconds` and, on a GPU, `<name>_gpu_peak_mb`: the highest GPU memory use while it ran.
+    # Stages running at the same time share the GPU, so their peaks include each other.
+    @contextmanager
+    def span(self, name: str, **labels):
+        span = Span(self, name, {key: str(value) for key, value in labels.items()})
+        with self._lock:
+            if self.track_gpu_memory and self._active_spans == 0:
+                _reset_gpu_peak()
+            self._active_spans += 1
+
+        started = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except BaseException as exception:
+            error = f"{type(exception).__name__}: {exception}"
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self._active_spans -= 1
+            self.observe(f"{name}_seconds", seconds, span.labels)
+            if self.track_gpu_memory:
+                span.observe("gpu_peak_mb", _gpu_peak_mb(), MEGABYTE_BUCKETS)
+
+            # one structured log line per stage
+            print(json.dumps({
+                "event": "span",
+                "span": name,
+                **span.labels,
+                "seconds": round(seconds, 4),
+                **span.fields,
+                **({"error": error} if error else {})
+            }))
+
+    # Every histogram and gauge as plain data (json friendly), e.g. to save it in a modal.Dict.
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self._gauges.items()],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "buckets": list(histogram.buckets),
+                        "counts": list(histogram.counts),
+                        "sum": histogram.sum,
+                        "count": histogram.count
+                    }
+                    for (name, labels), histogram in self._histograms.items()
+                ]
+            }
+
+
+# The snapshots of the containers that are still publishing, from a store of container id -> snapshot.
+# The ones of gone containers are deleted from the store, so it does not grow with every container that ever ran.
+def live_snapshots(store, stale_after_seconds: float = STALE_AFTER_SECONDS) -> List[dict]:
+    now = time.time()
+    live = []
+    for container_id, snapshot in list(store.items()):
+        if now - snapshot.get("updated_at", 0) <= stale_after_seconds:
+            live.append(snapshot)
+            continue
+        try:
+            del store[container_id]
+        except KeyError:
+            pass # another metrics request deleted it first
+    return live
+
+
+# Adds up the snapshots of several containers into one.
+def merge_snapshots(snapshots: Iterable[dict]) -> dict:
+    merged: Dict[tuple, dict] = {}
+    gauges: Dict[tuple, dict] = {}
+    for snapshot in snapshots:
+        for gauge in snapshot.get("gauges", []):
+            key = (gauge["name"], tuple(sorted(gauge["labels"].items())))
+            if key in gauges:
+                gauges[key]["value"] += gauge["value"]
+            else:
+                gauges[key] = dict(gauge)
+        for histogram in snapshot.get("histograms", []):
+            key = (histogram["name"], tuple(sorted(histogram["labels"].items())), tuple(histogram["buckets"]))
+            if key not in merged:
+                merged[key] = {**histogram, "counts": list(histogram["counts"])}
+                continue
+            total = merged[key]
+            total["counts"] = [a + b for a, b in zip(total["counts"], histogram["counts"])]
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+    return {"histograms": list(merged.values()), "gauges": list(gauges.values())}
+
+
+# Turns a snapshot into the Prometheus text format, so any metrics scraper/dashboard can read it.
+def to_prometheus(snapshot: dict) -> str:
+    lines: List[str] = []
+    typed = set()
+    for histogram in sorted(snapshot.get("histograms", []), key=lambda item: (item["name"], sorted(item["labels"].items()))):
+        name = f"musicgen_{histogram['name']}"
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        labels = [f'{key}="{value}"' for key, value in sorted(histogram["labels"].items())]
+        cumulative = 0
+        for bound, count in zip([*histogram["buckets"], "+Inf"], histogram["counts"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{",".join([*labels, f"le={json.dumps(str(bound))}"])}}} {cumulative}')
+        label_text = f"{{{','.join(labels)}}}" if labels else ""
+        lines.append(f"{name}_sum{label_text} {histogram['sum']}")
+        lines.append(f"{name}_count{label_text} {histogram['count']}")
+    for gauge in sorted(snapshot.get("gauges", []), key=lambda item: (item["name"], sorted(item["labels"].items()))):
+        name = f"musicgen_{gauge['name']}"
+        if name not in typed:
+            lines.append(f"# TYPE {name} gauge")
+            typed.add(name)
+        labels = ",".join(f'{key}="{value}"' for key, value in sorted(gauge["labels"].items()))
+        lines.append(f"{name}{{{labels}}} {gauge['value']}" if labels else f"{name} {gauge['value']}")
+    return "\n".join(lines) + "\n"
+
+# ------------------------------------------------ GPU Memory ------------------------------------------------
+
+def _cuda_available() -> bool:
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def _reset_gpu_peak():
+    import torch
+    torch.cuda.reset_peak_memory_stats()
+
+
+def _gpu_peak_mb() -> float:
+    import torch
+    return torch.cuda.max_memory_allocated() / (1024 * 1024)
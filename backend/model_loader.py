@@ -0,0 +1,152 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# --------------------------------------------- Model Loading ---------------------------------------------
+
+# Loads the models of a container on background threads, so their disk reads (the /models and
+# HF cache volumes) overlap instead of running one after the other, and requests can start before
+# every model is loaded. `get(name)` only waits for the model it asks for.
+#
+# A model marked `lazy` is not loaded at start, only the first time something asks for it.
+#
+# Example:
+#   models = ModelLoader(metrics, lazy=["sdxl_turbo"])
+#   models.register("ace_step", load_ace_step)
+#   models.register("sdxl_turbo", load_sdxl_turbo)
+#   models.start()                 # ace_step starts loading on its own thread
+#   music = models.get("ace_step") # waits until ace_step is loaded (sdxl_turbo is still not loading)
+#
+# Every load is measured as the `load_model` span (model=<name>), and a request that has to wait for
+# a model that is still loading records `model_wait_seconds` (model=<name>).
+
+# Model states, see ModelLoader.states
+NOT_STARTED = "not_started"
+LOADING = "loading"
+LOADED = "loaded"
+FAILED = "failed"
+
+
+class _Model:
+    def __init__(self, name: str, load: Callable[[], Any], lazy: bool):
+        self.name = name
+        self.load = load
+        self.lazy = lazy
+        self.future: Future = Future()
+        self.started = False
+        self.ready = False # set once the on_load callbacks ran, right before the future gets its result
+        self.callbacks: List[Callable[[Any], None]] = []
+        self.seconds: Optional[float] = None
+
+
+class ModelLoader:
+    def __init__(self, metrics=None, lazy: Iterable[str] = (), max_workers: int = 4):
+        self.metrics = metrics
+        self._lazy = {name.strip() for name in lazy if name.strip()}
+        self._models: Dict[str, _Model] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-load")
+        self._started = False
+
+    # Adds a model. `load()` returns the loaded model (anything: a pipeline, a (tokenizer, model) pair, ...).
+    def register(self, name: str, load: Callable[[], Any], lazy: bool = False):
+        with self._lock:
+            if name in self._models:
+                raise ValueError(f"model '{name}' was already registered")
+            model = self._models[name] = _Model(name, load, lazy or name in self._lazy)
+            start = self._started and not model.lazy
+        if start:
+            self._start(model)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._models
+
+    # Starts loading every model that is not lazy, each on its own thread.
+    def start(self):
+        with self._lock:
+            self._started = True
+            eager = [model for model in self._models.values() if not model.lazy]
+        for model in eager:
+            self._start(model)
+
+    # Calls `callback(model)` once the model is loaded (right away if it already is), before anyone gets it from `get`.
+    # Used to set up a model after it loads, e.g. swapping one of its methods.
+    def on_load(self, name: str, callback: Callable[[Any], None]):
+        model = self._models[name]
+        with self._lock:
+            if not model.ready:
+                model.callbacks.append(callback)
+                return
+        callback(model.future.result())
+
+    # The loaded model, loading it first if it is lazy and nobody asked for it yet.
+    def get(self, name: str) -> Any:
+        model = self._models[name]
+        if model.future.done():
+            return model.future.result()
+
+        self._start(model)
+        started = time.perf_counter()
+        result = model.future.result()
+        if self.metrics is not None:
+            self.metrics.observe("model_wait_seconds", time.perf_counter() - started, {"model": name})
+        return result
+
+    # Waits until every model that was started is loaded (raises the first load error).
+    def wait(self):
+        for model in list(self._models.values()):
+            if model.started:
+                model.future.result()
+
+    # How long every loaded model took to load, in seconds.
+    def load_times(self) -> Dict[str, float]:
+        return {name: model.seconds for name, model in self._models.items() if model.seconds is not None}
+
+    def states(self) -> Dict[str, str]:
+        states = {}
+        for name, model in self._models.items():
+            if not model.started:
+                states[name] = NOT_STARTED
+            elif not model.future.done():
+                states[name] = LOADING
+            else:
+                states[name] = FAILED if model.future.exception() is not None else LOADED
+        return states
+
+    # ------------------------------------------------ Internals ------------------------------------------------
+
+    def _start(self, model: _Model):
+        with self._lock:
+            if model.started:
+                return
+            model.started = True
+        self._pool.submit(self._load, model)
+
+    def _load(self, model: _Model):
+        started = time.perf_counter()
+        try:
+            if self.metrics is not None:
+                with self.metrics.span("load_model", model=model.name):
+                    loaded = model.load()
+            else:
+                loaded = model.load()
+            model.seconds = time.perf_counter() - started
+            print(f"loaded {model.name} in {model.seconds:.1f}s")
+
+            # run the on_load callbacks, including any added while the others ran
+            while True:
+                with self._lock:
+                    callbacks, model.callbacks = model.callbacks, []
+                    if not callbacks:
+                        model.ready = True
+                        break
+                for callback in callbacks:
+                    callback(loaded)
+        except BaseException as error:
+            with self._lock:
+                model.ready = True
+            print(f"could not load {model.name}: {type(error).__name__}: {error}")
+            model.future.set_exception(error)
+        else:
+            model.future.set_result(loaded)
@@ -0,0 +1,1151 @@
+from concurrent.futures import ThreadPoolExecutor # A group of worker threads to run tasks at the same time.
+from contextlib import nullcontext
+import importlib.metadata # Tells which ACE-Step release is installed.
+import io # In-memory "files", so generated audio and images never have to be written to disk.
+import os # Helps interact with the operating system, like creating folders or deleting files.
+import random # Picks the random seeds of the songs.
+import threading # Runs the streaming requests next to their HTTP response.
+import time # Measures how long the stages take.
+from typing import Callable, Iterator, List, Optional
+import uuid # Generates unique IDs, useful for unique filenames.
+
+from admission import BACKGROUND, INTERACTIVE, AdmissionController, Overloaded, PriorityClass, Ticket # Decides which requests run, when, and at what quality.
+from audio_encoding import AUDIO_FORMATS, LOSSY_FORMATS, encode_audio, write_wav # Turns the WAV into flac/opus/mp3.
+from batching import AudioRequest, MicroBatcher, audio_bucket # Runs songs requested at the same time as one batch.
+from categorizer import TagCategorizer # Categorizes comma-separated tags without the LLM.
+from decoding_profiles import ( # How every LLM task is decoded, stopped and parsed.
+    CATEGORIES,
+    LYRICS,
+    TAGS,
+    DecodingProfile,
+    GreedyRowsProcessor,
+    LLMQuestion,
+    ProfileStoppingCriteria,
+    group_rows,
+)
+from jobs import DONE, JOB_STAGES, StageTracker # Reports the progress of background jobs.
+from llm_cache import LLMResponseCache # Remembers LLM answers between requests.
+from llm_prefix_cache import PrefixKVCache, render_prefix # Reuses the LLM's work on the fixed part of the prompts.
+from model_loader import ModelLoader # Loads the models in the background.
+from metrics import COUNT_BUCKETS, MEGABYTE_BUCKETS, PUBLISH_SECONDS # Histogram buckets of the stage metrics, how often they are published.
+from pipeline_executor import PipelinedExecutor # Runs the generation stages at the same time.
+from progressive import SegmentStream, manifest_key # Uploads progressive songs segment by segment.
+from streaming import BatchTextStreamer, EventStream, stream_answer # Streams the LLM answers and the stages to the client.
+from prompts import (
+    CATEGORIES_GENERATOR_INSTRUCTIONS,
+    CATEGORIES_GENERATOR_PROMPT,
+    LYRICS_GENERATOR_INSTRUCTIONS,
+    LYRICS_GENERATOR_PROMPT,
+    PROMPT_GENERATOR_INSTRUCTIONS,
+    PROMPT_GENERATOR_PROMPT,
+)
+from schemas import (
+    GenerateFromDescriptionRequest,
+    GenerateMusicResponseS3,
+    GenerateVariationsRequest,
+    GenerateWithCustomLyricsRequest,
+    GenerateWithDescribedLyricsRequest,
+)
+from result_index import COMPUTED, ResultIndex # Reuses the songs of fixed-seed requests that were generated before.
+from storage import connection_stats, copy_object, object_exists, s3_pool_connections, upload_buffer # Streams in-memory files to S3.
+
+# --------------------------------------------- Music Generation Service ---------------------------------------------
+# Everything MusicGenServer (main.py) does with its models, without anything Modal specific,
+# so it can also run with stub models on any machine (see benchmarks/harness.py).
+
+# How many requests one MusicGenServer container works on at the same time.
+MAX_CONCURRENT_REQUESTS = 4
+# How many requests one container accepts at the same time: the ones above MAX_CONCURRENT_REQUESTS wait for
+# their turn in its admission queue (see admission.AdmissionController), or are turned away if it is too long.
+MAX_ACCEPTED_REQUESTS = 32
+
+# Worker threads of a container: the generation stages (4 per request, for every request it runs at the same time),
+# and the segment uploads of progressive songs. Both upload to S3, the S3 client's connection pool is sized for them.
+STAGE_WORKERS = 4 * MAX_CONCURRENT_REQUESTS
+SEGMENT_WORKERS = MAX_CONCURRENT_REQUESTS
+S3_POOL_CONNECTIONS = s3_pool_connections(STAGE_WORKERS + SEGMENT_WORKERS)
+
+# Which job stage every stage of generate_and_upload_to_s3 belongs to.
+PIPELINE_JOB_STAGES = {
+    "categories": "llm",
+    "audio": "audio",
+    "audio_encode": "audio",
+    "image": "image",
+    "audio_upload": "upload",
+    "image_upload": "upload",
+    "stream_finish": "upload"
+}
+
+# Latent frames around a progressive segment that are decoded with it and then cut off,
+# so the decoder sees the same context at the segment edges as in one piece (~0.75s each side).
+SEGMENT_CONTEXT_FRAMES = 8
+
+# The ACE-Step release whose text2music internals run_text2music_batch copies (the one main.py installs).
+# With any other release installed, the songs of a batch go through the stock ACEStepPipeline.__call__ one by one.
+ACE_STEP_VERSION = "0.2.0"
+
+# Default for the `progress` argument of the request handlers: report to nobody.
+def ignore_progress(stage: str, state: str):
+    pass
+
+
+# Whether run_text2music_batch can drive this music model: ACE-Step's own pipeline only at ACE_STEP_VERSION
+# (the stand-ins of the benchmarks are not ACE-Step's, they have the same internals by construction).
+def supports_text2music_batch(music_model) -> bool:
+    if not type(music_model).__module__.startswith("acestep."):
+        return True
+    try:
+        installed = importlib.metadata.version("ace-step")
+    except importlib.metadata.PackageNotFoundError:
+        installed = None
+    if installed != ACE_STEP_VERSION:
+        print(f"ACE-Step {installed} is installed, the batched text2music path was written for {ACE_STEP_VERSION}: every song runs on its own")
+        return False
+    return True
+
+
+class MusicGenService:
+    # ------------------------------------------------ Models ------------------------------------------------
+    # The models come from a model_loader.ModelLoader with these names:
+    # - "ace_step": the ACEStepPipeline
+    # - "qwen": the (tokenizer, model) pair of the LLM
+    # - "sdxl_turbo": the text-to-image pipeline
+    # They load in the background, so using one of these waits until that model (and only that one) is loaded.
+
+    @property
+    def music_model(self):
+        return self.models.get("ace_step")
+
+    @property
+    def tokenizer(self):
+        return self.models.get("qwen")[0]
+
+    @property
+    def llm_model(self):
+        return self.models.get("qwen")[1]
+
+    @property
+    def image_pipe(self):
+        return self.models.get("sdxl_turbo")
+
+    # ------------------------------------------------ Setup ------------------------------------------------
+
+    # Sets up everything around the models and starts loading them. Needs `self.llm_model_id` and
+    # `self.metrics` to be set. MusicGenServer.load_model registers the real models, the offline
+    # benchmarks (benchmarks/harness.py) register stub models instead.
+    def init_runtime(self, models: ModelLoader, s3_client, bucket_name: str, metrics_store=None, llm_cache: Optional[LLMResponseCache] = None, llm_prefix_cache: Optional[bool] = None, result_store=None):
+        import torch
+
+        self.models = models
+
+        # ACE-Step normally writes the finished song to a file on disk.
+        # We swap its save step with one that keeps the song in memory (see save_wav_to_memory).
+        self.audio_buffers = {} # (save_path, index in the batch) -> in-memory WAV of that song
+        # The SDXL-turbo pipeline keeps scheduler state between calls (its timesteps and step index), so
+        # the covers of requests running at the same time are made one after the other.
+        self.image_lock = threading.Lock()
+        self.models.on_load("ace_step", self.use_in_memory_wav)
+
+        # Songs requested at about the same time (with the same duration/steps/guidance) are generated
+        # together in one batched diffusion run instead of waiting for each other (see batching.MicroBatcher).
+        self.music_batcher = MicroBatcher(
+            self.run_music_batch,
+            bucket_key=audio_bucket,
+            max_batch_size=int(os.environ.get("MUSIC_BATCH_MAX_SIZE", "4")),
+            max_wait_seconds=float(os.environ.get("MUSIC_BATCH_MAX_WAIT_MS", "50")) / 1000
+        )
+
+        # Remembers LLM answers so the same question is not asked twice (see llm_cache.LLMResponseCache).
+        # The disk tier lives on the qwen-hf-cache volume so it survives container restarts.
+        self.llm_cache = llm_cache or LLMResponseCache(
+            max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1024")),
+            disk_dir="/.cache/huggingFace/llm-response-cache" if os.environ.get("LLM_CACHE_DISK", "true").lower() == "true" else None,
+            max_disk_bytes=int(os.environ.get("LLM_CACHE_MAX_DISK_MB", "256")) * 1024 * 1024,
+            cache_sampled=os.environ.get("LLM_CACHE_SAMPLED", "false").lower() == "true" # sampled answers (the lyrics) stay new for every request
+        )
+
+        # The KV cache of the fixed instructions of every prompt template, computed once the LLM is loaded
+        # (see llm_prefix_cache.PrefixKVCache), so every request only prefills its own part of the prompt.
+        self.prefix_cache: Optional[PrefixKVCache] = None
+        if llm_prefix_cache is None:
+            llm_prefix_cache = os.environ.get("LLM_PREFIX_CACHE", "true").lower() == "true"
+        if llm_prefix_cache:
+            self.models.on_load("qwen", self.build_prefix_cache)
+
+        # Categories straight from comma-separated tags, without the LLM when the tags are clear enough (see categorizer.TagCategorizer).
+        # If a "tag_embedder" model is registered, tags the lookup table doesn't know are matched by embedding similarity.
+        self.categorizer: Optional[TagCategorizer] = None
+        if os.environ.get("TAG_CATEGORIZER", "true").lower() == "true":
+            self.categorizer = TagCategorizer(
+                min_coverage=float(os.environ.get("TAG_CATEGORIZER_MIN_COVERAGE", "0.6")),
+                min_categories=int(os.environ.get("TAG_CATEGORIZER_MIN_CATEGORIES", "2"))
+            )
+            if "tag_embedder" in self.models:
+                self.models.on_load("tag_embedder", self.categorizer.use_embeddings)
+
+        # The S3 client is made once for the whole container.
+        # Every request reuses this client and its open connections (see storage.create_s3_client).
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+
+        # Which S3 keys already hold the song of every fixed-seed request (see result_index.ResultIndex),
+        # saved in `result_store` (a modal.Dict shared by every container in the cloud, in memory otherwise).
+        self.result_index: Optional[ResultIndex] = None
+        if os.environ.get("RESULT_INDEX", "true").lower() == "true":
+            self.result_index = ResultIndex(result_store, version=os.environ.get("RESULT_INDEX_VERSION", "1"))
+        self.result_index_verify = os.environ.get("RESULT_INDEX_VERIFY", "true").lower() == "true" # check the files are still in S3 before reusing them
+
+        # Which requests run, in what order and with how many diffusion steps (see admission.AdmissionController).
+        # Requests from the endpoints are degraded to fewer steps, then turned away, when the projected wait gets
+        # close to / past their SLO. Background jobs only wait behind them.
+        self.admission = AdmissionController(
+            slots=MAX_CONCURRENT_REQUESTS,
+            classes={
+                INTERACTIVE: PriorityClass(
+                    INTERACTIVE, rank=0,
+                    max_wait_seconds=float(os.environ.get("ADMISSION_SLO_SECONDS", "120")),
+                    min_infer_step=int(os.environ.get("ADMISSION_MIN_INFER_STEP", "30"))
+                ),
+                BACKGROUND: PriorityClass(BACKGROUND, rank=1),
+            },
+            seconds_per_step_second=float(os.environ.get("ADMISSION_GPU_SECONDS_PER_STEP_SECOND", "0.003")), # until the first batches are measured
+            degrade_from=float(os.environ.get("ADMISSION_DEGRADE_FROM", "0.5"))
+        )
+
+        # Where publish_metrics saves the metrics of this container (a modal.Dict in the cloud).
+        self.metrics_store = metrics_store if metrics_store is not None else {}
+        self.container_id = os.environ.get("MODAL_TASK_ID", str(uuid.uuid4()))
+
+        # Worker threads shared by every request, used to run the generation stages at the same time.
+        self.stage_pool = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+        # Encodes and uploads the segments of progressive songs (see progressive.SegmentStream).
+        self.segment_pool = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS, thread_name_prefix="segment")
+        # Separate CUDA streams so the thumbnail and category work can run on the GPU alongside the audio model.
+        # (no GPU, e.g. in the offline benchmarks -> no streams)
+        self.image_stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+        self.llm_stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+
+        self.publish_metrics()
+        # and again every PUBLISH_SECONDS, also when idle: the metrics endpoint drops the snapshots that stop updating
+        threading.Thread(target=self.publish_metrics_periodically, name="metrics-publisher", daemon=True).start()
+        # every model starts loading now; the load times show up in the metrics as each one finishes
+        for name in ("ace_step", "qwen", "sdxl_turbo"):
+            self.models.on_load(name, lambda _: self.publish_metrics())
+        self.models.start()
+
+    def use_in_memory_wav(self, music_model):
+        music_model.save_wav_file = self.save_wav_to_memory
+        self.batched_text2music = supports_text2music_batch(music_model)
+
+    def build_prefix_cache(self, qwen):
+        tokenizer, llm_model = qwen
+        with self.metrics.span("llm_prefix_cache") as span:
+            prefix_cache = PrefixKVCache(tokenizer, llm_model)
+            for name, instructions in (("tags", PROMPT_GENERATOR_INSTRUCTIONS), ("lyrics", LYRICS_GENERATOR_INSTRUCTIONS), ("categories", CATEGORIES_GENERATOR_INSTRUCTIONS)):
+                prefix_cache.add(name, render_prefix(tokenizer, instructions))
+            span.set(cached_tokens=prefix_cache.cached_tokens())
+        self.prefix_cache = prefix_cache
+
+    # Runs the code inside the `with` block on the given CUDA stream (or normally, if there is no stream).
+    def gpu_stream(self, stream):
+        import torch
+
+        return torch.cuda.stream(stream) if stream is not None else nullcontext()
+
+    # ------------------------------------------------ Helper Functions ------------------------------------------------
+     
+    # Helper method to interact with the Qwen LLM. Returns the parsed answer (see decoding_profiles).
+    def prompt_qwen(self, question: LLMQuestion):
+        # A single question is just a batch of one.
+        return self.prompt_qwen_batch([question])[0]
+
+    # Runs several questions through the Qwen LLM in ONE generate call instead of one call per question.
+    # The GPU does almost the same amount of work for a batch of 3 as for a batch of 1, so this saves time.
+    # Questions that were already answered before come from the LLM cache and are not generated again.
+    # Every question is decoded with its own profile (token budget, stop strings, sampling) and its answer
+    # is parsed by it; an answer that can't be parsed is asked again (if the question allows retries), then replaced
+    # by the question's fallback, or fails the request if the question has no usable fallback.
+    # With `events` (a streaming request) every answer is also streamed, token by token, see streaming.EventStream.
+    def prompt_qwen_batch(self, questions: List[LLMQuestion], events: Optional[EventStream] = None) -> list:
+        if not questions:
+            return []
+
+        # Format every question into a chat-like format for the LLM
+        texts = [
+            self.tokenizer.apply_chat_template(
+                [{"role": "user", "content": question.text}],
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            for question in questions
+        ]
+
+        # Look every question up in the cache first.
+        defaults = self.llm_model.generation_config
+        decodings = [question.profile.decoding(defaults) for question in questions]
+        answers: List[Optional[str]] = [None] * len(texts)
+        keys: List[Optional[str]] = [None] * len(texts)
+        for index, (text, decoding) in enumerate(zip(texts, decodings)):
+            if self.llm_cache.is_cacheable(decoding):
+                keys[index] = self.llm_cache.make_key(self.llm_model_id, text, decoding)
+                answers[index] = self.llm_cache.get(keys[index])
+            else:
+                self.llm_cache.record_uncacheable(1)
+
+        # Only the questions that were not in the cache go to the LLM.
+        missing = [index for index, answer in enumerate(answers) if answer is None]
+        if events is not None:
+            for question, answer in zip(questions, answers):
+                if answer is not None:
+                    events.text(question.profile.name, answer) # from the cache, all at once
+        if missing:
+            on_text = (lambda row, text: events.text(questions[missing[row]].profile.name, text)) if events is not None else None
+            generated = self.generate_llm_batch([texts[index] for index in missing], [questions[index].profile for index in missing], on_text)
+            for index, answer in zip(missing, generated):
+                answers[index] = answer
+
+        generated = set(missing)
+        results: list = [None] * len(questions)
+        pending = list(range(len(questions)))
+        attempt = 0
+        while pending:
+            retry = []
+            for index in pending:
+                question = questions[index]
+                try:
+                    results[index] = question.profile.parse(answers[index])
+                except ValueError as error:
+                    if attempt < question.retries:
+                        print(f"unusable {question.profile.name} answer, asking again: {error}")
+                        retry.append(index)
+                    elif question.required:
+                        raise ValueError(f"the LLM gave no usable {question.profile.name} answer in {attempt + 1} tries: {error}")
+                    else:
+                        print(f"unusable {question.profile.name} answer, using the fallback: {error}")
+                        results[index] = question.fallback
+                        stream_answer(events, question.profile.name, question.fallback)
+                    continue
+                stream_answer(events, question.profile.name, results[index])
+                # only answers that parse are remembered
+                if index in generated and keys[index] is not None:
+                    self.llm_cache.put(keys[index], answers[index])
+
+            # the unusable answers are generated again (one batched call for all of them)
+            if retry:
+                on_text = (lambda row, text: events.text(questions[retry[row]].profile.name, text)) if events is not None else None
+                for index, answer in zip(retry, self.generate_llm_batch([texts[index] for index in retry], [questions[index].profile for index in retry], on_text)):
+                    answers[index] = answer
+                generated.update(retry)
+            pending = retry
+            attempt += 1
+        return results
+
+    # Runs the already formatted chat texts through the LLM, each with its own decoding profile.
+    # Usually that is one batched generate call (see decoding_profiles.group_rows).
+    # `on_text(row, text)` gets the new text of every row while it is decoded (for streaming requests).
+    def generate_llm_batch(self, texts: List[str], profiles: List[DecodingProfile], on_text: Optional[Callable[[int, str], None]] = None) -> List[str]:
+        defaults = self.llm_model.generation_config
+        answers: List[Optional[str]] = [None] * len(texts)
+        for rows, settings in group_rows([profile.decoding(defaults) for profile in profiles]):
+            group_on_text = (lambda position, text, rows=rows: on_text(rows[position], text)) if on_text is not None else None
+            generated = self.generate_llm_group([texts[row] for row in rows], [profiles[row] for row in rows], settings, group_on_text)
+            for row, answer in zip(rows, generated):
+                answers[row] = answer
+        return answers
+
+    # One batched generate call.
+    def generate_llm_group(self, texts: List[str], profiles: List[DecodingProfile], settings: dict, on_text: Optional[Callable[[int, str], None]] = None) -> List[str]:
+        # Prepare the inputs for the LLM and send them to the GPU.
+        # padding=True makes all prompts the same length (left padded, see load_model),
+        # and the attention mask tells the model to ignore the padding.
+        tokenizer, llm_model = self.tokenizer, self.llm_model
+        if self.prefix_cache is not None:
+            # the template instructions come from the prefix cache, only the rest of each prompt is prefilled
+            input_ids, attention_mask, past_key_values, cached_tokens = self.prefix_cache.build_inputs(texts)
+        else:
+            model_inputs = tokenizer(texts, return_tensors="pt", padding=True).to(llm_model.device)
+            input_ids, attention_mask, past_key_values, cached_tokens = model_inputs.input_ids, model_inputs.attention_mask, None, 0
+
+        # Every answer stops as soon as its profile says it is complete (e.g. the end of the line of tags).
+        prompt_length = input_ids.shape[1]
+        stopping = ProfileStoppingCriteria(tokenizer, prompt_length, profiles)
+        greedy_rows = [row for row, profile in enumerate(profiles) if settings["do_sample"] and not profile.decoding(llm_model.generation_config)["do_sample"]]
+
+        with self.metrics.span("llm_generate", profiles="+".join(sorted({profile.name for profile in profiles}))) as span:
+            # Generate the responses from the LLM.
+            # Each sequence stops on its own when it reaches the end-of-sequence token or its profile's stop (it is padded after that),
+            # and the whole call ends once every sequence in the batch is finished.
+            started = time.perf_counter()
+            generated_ids = llm_model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                pad_token_id=tokenizer.pad_token_id,
+                stopping_criteria=[stopping],
+                logits_processor=[GreedyRowsProcessor(greedy_rows)] if greedy_rows else None,
+                streamer=BatchTextStreamer(tokenizer, len(texts), on_text) if on_text is not None else None,
+                **settings
+            )
+            seconds = time.perf_counter() - started
+
+            # Extract the generated response part from the full output.
+            # All prompts share the same padded length, so the answers start at the same position.
+            generated_ids = generated_ids[:, prompt_length:]
+
+            prompt_tokens = int(attention_mask.sum())
+            generated_tokens = int((generated_ids != tokenizer.pad_token_id).sum())
+            span.set(batch_size=len(texts), max_new_tokens=settings["max_new_tokens"])
+            span.observe("prompt_tokens", prompt_tokens, COUNT_BUCKETS)
+            span.observe("prefill_tokens", prompt_tokens - cached_tokens, COUNT_BUCKETS) # the prompt tokens that were not in the prefix cache
+            span.observe("generated_tokens", generated_tokens, COUNT_BUCKETS)
+            span.observe("tokens_per_second", generated_tokens / seconds)
+
+        # Decode the generated IDs back into human-readable text, one string per question.
+        return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+    # Generates music tags/attributes using the LLM based on a song description.
+    def generate_prompt(self, description:str) -> str:
+        # Run the LLM to get the comma-separated tags (decoded with the TAGS profile).
+        return self.prompt_qwen(self.build_prompt_question(description))
+    
+    # Generates song lyrics using the LLM based on a song description.
+    def generate_lyrics(self, description:str) -> str:
+        # Run the LLM to get the generated lyrics (decoded with the LYRICS profile).
+        return self.prompt_qwen(self.build_lyrics_question(description))
+    
+    # Generates categories based on music description, e.g. ["Pop", "Electronic", "Sad"]
+    # Clear comma-separated tags are categorized without the LLM (see fast_categories).
+    def generate_categories(self, description:str) -> List[str]:
+        categories = self.fast_categories(description)
+        if categories is not None:
+            return categories
+        return self.prompt_qwen(self.build_categories_question(description))
+
+    # The categories of comma-separated tags from the categorizer (microseconds), or None if it is not
+    # confident and the LLM has to categorize them.
+    def fast_categories(self, tags: str) -> Optional[List[str]]:
+        if self.categorizer is None:
+            return None
+        started = time.perf_counter()
+        result = self.categorizer.categorize(tags)
+        labels = {"result": "fast" if result.confident else "llm"}
+        self.metrics.observe("tag_categorize_seconds", time.perf_counter() - started, labels)
+        self.metrics.observe("tag_categorize_coverage", result.coverage, labels, buckets=(0.25, 0.5, 0.75, 1))
+        if not result.confident:
+            print(f"categorizer not confident (coverage {result.coverage:.2f}, unknown tags {result.unknown}), asking the LLM")
+            return None
+        return result.categories
+
+    # The question builders below are shared by the single and the batched LLM paths.
+    # Each one picks the decoding profile of its task, and what to use if the answer is unusable.
+    def build_prompt_question(self, description:str) -> LLMQuestion:
+        # ACE-Step can work with the plain description too
+        return LLMQuestion(PROMPT_GENERATOR_PROMPT.format(user_prompt=description), TAGS, fallback=description)
+
+    def build_lyrics_question(self, description:str) -> LLMQuestion:
+        # no fallback: "[instrumental]" would silently turn the vocal song the user asked for into an instrumental
+        return LLMQuestion(LYRICS_GENERATOR_PROMPT.format(description=description), LYRICS, retries=1, required=True)
+
+    def build_categories_question(self, description:str) -> LLMQuestion:
+        return LLMQuestion(CATEGORIES_GENERATOR_PROMPT.format(description=description), CATEGORIES, fallback=[])
+    
+    # Generates the song and its cover and uploads both to S3.
+    # With a fixed seed the song only depends on its inputs: if the same inputs were generated before (or are being
+    # generated right now), their stored files are copied inside S3 instead of generating again (see result_index).
+    def generate_and_upload_to_s3(
+        self,
+        prompt: str,
+        lyrics: str,
+        instrumental: bool,
+        audio_duration: float,
+        infer_step: int,
+        guidance_scale: float,
+        seed: int,
+        description_for_categorization: str,
+        output_format: str = "wav", # wav, flac, opus or mp3
+        bitrate_kbps: int = 192, # quality of opus and mp3
+        categories: Optional[List[str]] = None, # already generated categories (from a batched LLM call), if any
+        progress: Optional[Callable[[str, str], None]] = None, # told about the progress of every stage (for background jobs)
+        progressive: bool = False, # upload the song in segments as it is decoded (see progressive.SegmentStream)
+        segment_seconds: float = 10.0,
+        stream_id: Optional[str] = None # where the segments go (picked by the server), a new one if not given
+    ) -> GenerateMusicResponseS3:
+        if progressive and stream_id is None:
+            stream_id = str(uuid.uuid4())
+        settings = dict(
+            prompt=prompt, lyrics=lyrics, instrumental=instrumental, audio_duration=audio_duration, infer_step=infer_step,
+            guidance_scale=guidance_scale, seed=seed, description_for_categorization=description_for_categorization,
+            output_format=output_format, bitrate_kbps=bitrate_kbps, categories=categories, progress=progress,
+            progressive=progressive, segment_seconds=segment_seconds, stream_id=stream_id
+        )
+        if self.result_index is None or not ResultIndex.is_deterministic(seed):
+            return self.generate_and_upload_song(**settings)
+
+        # everything the uploaded files depend on
+        key = self.result_index.make_key({
+            "prompt": prompt,
+            "lyrics": "[instrumental]" if instrumental else lyrics,
+            "audio_duration": audio_duration,
+            "infer_step": infer_step,
+            "guidance_scale": guidance_scale,
+            "seed": seed,
+            "output_format": output_format,
+            "bitrate_kbps": bitrate_kbps if output_format in LOSSY_FORMATS else None,
+            "segment_seconds": segment_seconds if progressive else None, # a song decoded in segments is not bit for bit the same
+            "description_for_categorization": description_for_categorization # the categories of the stored result
+        })
+        started = time.perf_counter()
+        entry, source = self.result_index.get_or_compute(
+            key,
+            lambda: self.generate_and_upload_song(**settings).model_dump(),
+            is_valid=self.stored_song_exists if self.result_index_verify else None
+        )
+        self.metrics.observe("result_index_seconds", time.perf_counter() - started, {"source": source})
+        print(f"result index: {source}, {self.result_index.stats()}")
+
+        if source != COMPUTED and progress is not None:
+            # nothing had to run, every stage of the job is done
+            for stage in JOB_STAGES:
+                progress(stage, DONE)
+        response = GenerateMusicResponseS3(**{name: value for name, value in entry.items() if name in GenerateMusicResponseS3.model_fields})
+        if source != COMPUTED:
+            # every request still gets files of its own (the frontend saves every song under a unique s3 key),
+            # copied inside S3 from the stored ones: no GPU work and no upload
+            response.s3_key = self.copy_in_s3(response.s3_key)
+            response.cover_image_s3_key = self.copy_in_s3(response.cover_image_s3_key)
+        if categories is not None:
+            response.categories = categories
+        if progressive and source != COMPUTED:
+            # the client may already be waiting for this stream: it is complete right away, with the stored song
+            stream = SegmentStream(self.s3_client, self.bucket_name, stream_id, output_format, bitrate_kbps, self.segment_pool, self.metrics)
+            response.manifest_s3_key = stream.finish((response.s3_key, response.audio_bytes))
+        return response
+
+    # Copies a stored file to a new unique key (same extension) and returns that key.
+    def copy_in_s3(self, s3_key: str) -> str:
+        new_key = f"{uuid.uuid4()}.{s3_key.rsplit('.', 1)[-1]}"
+        with self.metrics.span("s3_copy", kind=s3_key.rsplit(".", 1)[-1]):
+            copy_object(self.s3_client, self.bucket_name, s3_key, new_key)
+        return new_key
+
+    # Are the song and the cover of a result index entry still in S3?
+    def stored_song_exists(self, entry: dict) -> bool:
+        return all(object_exists(self.s3_client, self.bucket_name, entry[name]) for name in ("s3_key", "cover_image_s3_key"))
+
+    # Generates the song, its cover and its categories at the same time and uploads them to S3.
+    def generate_and_upload_song(
+        self,
+        prompt: str,
+        lyrics: str,
+        instrumental: bool,
+        audio_duration: float,
+        infer_step: int,
+        guidance_scale: float,
+        seed: int,
+        description_for_categorization: str,
+        output_format: str = "wav", # wav, flac, opus or mp3
+        bitrate_kbps: int = 192, # quality of opus and mp3
+        categories: Optional[List[str]] = None, # already generated categories (from a batched LLM call), if any
+        progress: Optional[Callable[[str, str], None]] = None, # told about the progress of every stage (for background jobs)
+        progressive: bool = False, # upload the song in segments as it is decoded (see progressive.SegmentStream)
+        segment_seconds: float = 10.0,
+        stream_id: Optional[str] = None # where the segments go (picked by the server), a new one if not given
+    ) -> GenerateMusicResponseS3:
+        final_lyrics = "[instrumental]" if instrumental else lyrics
+        print(f"song description: {description_for_categorization}")
+        print(f"user prompt: {prompt}")
+        print(f"generated lyrics: {final_lyrics}")
+        
+        s3_client = self.s3_client # connected once in load_model
+        bucket_name = self.bucket_name # from modal secrets
+        
+        # The thumbnail and the categories only need the prompt/description, not the audio,
+        # so they run at the same time as the (long) audio generation instead of after it.
+        # Each upload starts as soon as its own file is ready.
+        listener = StageTracker(progress, PIPELINE_JOB_STAGES) if progress else None
+        pipeline = PipelinedExecutor(self.stage_pool, listener=listener)
+
+        # Progressive mode: every segment of the song is uploaded as soon as it is decoded, and listed in the
+        # stream's manifest, so the client can start playing long before the full file is uploaded.
+        stream = None
+        if progressive:
+            stream = SegmentStream(s3_client, bucket_name, stream_id or str(uuid.uuid4()), output_format, bitrate_kbps, self.segment_pool, self.metrics)
+        
+        # ? CREATE AUDIO AND STORE IT IN S3
+        pipeline.submit(
+            "audio", self.generate_audio,
+            prompt=prompt, lyrics=final_lyrics, audio_duration=audio_duration,
+            infer_step=infer_step, guidance_scale=guidance_scale, seed=seed,
+            segment_seconds=segment_seconds if stream else None, on_segment=stream.add if stream else None
+        )
+        # the WAV is turned into the requested format on a CPU thread, while the GPU keeps working on the rest
+        audio_format = AUDIO_FORMATS[output_format]
+        pipeline.submit("audio_encode", self.encode_audio, output_format, bitrate_kbps, after=["audio"])
+        pipeline.submit(
+            "audio_upload", self.upload_to_s3, s3_client, bucket_name,
+            audio_format["extension"], audio_format["content_type"], after=["audio_encode"]
+        )
+        if stream is not None:
+            # the full file (stitched from the same segments) is up: mark the stream complete
+            pipeline.submit("stream_finish", stream.finish, after=["audio_upload"])
+        
+        # ? CREATE IMAGE FROM PROMPT AND SAVE TO S3
+        pipeline.submit("image", self.generate_thumbnail, prompt=prompt)
+        pipeline.submit("image_upload", self.upload_to_s3, s3_client, bucket_name, "png", "image/png", after=["image"])
+        
+        # ? CREATE CATEGORIES BASED ON SONG DESCRIPTION PROVIDED
+        # skip it if the endpoint already generated the categories together with the other LLM work
+        if categories is None:
+            pipeline.submit("categories", self.generate_categories_on_side_stream, description=description_for_categorization)
+        
+        # wait for every stage to finish
+        try:
+            results = pipeline.join()
+        except Exception as error:
+            if stream is not None:
+                # the client may be polling the stream: end it instead of leaving it open forever
+                stream.fail(str(error))
+            raise
+        finally:
+            self.publish_metrics()
+        print(f"stage timings (s): {pipeline.timings}")
+        print(f"s3 connections: {connection_stats(s3_client)}")
+        print(f"llm cache: {self.llm_cache.stats()}")
+        
+        audio_s3_key, audio_bytes = results["audio_upload"]
+        image_s3_key, _ = results["image_upload"]
+        print(f"uploaded {audio_bytes} bytes of {output_format} audio")
+        
+        return GenerateMusicResponseS3(
+            s3_key=audio_s3_key,
+            cover_image_s3_key=image_s3_key,
+            categories=results.get("categories", categories),
+            audio_format=output_format,
+            audio_bytes=audio_bytes,
+            manifest_s3_key=results.get("stream_finish"),
+            infer_step=infer_step
+        )
+
+    # Generates several takes of one song (same prompt and lyrics, one seed each) and uploads them to S3.
+    # Every take is handed to the micro-batcher at the same time, so they share diffusion runs, and each take is
+    # encoded and uploaded as soon as its own audio is ready. With `share_cover` one cover is made for all of them.
+    def generate_and_upload_variations(
+        self,
+        prompt: str,
+        lyrics: str,
+        seeds: List[int],
+        audio_duration: float,
+        infer_step: int,
+        guidance_scale: float,
+        categories: List[str],
+        share_cover: bool = True,
+        output_format: str = "wav",
+        bitrate_kbps: int = 192,
+        progress: Optional[Callable[[str, str], None]] = None
+    ) -> List[GenerateMusicResponseS3]:
+        takes = range(len(seeds))
+        covers = range(1 if share_cover else len(seeds))
+        # which job stage every stage of this pipeline belongs to ("audio" only hands the takes to the batcher)
+        job_stage_of = {}
+        for take in takes:
+            job_stage_of.update({f"audio_{take}": "audio", f"audio_encode_{take}": "audio", f"audio_upload_{take}": "upload"})
+        job_stage_of["image"] = "image"
+        for cover in covers:
+            job_stage_of[f"image_upload_{cover}"] = "upload"
+        listener = StageTracker(progress, job_stage_of) if progress else None
+        pipeline = PipelinedExecutor(self.stage_pool, listener=listener)
+
+        audio_format = AUDIO_FORMATS[output_format]
+        pipeline.submit(
+            "audio", self.submit_variations,
+            prompt=prompt, lyrics=lyrics, seeds=seeds, audio_duration=audio_duration,
+            infer_step=infer_step, guidance_scale=guidance_scale
+        )
+        for take in takes:
+            pipeline.submit(f"audio_{take}", self.wait_for_variation, take, after=["audio"])
+            pipeline.submit(f"audio_encode_{take}", self.encode_audio, output_format, bitrate_kbps, after=[f"audio_{take}"])
+            pipeline.submit(
+                f"audio_upload_{take}", self.upload_to_s3, self.s3_client, self.bucket_name,
+                audio_format["extension"], audio_format["content_type"], after=[f"audio_encode_{take}"]
+            )
+        # every cover in one SDXL call (the pipeline can not run several calls at once, see image_lock)
+        pipeline.submit("image", self.generate_thumbnails, prompt=prompt, count=len(covers))
+        for cover in covers:
+            pipeline.submit(f"image_upload_{cover}", self.upload_thumbnail, cover, after=["image"])
+
+        try:
+            results = pipeline.join()
+        finally:
+            self.publish_metrics()
+        print(f"stage timings (s): {pipeline.timings}")
+
+        responses = []
+        for take, future in enumerate(results["audio"]):
+            # the seed the take actually used: a seed of -1 was picked at random by the batcher
+            _, seed = future.result()
+            audio_s3_key, audio_bytes = results[f"audio_upload_{take}"]
+            image_s3_key, _ = results[f"image_upload_{take if not share_cover else 0}"]
+            responses.append(GenerateMusicResponseS3(
+                s3_key=audio_s3_key,
+                cover_image_s3_key=image_s3_key,
+                categories=categories,
+                audio_format=output_format,
+                audio_bytes=audio_bytes,
+                seed=seed,
+                infer_step=infer_step
+            ))
+        return responses
+
+    # Saves this container's metrics in the shared metrics store, where the metrics endpoint reads them.
+    def publish_metrics(self):
+        try:
+            # how well the S3 connections are reused, see storage.connection_stats
+            for name, value in connection_stats(self.s3_client).items():
+                self.metrics.set_gauge(f"s3_{name}", value)
+            self.metrics_store[self.container_id] = {"updated_at": time.time(), **self.metrics.snapshot()}
+        except Exception as error:
+            print(f"could not publish metrics: {error}")
+
+    def publish_metrics_periodically(self):
+        while True:
+            time.sleep(PUBLISH_SECONDS)
+            self.publish_metrics()
+
+    # ------------------------------------------------ Pipeline Stages ------------------------------------------------
+    # These run on the worker threads of generate_and_upload_to_s3.
+
+    # Generates the audio and returns it as an in-memory WAV file.
+    # The request waits in the micro-batcher for other songs it can share a diffusion run with.
+    # In progressive mode `on_segment(index, audio, sample rate)` also gets every segment of `segment_seconds` as it is decoded.
+    def generate_audio(self, prompt: str, lyrics: str, audio_duration: float, infer_step: int, guidance_scale: float, seed: int, segment_seconds: Optional[float] = None, on_segment: Optional[Callable] = None) -> io.BytesIO:
+        buffer, actual_seed = self.music_batcher.submit(AudioRequest(
+            prompt=prompt,
+            lyrics=lyrics,
+            audio_duration=audio_duration,
+            infer_step=infer_step,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            segment_seconds=segment_seconds,
+            on_segment=on_segment
+        ))
+        print(f"audio seed: {actual_seed}") # use this seed to get the exact same song again
+        
+        # ? AUDIO CREATED
+        return buffer
+
+    # Hands every take of generate_and_upload_variations to the micro-batcher at once and returns their Futures.
+    def submit_variations(self, prompt: str, lyrics: str, seeds: List[int], audio_duration: float, infer_step: int, guidance_scale: float) -> list:
+        return self.music_batcher.submit_many([
+            AudioRequest(prompt=prompt, lyrics=lyrics, audio_duration=audio_duration, infer_step=infer_step, guidance_scale=guidance_scale, seed=seed)
+            for seed in seeds
+        ])
+
+    # Waits for one take of submit_variations and returns its in-memory WAV (its seed stays in the Future).
+    def wait_for_variation(self, futures: list, take: int) -> io.BytesIO:
+        buffer, _ = futures[take].result()
+        return buffer
+
+    # Generates every song of a batch (all with the same duration, steps and guidance) and
+    # returns (in-memory WAV, seed that was used) for each of them, in the same order.
+    def run_music_batch(self, requests: List[AudioRequest]) -> list:
+        # The songs never reach the disk (see save_wav_to_memory), this path is only used as their name.
+        # ACE-Step still writes a tiny "_input_params.json" next to it, so we point it at /dev/shm (which lives in RAM).
+        output_dir = "/dev/shm/outputs"
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, f"{uuid.uuid4()}.wav")
+
+        # pick the random seeds ourselves, so we can tell every request which seed its song used
+        seeds = [request.seed if request.seed >= 0 else random.randint(0, 2**32 - 1) for request in requests]
+
+        music_model = self.music_model # waits here if ACE-Step is still loading, so the span below only measures the diffusion
+        if len(requests) == 1 and requests[0].segment_seconds is None or self.batched_text2music:
+            songs = [(output_path, index) for index in range(len(requests))] # where save_wav_to_memory keeps every song
+        else:
+            songs = [(os.path.join(output_dir, f"{uuid.uuid4()}.wav"), 0) for _ in requests] # one stock call per song
+        try:
+            with self.metrics.span("audio_diffusion") as span:
+                started = time.perf_counter()
+                if len(requests) == 1 and requests[0].segment_seconds is None:
+                    self.run_text2music(music_model, requests[0], seeds[0], output_path)
+                elif self.batched_text2music:
+                    self.run_text2music_batch(requests, seeds, output_path)
+                else:
+                    # The installed ACE-Step is not the release run_text2music_batch copies (see supports_text2music_batch).
+                    # Progressive songs come out in one piece this way, their stream only gets the full file.
+                    for request, seed, (path, _) in zip(requests, seeds, songs):
+                        self.run_text2music(music_model, request, seed, path)
+                seconds = time.perf_counter() - started
+
+                # how fast the diffusion ran: denoising steps per second, and seconds of music per second
+                span.set(batch_size=len(requests), infer_step=requests[0].infer_step, audio_duration=requests[0].audio_duration)
+                span.observe("steps_per_second", requests[0].infer_step / seconds)
+                span.observe("audio_seconds_per_second", requests[0].audio_duration * len(requests) / seconds)
+            # what a song costs, for the projected waits of the admission controller
+            self.admission.observe(sum(request.audio_duration * request.infer_step for request in requests), seconds)
+        finally:
+            for path in {path for path, _ in songs}:
+                params_path = path.replace(".wav", "_input_params.json")
+                if os.path.exists(params_path):
+                    os.remove(params_path)
+
+        return [(self.audio_buffers.pop(song), seed) for song, seed in zip(songs, seeds)]
+
+    # One song through the stock ACEStepPipeline.__call__, kept in memory under (save_path, 0) by save_wav_to_memory.
+    def run_text2music(self, music_model, request: AudioRequest, seed: int, save_path: str):
+        # let the AceStep instance model generate audio based on prompt, lyrics, and settings
+        music_model(
+            prompt = request.prompt, 
+            lyrics = request.lyrics,
+            audio_duration = request.audio_duration, # audio duration to be generated, 3 mins by default
+            infer_step = request.infer_step, # the quality of the audio
+            guidance_scale = request.guidance_scale, # the creativity of the audio
+            save_path=save_path, # name of the output, used to find its in-memory buffer
+            format="wav",
+            manual_seeds = str(seed) # same seed + same input = same song
+        )
+
+    # One diffusion run for several DIFFERENT songs.
+    # ACEStepPipeline.__call__ can only batch copies of the same prompt and lyrics, so this does what its
+    # "text2music" path does (with the same default settings), but with the prompt and lyrics of every song.
+    def run_text2music_batch(self, requests: List[AudioRequest], seeds: List[int], output_path: str):
+        import torch
+
+        model = self.music_model
+        batch_size = len(requests)
+        first = requests[0] # every request of the batch shares these settings (see batching.audio_bucket)
+
+        random_generators, _ = model.set_seeds(batch_size, ",".join(str(seed) for seed in seeds))
+        retake_random_generators, _ = model.set_seeds(batch_size, None)
+
+        # the prompt (tags) of every song
+        texts = [request.prompt for request in requests]
+        encoder_text_hidden_states, text_attention_mask = model.get_text_embeddings(texts, model.device)
+        encoder_text_hidden_states_null = model.get_text_embeddings_null(texts, model.device)
+
+        # the lyrics of every song, padded with 0 to the longest one (the mask marks the real tokens)
+        lyric_tokens = [model.tokenize_lyrics(request.lyrics) if request.lyrics else [0] for request in requests]
+        longest = max(len(tokens) for tokens in lyric_tokens)
+        lyric_token_idx = torch.zeros(batch_size, longest, dtype=torch.long)
+        lyric_mask = torch.zeros(batch_size, longest, dtype=torch.long)
+        for index, (request, tokens) in enumerate(zip(requests, lyric_tokens)):
+            lyric_token_idx[index, :len(tokens)] = torch.tensor(tokens)
+            lyric_mask[index, :len(tokens)] = 1 if request.lyrics else 0
+
+        speaker_embeds = torch.zeros(batch_size, 512).to(model.device).to(model.dtype) # not used by the released checkpoint
+
+        target_latents = model.text2music_diffusion_process(
+            duration=first.audio_duration,
+            encoder_text_hidden_states=encoder_text_hidden_states,
+            text_attention_mask=text_attention_mask,
+            speaker_embds=speaker_embeds,
+            lyric_token_ids=lyric_token_idx.to(model.device),
+            lyric_mask=lyric_mask.to(model.device),
+            guidance_scale=first.guidance_scale,
+            omega_scale=10.0,
+            infer_steps=first.infer_step,
+            random_generators=random_generators,
+            scheduler_type="euler",
+            cfg_type="apg",
+            guidance_interval=0.5,
+            guidance_interval_decay=0.0,
+            min_guidance_scale=3.0,
+            oss_steps=[],
+            encoder_text_hidden_states_null=encoder_text_hidden_states_null,
+            use_erg_lyric=True,
+            use_erg_diffusion=True,
+            retake_random_generators=retake_random_generators,
+            retake_variance=0.5,
+            add_retake_noise=False,
+            guidance_scale_text=0.0,
+            guidance_scale_lyric=0.0
+        )
+
+        if first.segment_seconds is not None:
+            # progressive songs (a batch is either all progressive or not at all, see batching.audio_bucket)
+            self.decode_in_segments(target_latents, requests, output_path)
+            return
+
+        # turn the latents into audio, save_wav_to_memory keeps every song of the batch by its index
+        model.latents2audio(
+            latents=target_latents,
+            target_wav_duration_second=first.audio_duration,
+            save_path=output_path,
+            format="wav"
+        )
+
+    # Decodes the latents of a batch of progressive songs segment by segment (what latents2audio does in one piece),
+    # hands every segment to its request's `on_segment` right away, and keeps the full songs (the segments stitched
+    # together) in memory like save_wav_to_memory does.
+    # Every segment is decoded with SEGMENT_CONTEXT_FRAMES extra latent frames on each side that are cut off afterwards.
+    def decode_in_segments(self, latents, requests: List[AudioRequest], output_path: str):
+        import torch
+
+        first = requests[0]
+        frames = latents.shape[-1]
+        segment_frames = max(1, round(first.segment_seconds * frames / first.audio_duration))
+        starts = list(range(0, frames, segment_frames))
+        if len(starts) > 1 and frames - starts[-1] < segment_frames / 2:
+            starts.pop() # a short rest goes into the last segment instead of a segment of its own
+        pieces = [[] for _ in requests]
+        sample_rate = 48000
+        with self.metrics.span("audio_decode", mode="segments") as span:
+            for number, start in enumerate(starts):
+                end = starts[number + 1] if number + 1 < len(starts) else frames
+                context_start, context_end = max(0, start - SEGMENT_CONTEXT_FRAMES), min(frames, end + SEGMENT_CONTEXT_FRAMES)
+                with torch.no_grad():
+                    sample_rate, wavs = self.music_model.music_dcae.decode(latents[..., context_start:context_end], sr=sample_rate)
+                for index, (request, wav) in enumerate(zip(requests, wavs)):
+                    wav = wav.cpu().float()
+                    samples_per_frame = wav.shape[-1] / (context_end - context_start)
+                    segment = wav[:, round((start - context_start) * samples_per_frame):round((end - context_start) * samples_per_frame)]
+                    pieces[index].append(segment)
+                    request.on_segment(len(pieces[index]) - 1, segment, sample_rate)
+            span.set(batch_size=len(requests), segments=len(pieces[0]))
+
+        for index, (request, song) in enumerate(zip(requests, pieces)):
+            wav = torch.cat(song, dim=-1)[:, :int(request.audio_duration * sample_rate)]
+            self.save_wav_to_memory(wav, index, save_path=output_path, sample_rate=sample_rate)
+
+    # Replacement for ACEStepPipeline.save_wav_file: encodes the song into an in-memory WAV instead of a file.
+    def save_wav_to_memory(self, target_wav, idx, save_path=None, sample_rate=48000, format="wav"):
+        self.audio_buffers[(save_path, idx)] = write_wav(target_wav, sample_rate)
+        return save_path
+
+    # Generates the cover image and returns it as an in-memory PNG file.
+    def generate_thumbnail(self, prompt: str) -> io.BytesIO:
+        return self.generate_thumbnails(prompt, 1)[0]
+
+    # Generates `count` cover images of one prompt in a single SDXL call and returns them as in-memory PNG files.
+    def generate_thumbnails(self, prompt: str, count: int) -> List[io.BytesIO]:
+        # * THUMBNAIL GENERATION
+        thumbnail_prompt = f"{prompt}, album cover art" # create the prompt
+        
+        # image_pipi is instance of stabilityai/sdxl-turbo (our text to image generator model)
+        # It runs on its own CUDA stream so the GPU can work on it in between the audio model's work.
+        image_pipe = self.image_pipe # waits here if it is still loading
+        with self.image_lock, self.metrics.span("image_generate"), self.gpu_stream(self.image_stream):
+            images = image_pipe(prompt=thumbnail_prompt, num_inference_steps=2, guidance_scale=0.0, num_images_per_prompt=count).images
+        
+        # ? IMAGE GENERATED
+        
+        # save images generated into memory
+        buffers = []
+        for image in images:
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            buffers.append(buffer)
+        return buffers
+
+    # Uploads one of the covers of generate_thumbnails.
+    def upload_thumbnail(self, buffers: List[io.BytesIO], index: int) -> tuple:
+        return self.upload_to_s3(buffers[index], self.s3_client, self.bucket_name, "png", "image/png")
+
+    # Same as generate_categories, but on its own CUDA stream so it overlaps with the audio generation.
+    def generate_categories_on_side_stream(self, description: str) -> List[str]:
+        # * CATEGORY GENERATION -> [hip-hop, rap, etc.]
+        with self.gpu_stream(self.llm_stream):
+            return self.generate_categories(description=description)
+
+    # Turns the in-memory WAV into the requested format (on the CPU).
+    def encode_audio(self, wav_buffer: io.BytesIO, output_format: str, bitrate_kbps: int) -> io.BytesIO:
+        with self.metrics.span("audio_encode", format=output_format):
+            return encode_audio(wav_buffer, output_format, bitrate_kbps)
+
+    # Streams an in-memory file to s3 under a new unique name and returns (the s3 key, bytes uploaded).
+    def upload_to_s3(self, buffer: io.BytesIO, s3_client, bucket_name: str, extension: str, content_type: str) -> tuple:
+        s3_key = f"{uuid.uuid4()}.{extension}"
+        with self.metrics.span("s3_upload", kind=extension) as span:
+            started = time.perf_counter()
+            size = upload_buffer(s3_client, buffer, bucket_name, s3_key, content_type) # what we want to upload, where to upload, name of uploaded file
+            megabytes = size / (1024 * 1024)
+            span.observe("megabytes", megabytes, MEGABYTE_BUCKETS)
+            span.observe("mb_per_second", megabytes / (time.perf_counter() - started))
+        return s3_key, size
+        
+        
+    # ------------------------------------------------ Request Handlers ------------------------------------------------
+    # The actual work of each endpoint. They are plain methods so the blocking endpoints, the background jobs and
+    # the streaming endpoint can share them. `progress(stage, state)` is told about the llm/audio/image/upload stages,
+    # `events` (streaming requests only) gets the LLM answers as they are decoded. `stream_id` names the segment
+    # stream of a progressive song: the server picks it (never the client, it could overwrite someone else's stream).
+    
+    def run_generate_from_description(self, request: GenerateFromDescriptionRequest, progress: Optional[Callable[[str, str], None]] = None, events: Optional[EventStream] = None, stream_id: Optional[str] = None) -> GenerateMusicResponseS3:
+        progress = progress or ignore_progress
+
+        # All the LLM work of this endpoint goes through ONE batched call:
+        # - a comma-separated list of music tags (genre, mood, tempo, etc.) from the user's description
+        # - the categories of the song
+        # - the lyrics based on the user's full song description (skipped for instrumentals)
+        questions = [
+            self.build_prompt_question(request.full_described_song),
+            self.build_categories_question(request.full_described_song),
+        ]
+        if not request.instrumental:
+            questions.append(self.build_lyrics_question(request.full_described_song))
+
+        progress("llm", "running")
+        answers = self.prompt_qwen_batch(questions, events)
+        progress("llm", "done")
+        prompt = answers[0]
+        categories = answers[1]
+        lyrics = answers[2] if not request.instrumental else ""
+            
+        return self.generate_and_upload_to_s3(
+            prompt=prompt, # (e.g. value: melodic techno, male vocal, electronic, emotional, minor key, 124 bpm, synthesizer, driving, atmospheric)
+            lyrics=lyrics, # (e.g. value: the lyrics generated by qwen based on song description provided by user)
+            description_for_categorization=request.full_described_song, # (e.g. value: the song description itself provided by user)
+            categories=categories, # (e.g. value: [Pop, Sad, Ballad])
+            progress=progress,
+            stream_id=stream_id,
+            **request.model_dump(exclude={"full_described_song"}) # kinuha lahat ng props ng parent class, excluding its own property
+        )
+
+    def run_generate_with_lyrics(self, request: GenerateWithCustomLyricsRequest, progress: Optional[Callable[[str, str], None]] = None, events: Optional[EventStream] = None, stream_id: Optional[str] = None) -> GenerateMusicResponseS3:
+        progress = progress or ignore_progress
+        stream_answer(events, TAGS.name, request.prompt, as_text=request.prompt)
+        stream_answer(events, LYRICS.name, request.lyrics, as_text=request.lyrics)
+
+        # categories lang ang kailangan sa LLM dito. They are made by the "categories" stage of the pipeline,
+        # at the same time as the audio, so the audio never waits for the LLM (or for it to load).
+        return self.generate_and_upload_to_s3(
+            prompt=request.prompt, # dapat ang prompt input from user is comma separated na
+            lyrics=request.lyrics, # ginawa na din ni user yung lyrics
+            description_for_categorization=request.prompt, # same dito, comma separated na yung prompt na ibibigay ni user
+            progress=progress,
+            stream_id=stream_id,
+            **request.model_dump(exclude={"prompt", "lyrics"}) # kinuha lahat ng props ng parent class
+        )
+
+    def run_generate_with_described_lyrics(self, request: GenerateWithDescribedLyricsRequest, progress: Optional[Callable[[str, str], None]] = None, events: Optional[EventStream] = None, stream_id: Optional[str] = None) -> GenerateMusicResponseS3:
+        progress = progress or ignore_progress
+        stream_answer(events, TAGS.name, request.prompt, as_text=request.prompt)
+
+        # The prompt is comma separated, so the categorizer usually knows its categories without the LLM.
+        # Whatever LLM work is left (categories it is not sure about, lyrics) goes through one batched call.
+        categories = self.fast_categories(request.prompt)
+        questions = []
+        if categories is None:
+            questions.append(self.build_categories_question(request.prompt))
+        else:
+            stream_answer(events, CATEGORIES.name, categories)
+        if not request.instrumental:
+            questions.append(self.build_lyrics_question(request.described_lyrics)) # yung lyrics description will be used to let LLM create a lyrics
+
+        progress("llm", "running")
+        answers = self.prompt_qwen_batch(questions, events)
+        progress("llm", "done")
+        if categories is None:
+            categories = answers.pop(0)
+        lyrics = answers[0] if not request.instrumental else ""
+            
+        return self.generate_and_upload_to_s3(
+            prompt=request.prompt,  # prompt na ibibigay ni user dito is comma separated na
+            lyrics=lyrics, # AI generated lyrics
+            description_for_categorization=request.prompt, # comma separated prompt
+            categories=categories,
+            progress=progress,
+            stream_id=stream_id,
+            **request.model_dump(exclude={"described_lyrics", "prompt"})
+        )
+
+    def run_generate_variations(self, request: GenerateVariationsRequest, progress: Optional[Callable[[str, str], None]] = None) -> List[GenerateMusicResponseS3]:
+        progress = progress or ignore_progress
+        seeds = self.variation_seeds(request)
+
+        # The tags, categories and lyrics are the same for every take: ONE batched LLM call, like generate_from_description.
+        questions = [
+            self.build_prompt_question(request.full_described_song),
+            self.build_categories_question(request.full_described_song),
+        ]
+        if not request.instrumental:
+            questions.append(self.build_lyrics_question(request.full_described_song))
+
+        progress("llm", "running")
+        answers = self.prompt_qwen_batch(questions)
+        progress("llm", "done")
+
+        return self.generate_and_upload_variations(
+            prompt=answers[0],
+            lyrics="[instrumental]" if request.instrumental else answers[2],
+            seeds=seeds,
+            audio_duration=request.audio_duration,
+            infer_step=request.infer_step,
+            guidance_scale=request.guidance_scale,
+            categories=answers[1],
+            share_cover=request.share_cover,
+            output_format=request.output_format,
+            bitrate_kbps=request.bitrate_kbps,
+            progress=progress
+        )
+
+    # The seed of every take: the given seeds, or `num_variations` seeds counting up from `seed`
+    # (so the same request gives the same takes), or random ones.
+    def variation_seeds(self, request: GenerateVariationsRequest) -> List[int]:
+        if request.seeds:
+            return list(request.seeds)
+        if request.seed >= 0:
+            return [request.seed + take for take in range(request.num_variations)]
+        return [random.randint(0, 2**32 - 1) for _ in range(request.num_variations)]
+
+    # ------------------------------------------------ Admission ------------------------------------------------
+
+    # Admits a request of `priority` (admission.INTERACTIVE or BACKGROUND) or raises admission.Overloaded.
+    # A degraded request gets its fewer diffusion steps written into `request.infer_step`.
+    def admit(self, request, priority: str) -> Ticket:
+        songs = len(request.seeds) if getattr(request, "seeds", None) else getattr(request, "num_variations", 1)
+        requested = request.infer_step
+        try:
+            ticket = self.admission.admit(priority, request.audio_duration, request.infer_step, songs)
+        except Overloaded as error:
+            self.metrics.observe("admission_projected_wait_seconds", error.projected_wait, {"priority": priority, "decision": "rejected"})
+            raise
+        decision = "degraded" if ticket.degraded else "admitted"
+        self.metrics.observe("admission_projected_wait_seconds", ticket.projected_wait, {"priority": priority, "decision": decision})
+        if ticket.degraded:
+            print(f"busy (projected wait {ticket.projected_wait:.0f}s): {requested} -> {ticket.infer_step} diffusion steps")
+            request.infer_step = ticket.infer_step
+        return ticket
+
+    # Runs the handler of `kind` (e.g. "generate_from_description") once admission control lets it:
+    # right away if it is rejected (admission.Overloaded), otherwise after waiting for its turn.
+    def run_admitted(self, kind: str, request, priority: str, **kwargs):
+        ticket = self.admit(request, priority)
+        try:
+            self.wait_for_turn(ticket)
+            return getattr(self, f"run_{kind}")(request, **kwargs)
+        finally:
+            self.admission.release(ticket)
+
+    def wait_for_turn(self, ticket: Ticket):
+        started = time.perf_counter()
+        self.admission.wait_for_slot(ticket)
+        self.metrics.observe("admission_queue_seconds", time.perf_counter() - started, {"priority": ticket.priority.name})
+
+    # Runs a request of `kind` (a job kind, e.g. "generate_from_description") on its own thread and returns its
+    # Server-Sent Events (see streaming.EventStream): the LLM answers token by token, the stages, then the response.
+    # It is admitted before the stream starts, so an overloaded server still answers with a plain error (admission.Overloaded).
+    # A client that disconnects does not stop the song, it is still made and uploaded.
+    def stream_job(self, kind: str, request, priority: str = INTERACTIVE) -> Iterator[str]:
+        ticket = self.admit(request, priority)
+        # a progressive song gets its stream id now (like submit_job), so the client can poll its manifest right away
+        stream_id = str(uuid.uuid4()) if request.progressive else None
+        stream = EventStream()
+        stream.emit("admission", {
+            "infer_step": ticket.infer_step,
+            "projected_wait_seconds": round(ticket.projected_wait, 1),
+            "manifest_s3_key": manifest_key(stream_id) if stream_id else None
+        })
+        handler = getattr(self, f"run_{kind}") # e.g. run_generate_from_description
+
+        def run():
+            try:
+                self.wait_for_turn(ticket)
+                stream.result(handler(request, progress=stream.stage, events=stream, stream_id=stream_id).model_dump())
+            except Exception as error:
+                print(f"streaming {kind} failed: {error}")
+                stream.error(str(error))
+            finally:
+                self.admission.release(ticket)
+
+        threading.Thread(target=run, name=f"stream-{kind}", daemon=True).start()
+        return stream.events()
@@ -0,0 +1,114 @@
+from concurrent.futures import Future, ThreadPoolExecutor # Future = a "box" that will hold a result later.
+import threading # Used for the lock that keeps the stage bookkeeping safe between threads.
+import time # Used to measure how long each stage took.
+from typing import Any, Callable, Dict, List, Optional
+
+# --------------------------------------------- Pipelined Stage Executor ---------------------------------------------
+
+# Runs the stages of one song generation (audio, thumbnail, categories, uploads) at the same time.
+# A stage can wait for other stages with `after=[...]`; it is only handed to a worker thread once
+# everything it waits for is done, so workers never sit blocked waiting on each other.
+# The results of the stages it waited for are passed to the stage function as its first arguments.
+#
+# Example:
+#   pipeline = PipelinedExecutor(pool)
+#   pipeline.submit("audio", make_audio)
+#   pipeline.submit("audio_upload", upload, after=["audio"]) # -> upload(<result of make_audio>)
+#   pipeline.submit("image", make_image)                      # runs while the audio is being made
+#   results = pipeline.join()                                 # {"audio": ..., "audio_upload": ..., "image": ...}
+#
+# An optional `listener(stage_name, state)` is told about every stage as it goes
+# "queued" -> "running" -> "done" (or "failed"), e.g. to report the progress of a job.
+class PipelinedExecutor:
+    def __init__(self, pool: Optional[ThreadPoolExecutor] = None, listener: Optional[Callable[[str, str], None]] = None):
+        # The worker threads are usually shared for the whole container (created once in load_model),
+        # if none is given we make our own and close it in join().
+        self._owns_pool = pool is None
+        self._pool = pool or ThreadPoolExecutor(max_workers=4, thread_name_prefix="stage")
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.timings: Dict[str, float] = {} # stage name -> seconds it took to run
+        self._listener = listener
+
+    def _notify(self, name: str, state: str):
+        if self._listener is None:
+            return
+        try:
+            self._listener(name, state)
+        except Exception as error:
+            # progress reporting must never break the generation itself
+            print(f"stage listener failed for {name} ({state}): {error}")
+
+    def submit(self, name: str, fn: Callable[..., Any], *args, after: Optional[List[str]] = None, **kwargs) -> Future:
+        after = after or []
+        with self._lock:
+            if name in self._futures:
+                raise ValueError(f"stage '{name}' was already submitted")
+            missing = [dep for dep in after if dep not in self._futures]
+            if missing:
+                raise ValueError(f"stage '{name}' waits for unknown stage(s): {', '.join(missing)}")
+
+            future: Future = Future()
+            self._futures[name] = future
+            dependencies = [self._futures[dep] for dep in after]
+        self._notify(name, "queued")
+
+        # what a worker thread will do once every dependency is done
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            # a stage whose dependency failed does not run, it fails with the same error
+            for dependency in dependencies:
+                if dependency.exception() is not None:
+                    self._notify(name, "failed")
+                    future.set_exception(dependency.exception())
+                    return
+            self._notify(name, "running")
+            started = time.perf_counter()
+            try:
+                result = fn(*[dependency.result() for dependency in dependencies], *args, **kwargs)
+            except BaseException as error:
+                self.timings[name] = time.perf_counter() - started
+                self._notify(name, "failed")
+                future.set_exception(error)
+            else:
+                self.timings[name] = time.perf_counter() - started
+                self._notify(name, "done")
+                future.set_result(result)
+
+        # start right away, or when the last dependency finishes
+        remaining = [len(dependencies)]
+        remaining_lock = threading.Lock()
+
+        def on_dependency_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._pool.submit(run)
+
+        if not dependencies:
+            self._pool.submit(run)
+        for dependency in dependencies:
+            dependency.add_done_callback(on_dependency_done)
+
+        return future
+
+    # Result of a single stage (waits for it if needed).
+    def result(self, name: str) -> Any:
+        return self._futures[name].result()
+
+    # Waits for EVERY stage, then returns {stage name: result}.
+    # If any stage failed, the first failure (in submit order) is raised, but only after all stages
+    # stopped running so no worker is left touching files or the GPU behind our back.
+    def join(self) -> Dict[str, Any]:
+        try:
+            for future in list(self._futures.values()):
+                future.exception() # waits without raising
+            for future in self._futures.values():
+                if future.exception() is not None:
+                    raise future.exception()
+            return {name: future.result() for name, future in self._futures.items()}
+        finally:
+            if self._owns_pool:
+                self._pool.shutdown(wait=False)
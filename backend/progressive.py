@@ -0,0 +1,162 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from audio_encoding import AUDIO_FORMATS, encode_audio, write_wav
+from storage import put_small_object, upload_buffer
+
+# --------------------------------------------- Progressive Audio ---------------------------------------------
+
+# A long song used to reach the client only once the whole file was decoded, encoded and uploaded.
+# In progressive mode the finished latents are decoded in segments of a few seconds (see
+# MusicGenService.decode_in_segments), and every segment is encoded and uploaded as soon as it is decoded,
+# so the client can start playing while the rest of the song is still on its way. The full file is
+# stitched from the same segments and uploaded at the end, like a normal song.
+#
+# Everything of one stream lives under streams/<stream id>/:
+# - segment_000.<ext>, segment_001.<ext>, ...: the segments, in the requested output format
+# - manifest.json: the segments uploaded so far (always a gap-free run from the first one), and once the
+#   song is done `complete: true` with the key of the full file (or with an `error` if the song failed)
+# - playlist.m3u8: the same as an HLS playlist (an EVENT playlist until the song is done or failed). Its segment URIs are
+#   relative, so it plays straight from a public bucket or CDN; with presigned URLs use manifest.json instead.
+#   mp3 segments play in HLS players, the other formats are best played from the manifest.
+#
+# Example:
+#   stream = SegmentStream(s3_client, bucket_name, stream_id, "mp3", 192, pool)
+#   stream.add(0, wav, 48000)             # for every decoded segment, in order
+#   stream.finish(("song.mp3", 1234567))  # after the full file is uploaded
+#   stream.fail("out of memory")          # or instead, if the song failed
+
+STREAM_PREFIX = "streams"
+
+PLAYLIST_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+
+
+def stream_prefix(stream_id: str) -> str:
+    return f"{STREAM_PREFIX}/{stream_id}"
+
+
+# Where the manifest of a stream is, known before the song starts (the submit_job endpoint returns it).
+def manifest_key(stream_id: str) -> str:
+    return f"{stream_prefix(stream_id)}/manifest.json"
+
+
+def playlist_key(stream_id: str) -> str:
+    return f"{stream_prefix(stream_id)}/playlist.m3u8"
+
+
+class SegmentStream:
+    def __init__(self, s3_client, bucket_name: str, stream_id: str, output_format: str, bitrate_kbps: int, pool: ThreadPoolExecutor, metrics=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.stream_id = stream_id
+        self.output_format = output_format
+        self.bitrate_kbps = bitrate_kbps
+        self.pool = pool
+        self.metrics = metrics
+        self.manifest_key = manifest_key(stream_id)
+        self.playlist_key = playlist_key(stream_id)
+        self.started = time.perf_counter()
+
+        self._segments: Dict[int, Dict[str, Any]] = {} # index -> its entry in the manifest
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock() # one manifest upload at a time, so the newest one is written last
+        self._ended = False # finished or failed, the manifest does not change anymore
+
+        # an empty manifest right away: the client can tell "not started" (404) from "in progress"
+        self._publish()
+
+    # Called for every decoded segment, in order (on the batcher thread, so this only queues the work):
+    # `wav` is the audio of the segment, shape [channels, samples].
+    def add(self, index: int, wav, sample_rate: int):
+        self._futures.append(self.pool.submit(self._upload_segment, index, wav, sample_rate))
+
+    # Waits for the segments, then marks the stream complete with the full file `(s3 key, bytes)`.
+    # Returns the manifest key.
+    def finish(self, upload_result: tuple) -> str:
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as error:
+                # a lost segment only hurts the early playback, the full file is there
+                print(f"segment upload of stream {self.stream_id} failed: {error}")
+        s3_key, audio_bytes = upload_result
+        self._publish(complete={"s3_key": s3_key, "audio_bytes": audio_bytes})
+        return self.manifest_key
+
+    # Ends a stream whose song failed, so the client stops waiting: the manifest becomes `complete: true`
+    # with the `error` and no full file, and the playlist gets its ENDLIST. Does nothing if the stream was
+    # already finished (its full file is there). Never raises, the song's own error is the one that matters.
+    def fail(self, detail: str):
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception:
+                pass # the song failed anyway
+        try:
+            self._publish(complete={"error": detail})
+        except Exception as error:
+            print(f"could not end the failed stream {self.stream_id}: {error}")
+
+    def _upload_segment(self, index: int, wav, sample_rate: int):
+        audio_format = AUDIO_FORMATS[self.output_format]
+        duration = wav.shape[-1] / sample_rate
+        buffer = encode_audio(write_wav(wav, sample_rate), self.output_format, self.bitrate_kbps)
+        s3_key = f"{stream_prefix(self.stream_id)}/segment_{index:03d}.{audio_format['extension']}"
+        size = upload_buffer(self.s3_client, buffer, self.bucket_name, s3_key, audio_format["content_type"])
+
+        with self._lock:
+            self._segments[index] = {"index": index, "s3_key": s3_key, "duration": round(duration, 3), "bytes": size}
+        if index == 0 and self.metrics is not None:
+            # what the user waits for before the song starts playing
+            self.metrics.observe("first_segment_seconds", time.perf_counter() - self.started)
+        self._publish()
+
+    # Uploads the manifest and the playlist with every segment that is ready.
+    def _publish(self, complete: Optional[Dict[str, Any]] = None):
+        with self._publish_lock:
+            if self._ended:
+                return
+            with self._lock:
+                segments = []
+                while len(segments) in self._segments:
+                    segments.append(self._segments[len(segments)])
+
+            start = 0.0
+            for segment in segments:
+                segment["start"] = round(start, 3)
+                start += segment["duration"]
+            manifest = {
+                "stream_id": self.stream_id,
+                "format": self.output_format,
+                "content_type": AUDIO_FORMATS[self.output_format]["content_type"],
+                "playlist_s3_key": self.playlist_key,
+                "segments": segments,
+                "complete": complete is not None,
+                **(complete or {})
+            }
+            put_small_object(self.s3_client, self.bucket_name, self.manifest_key, json.dumps(manifest).encode("utf-8"), "application/json", no_cache=True)
+            put_small_object(self.s3_client, self.bucket_name, self.playlist_key, render_playlist(segments, complete is not None).encode("utf-8"), PLAYLIST_CONTENT_TYPE, no_cache=True)
+            self._ended = complete is not None
+
+
+# An HLS media playlist of the segments (URIs relative to the playlist).
+def render_playlist(segments: List[Dict[str, Any]], complete: bool) -> str:
+    target = max([math.ceil(segment["duration"]) for segment in segments] or [1])
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{target}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:EVENT"
+    ]
+    for segment in segments:
+        lines.append(f"#EXTINF:{segment['duration']:.3f},")
+        lines.append(segment["s3_key"].rsplit("/", 1)[-1])
+    if complete:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
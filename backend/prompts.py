@@ -17,10 +17,12 @@
 # Formatted Tags:
 # """
 
-PROMPT_GENERATOR_PROMPT = """
-Reformat the following user-provided music details into a simple comma-separated list of audio tags.
+# Every template is a fixed block of instructions first and the user's part last. Only the last part changes
+# between requests, so the model's work on the fixed part (its KV cache) is computed once per container
+# and reused (see llm_prefix_cache.PrefixKVCache). Keep the `{...}` slot out of the *_INSTRUCTIONS.
 
-User Input: "{user_prompt}"
+PROMPT_GENERATOR_INSTRUCTIONS = """
+Reformat the "User Input" below (user-provided music details) into a simple comma-separated list of audio tags.
 
 Follow these guidelines strictly when reformatting:
 - **Parse the "User Input" thoroughly.** It may contain a general music description, or it might explicitly define specific attributes like "Genre:", "Vocal Type:", "Instruments:", "Mood:", "Tempo:", or "Key:".
@@ -38,18 +40,28 @@ Follow these guidelines strictly when reformatting:
 
 If the combined tags (from explicit user input and inference) are few (less than 6 unique tags), infer what the user wants and add 2-3 more tags that are synonyms or closely related to the existing tags. **Do not introduce new categories** when adding synonyms.
 
+"""
+
+PROMPT_GENERATOR_PROMPT = PROMPT_GENERATOR_INSTRUCTIONS + """User Input: "{user_prompt}"
+
 Formatted Tags:
 """
 
-LYRICS_GENERATOR_PROMPT = """
-Generate song lyrics based on the following description.
+LYRICS_GENERATOR_INSTRUCTIONS = """
+Generate song lyrics based on the description below.
 The lyrics should be suitable for a song and structured clearly.
 Use tags like [verse], [chorus], [bridge], [intro], and [outro] to structure the song.
 
 Here is an example:
 "[verse]\nWoke up in a city that's always alive\nNeon lights they shimmer they thrive\nElectric pulses beat they drive\nMy heart races just to survive\n\n[chorus]\nOh electric dreams they keep me high\nThrough the wires I soar and fly\nMidnight rhythms in the sky\nElectric dreams together we’ll defy\n\n[verse]\nLost in the labyrinth of screens\nVirtual love or so it seems\nIn the night the city gleams\nDigital faces haunted by memes\n\n[chorus]\nOh electric dreams they keep me high\nThrough the wires I soar and fly\nMidnight rhythms in the sky\nElectric dreams together we’ll defy\n\n[bridge]\nSilent whispers in my ear\nPixelated love serene and clear\nThrough the chaos find you near\nIn electric dreams no fear\n\n[verse]\nBound by circuits intertwined\nLove like ours is hard to find\nIn this world we’re truly blind\nBut electric dreams free the mind"
 
-Description: "{description}"
+"""
+
+LYRICS_GENERATOR_PROMPT = LYRICS_GENERATOR_INSTRUCTIONS + """Description: "{description}"
 
 Lyrics:
-"""
\ No newline at end of file
+"""
+
+CATEGORIES_GENERATOR_INSTRUCTIONS = "Based on the following music description, list 3-5 relevant genres or categories as a comma-separated list. For example: Pop, Electronic, Sad, 80s.\n"
+
+CATEGORIES_GENERATOR_PROMPT = CATEGORIES_GENERATOR_INSTRUCTIONS + "Description: '{description}'"
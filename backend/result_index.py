@@ -0,0 +1,96 @@
+from concurrent.futures import Future
+import hashlib # Makes the index keys (a fingerprint of the generation inputs).
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# --------------------------------------------- Result Dedupe Index ---------------------------------------------
+
+# With a fixed seed (seed != -1) ACE-Step makes the same song for the same inputs, so generating it again
+# only burns a diffusion run on the GPU and uploads a copy under a new uuid. This index remembers which
+# S3 keys hold the song (and cover) of every set of inputs that was generated before, and hands them out
+# instead of generating again.
+#
+# - the key is a sha256 of the canonical json of the resolved inputs (after the LLM: final prompt and lyrics,
+#   duration, steps, guidance, seed, output format), see make_key
+# - the storage is any dict-like: a modal.Dict in the cloud (shared by every container), a plain dict locally
+# - identical requests that arrive while the first one is still generating wait for it instead of generating
+#   too ("coalescing", only within one container)
+# - `is_valid(entry)` can reject an entry whose files are gone (e.g. deleted from S3), it is then generated again
+#
+# Example:
+#   index = ResultIndex()  # local, in memory
+#   key = index.make_key({"prompt": "lofi, chill", "seed": 7, ...})
+#   entry, source = index.get_or_compute(key, generate_and_upload)  # source: "hit", "coalesced" or "computed"
+
+# Where get_or_compute got its entry from
+HIT = "hit"
+COALESCED = "coalesced"
+COMPUTED = "computed"
+
+
+class ResultIndex:
+    def __init__(self, storage=None, version: str = "1"):
+        self._storage = storage if storage is not None else {}
+        self.version = version # part of every key: change it to start over, e.g. after swapping the music model
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {} # key -> the entry of the request that is generating it
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0}
+
+    # A fixed seed makes the song deterministic, a random one (-1) never repeats.
+    @staticmethod
+    def is_deterministic(seed: int) -> bool:
+        return seed >= 0
+
+    # The index key: a sha256 of the canonical json of the inputs (sorted keys, every number as a float,
+    # so 30 and 30.0 are the same duration).
+    def make_key(self, inputs: Dict[str, Any]) -> str:
+        canonical = {name: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value for name, value in inputs.items()}
+        payload = json.dumps({"version": self.version, "inputs": canonical}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Returns (entry, HIT/COALESCED/COMPUTED). `compute()` makes a new entry (a json-friendly dict) and only
+    # runs if the index has no valid entry for `key` and no identical request is already running it.
+    def get_or_compute(self, key: str, compute: Callable[[], Dict[str, Any]], is_valid: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Tuple[Dict[str, Any], str]:
+        with self._lock:
+            running = self._in_flight.get(key)
+            if running is None:
+                future = self._in_flight[key] = Future()
+        if running is not None:
+            with self._lock:
+                self._stats["coalesced"] += 1
+            return running.result(), COALESCED # raises the error of the request we waited for, if it failed
+
+        try:
+            entry = self._lookup(key, is_valid)
+            source = HIT
+            if entry is None:
+                entry = {**compute(), "created_at": time.time()}
+                self._storage[key] = entry
+                source = COMPUTED
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(entry)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return entry, source
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._in_flight)}
+
+    # The stored entry of `key`, or None (also if it is no longer valid, then it is removed).
+    def _lookup(self, key: str, is_valid: Optional[Callable[[Dict[str, Any]], bool]]) -> Optional[Dict[str, Any]]:
+        entry = self._storage.get(key)
+        if entry is not None and is_valid is not None and not is_valid(entry):
+            self._storage.pop(key, None)
+            with self._lock:
+                self._stats["stale"] += 1
+            entry = None
+        with self._lock:
+            self._stats["hits" if entry is not None else "misses"] += 1
+        return entry
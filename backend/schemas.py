@@ -0,0 +1,84 @@
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field # Used to define data structures for API requests/responses.
+
+# --------------------------------------------- Request / Response Models ---------------------------------------------
+# Shared by the Modal endpoints (main.py) and the request handlers (music_service.py).
+
+# Base configuration options for audio generation.
+class AudioGenerationBase(BaseModel):
+    audio_duration: float = 180.0
+    seed: int = -1
+    guidance_scale: float = 15.0
+    infer_step: int = 60
+    instrumental: bool = False
+    output_format: Literal["wav", "flac", "opus", "mp3"] = "wav" # file type of the uploaded song, flac/opus/mp3 are a lot smaller than wav
+    bitrate_kbps: int = Field(default=192, ge=32, le=320) # quality of opus and mp3 (ignored by wav and flac)
+    progressive: bool = False # upload the song in segments as it is decoded, so playback can start early (see progressive.py)
+    segment_seconds: float = Field(default=10.0, ge=2, le=60) # length of the progressive segments
+    
+# Request model for generating music from a user-provided song description.
+class GenerateFromDescriptionRequest(AudioGenerationBase):
+    full_described_song: str # generates lyrics from the given song description by user
+    
+# Request model for generating music with custom lyrics provided directly by the user.
+class GenerateWithCustomLyricsRequest(AudioGenerationBase):
+    prompt: str
+    lyrics: str # passed lyrics by the user
+    
+# Request model for generating music with user-defined style and LLM-generated lyrics.
+class GenerateWithDescribedLyricsRequest(AudioGenerationBase):
+    prompt: str
+    described_lyrics: str # lyrics coming from LLM
+
+# Request model for several takes of the same song description, each with its own seed.
+# The tags, lyrics and categories are generated once for all of them.
+class GenerateVariationsRequest(GenerateFromDescriptionRequest):
+    num_variations: int = Field(default=4, ge=1, le=8) # how many takes
+    seeds: Optional[List[int]] = Field(default=None, min_length=1, max_length=8) # the seed of every take (instead of num_variations)
+    share_cover: bool = True # one cover image for every take, instead of one each
+    progressive: Literal[False] = False # the takes are never progressive, asking for it is a 422
+    segment_seconds: None = None # so no segment length either
+    
+
+
+
+
+# Defines the expected structure of the response when music generation is integrated with S3 for storage.
+class GenerateMusicResponseS3(BaseModel):
+    s3_key: str # The key (path) to the generated audio file in the S3 bucket.
+    cover_image_s3_key: str # The key (path) to the generated cover image in the S3 bucket.
+    categories: List[str] # A list of categories/tags describing the generated music.
+    audio_format: str = "wav" # The file type of the uploaded audio (wav, flac, opus or mp3).
+    audio_bytes: int = 0 # The size of the uploaded audio file in bytes.
+    seed: Optional[int] = None # The seed of the song, to make exactly this take again (set by the variations endpoint).
+    manifest_s3_key: Optional[str] = None # The manifest of the segments, for progressive songs.
+    infer_step: Optional[int] = None # The diffusion steps the song was made with, fewer than requested if the server was busy.
+
+# Defines the expected structure of the response when audio data is returned directly (base64 encoded).
+class GenerateMusicResponse(BaseModel):
+    audio_data: str # The generated audio, encoded as a base64 string.
+
+# Request model for starting a background job, e.g. {"kind": "generate_with_lyrics", "request": {"prompt": ..., "lyrics": ...}}
+class SubmitJobRequest(BaseModel):
+    kind: Literal["generate_from_description", "generate_with_lyrics", "generate_with_described_lyrics"] # which generation to run
+    request: dict # the same body the blocking endpoint of that kind takes
+
+# Response of the submit endpoint, use the job id to poll the status and the result.
+class SubmitJobResponse(BaseModel):
+    job_id: str
+    manifest_s3_key: Optional[str] = None # progressive songs: poll this manifest in S3 to play the segments as they arrive
+
+# Response of the status endpoint.
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str # queued, running, succeeded or failed
+    stages: Dict[str, str] # llm/audio/image/upload -> pending, running, done or failed
+    error: Optional[str] = None # what went wrong, if the job failed
+
+# The request model of every kind of background job.
+JOB_REQUEST_MODELS = {
+    "generate_from_description": GenerateFromDescriptionRequest,
+    "generate_with_lyrics": GenerateWithCustomLyricsRequest,
+    "generate_with_described_lyrics": GenerateWithDescribedLyricsRequest
+}
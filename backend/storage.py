@@ -0,0 +1,128 @@
+import io # In-memory "files" (BytesIO), so nothing has to touch the disk.
+import os # Reads the S3 client settings from environment variables (Modal secrets).
+
+import boto3
+from boto3.s3.transfer import TransferConfig # Settings for how boto3 splits and sends big uploads.
+from botocore.config import Config # Settings for the S3 client itself (connection pool, retries, keep-alive).
+from botocore.exceptions import ClientError
+
+# --------------------------------------------- S3 Upload Settings ---------------------------------------------
+
+MB = 1024 * 1024
+
+# A 3 minute stereo WAV is ~30 MB. Anything above 8 MB is split into 8 MB parts,
+# and up to 4 parts are sent to S3 at the same time instead of one long single stream
+# (a 3 minute WAV has 4 parts, so it still goes out all at once).
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=8 * MB,
+    max_concurrency=4,
+    use_threads=True
+)
+
+
+# How many connections the S3 client needs so that `upload_threads` threads can each send the parts of a
+# multipart upload at the same time. With fewer, urllib3 warns "Connection pool is full, discarding connection"
+# and closes the extra connections after every use, which is what the shared pool is there to avoid.
+def s3_pool_connections(upload_threads: int, config: TransferConfig = TRANSFER_CONFIG) -> int:
+    return upload_threads * config.max_concurrency
+
+# --------------------------------------------- S3 Client ---------------------------------------------
+
+# Creates the S3 client. It is made ONCE per container (in load_model) and shared by every request,
+# so the credentials lookup, endpoint setup and open connections are all reused.
+# Every setting can be changed with an environment variable (e.g. in the Modal secret):
+# - S3_MAX_POOL_CONNECTIONS: how many connections can be open at once (default `max_pool_connections`,
+#   see s3_pool_connections)
+# - S3_RETRY_MODE: "standard" or "adaptive" (default "standard")
+# - S3_MAX_ATTEMPTS: how many times a failed call is tried in total (default 5)
+# - S3_TCP_KEEPALIVE: "true"/"false", keeps idle connections alive between requests (default "true")
+def create_s3_client(max_pool_connections: int = 32, **client_kwargs):
+    config = Config(
+        max_pool_connections=int(os.environ.get("S3_MAX_POOL_CONNECTIONS", str(max_pool_connections))),
+        retries={
+            "mode": os.environ.get("S3_RETRY_MODE", "standard"),
+            "max_attempts": int(os.environ.get("S3_MAX_ATTEMPTS", "5"))
+        },
+        tcp_keepalive=os.environ.get("S3_TCP_KEEPALIVE", "true").lower() == "true"
+    )
+    return boto3.client("s3", config=config, **client_kwargs)
+
+
+# Counts how many requests the S3 client sent and how many new connections it had to open for them.
+# Every request above the number of opened connections went over an already open (reused) connection.
+# This reads the counters of the connection pools inside boto3 (urllib3), which are not a public API,
+# so it reports zeros instead of failing if they ever change.
+def connection_stats(s3_client) -> dict:
+    requests_sent = 0
+    connections_opened = 0
+    try:
+        pools = s3_client._endpoint.http_session._manager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+    except (AttributeError, KeyError):
+        pass
+    return {
+        "requests": requests_sent,
+        "connections_opened": connections_opened,
+        "connections_reused": max(requests_sent - connections_opened, 0)
+    }
+
+# --------------------------------------------- S3 Upload Helpers ---------------------------------------------
+
+# Uploads an in-memory buffer to S3 and returns how many bytes were uploaded.
+# The buffer is always closed afterwards (its memory is released), whether the upload worked or not.
+def upload_buffer(s3_client, buffer: io.BytesIO, bucket_name: str, s3_key: str, content_type: str, config: TransferConfig = TRANSFER_CONFIG) -> int:
+    size = buffer.getbuffer().nbytes
+    buffer.seek(0) # start reading from the beginning of the buffer
+    try:
+        s3_client.upload_fileobj(
+            buffer, bucket_name, s3_key,
+            ExtraArgs={"ContentType": content_type}, # so browsers know what kind of file it is
+            Config=config
+        )
+    except Exception:
+        # boto3 already tries to abort a failed multipart upload, this makes sure no
+        # half-uploaded parts are left behind (S3 keeps charging for them until aborted).
+        abort_incomplete_uploads(s3_client, bucket_name, s3_key)
+        raise
+    finally:
+        buffer.close()
+    return size
+
+
+# Aborts every unfinished multipart upload of one s3 key.
+def abort_incomplete_uploads(s3_client, bucket_name: str, s3_key: str):
+    try:
+        response = s3_client.list_multipart_uploads(Bucket=bucket_name, Prefix=s3_key)
+        for upload in response.get("Uploads", []):
+            if upload["Key"] == s3_key:
+                s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload["UploadId"])
+    except Exception as error:
+        # the original upload error is the one that matters, so only report this one
+        print(f"could not clean up the multipart upload of {s3_key}: {error}")
+
+
+# Is there an object under this s3 key? (one small HEAD request, no download)
+def object_exists(s3_client, bucket_name: str, s3_key: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+    except ClientError as error:
+        if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+# Copies an object to another key inside the bucket (server-side: nothing is downloaded or uploaded again).
+def copy_object(s3_client, bucket_name: str, source_key: str, s3_key: str):
+    s3_client.copy_object(Bucket=bucket_name, Key=s3_key, CopySource={"Bucket": bucket_name, "Key": source_key})
+
+
+# Uploads a small in-memory file (a manifest, a playlist) in a single request. `no_cache` tells browsers and
+# CDNs to always fetch it again, for files that are rewritten while a client reads them.
+def put_small_object(s3_client, bucket_name: str, s3_key: str, body: bytes, content_type: str, no_cache: bool = False):
+    extra = {"CacheControl": "no-cache"} if no_cache else {}
+    s3_client.put_object(Bucket=bucket_name, Key=s3_key, Body=body, ContentType=content_type, **extra)
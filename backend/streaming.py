@@ -0,0 +1,120 @@
+import json
+import queue
+from typing import Any, Callable, Iterator, List, Optional
+
+# --------------------------------------------- Event Streams ---------------------------------------------
+
+# A blocking endpoint shows the user nothing until the song is uploaded, minutes later. The streaming endpoint
+# sends Server-Sent Events instead, as things happen:
+#
+#   event: admission data: {"infer_step": 60, "projected_wait_seconds": 12.0}  the first event, see admission.py
+#   event: token    data: {"field": "tags", "text": "lofi, chill"}     new text of an LLM answer, as it is decoded
+#   event: answer   data: {"field": "tags", "value": "lofi, chill"}    the parsed answer (what the song is made from)
+#   event: stage    data: {"stage": "audio", "state": "running"}       the llm/audio/image/upload stages, like the job status
+#   event: result   data: {...GenerateMusicResponseS3...}              the final response, the last event
+#   event: error    data: {"detail": "..."}                            the generation failed, the last event
+#
+# The fields are the names of the decoding profiles ("tags", "categories", "lyrics"). Answers that the user
+# wrote themselves, or that come from a cache, arrive as a single token event. The admission event also has the
+# `manifest_s3_key` of a progressive song (null otherwise), so the client can poll its segments right away.
+#
+# Example:
+#   stream = EventStream()
+#   threading.Thread(target=lambda: stream.result(run(progress=stream.stage, events=stream))).start()
+#   return StreamingResponse(stream.events(), media_type="text/event-stream")
+
+# A comment line is sent after this many quiet seconds (the audio takes minutes), so proxies keep the connection open.
+KEEPALIVE_SECONDS = 15.0
+
+_END = object() # put on the queue after the last event
+
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# The events of one generation, written by the worker threads and read by the HTTP response.
+class EventStream:
+    def __init__(self, keepalive_seconds: float = KEEPALIVE_SECONDS):
+        self.keepalive_seconds = keepalive_seconds
+        self._queue: "queue.Queue" = queue.Queue()
+
+    def emit(self, event: str, data: Any):
+        self._queue.put(format_event(event, data))
+
+    # Same signature as the `progress` callback of the request handlers.
+    def stage(self, stage: str, state: str):
+        self.emit("stage", {"stage": stage, "state": state})
+
+    def text(self, field: str, text: str):
+        if text:
+            self.emit("token", {"field": field, "text": text})
+
+    def answer(self, field: str, value: Any):
+        self.emit("answer", {"field": field, "value": value})
+
+    # Ends the stream with the final response (anything json-friendly, e.g. a model_dump).
+    def result(self, data: Any):
+        self.emit("result", data)
+        self._queue.put(_END)
+
+    # Ends the stream with an error.
+    def error(self, detail: str):
+        self.emit("error", {"detail": detail})
+        self._queue.put(_END)
+
+    # The SSE text of every event until the result or the error.
+    def events(self) -> Iterator[str]:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.keepalive_seconds)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is _END:
+                return
+            yield item
+
+
+# Hands the new text of every row of a batched LLM generate call to `on_text(row, text)` while it is decoded.
+# It is passed as `streamer=` to generate, which calls put() with the prompt ids first and then with the new
+# token of every row after each step, and end() at the end (the transformers BaseStreamer interface).
+# transformers' own TextIteratorStreamer only supports a batch of one, our LLM calls are batched.
+# Finished rows get padding tokens, which decode to nothing.
+class BatchTextStreamer:
+    def __init__(self, tokenizer, batch_size: int, on_text: Callable[[int, str], None]):
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self._tokens: List[List[int]] = [[] for _ in range(batch_size)]
+        self._sent = [0] * batch_size # characters of every row that were already handed out
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True # the prompt ids, not new text
+            return
+        for row, tokens in enumerate(value.reshape(len(self._tokens), -1).tolist()):
+            self._tokens[row].extend(tokens)
+            self._flush(row, final=False)
+
+    def end(self):
+        for row in range(len(self._tokens)):
+            self._flush(row, final=True)
+
+    # Decodes the whole row again (a token can change how the ones before it decode) and hands out what is new.
+    def _flush(self, row: int, final: bool):
+        text = self.tokenizer.decode(self._tokens[row], skip_special_tokens=True)
+        if text.endswith("�") and not final:
+            return # half of a multi-byte character, wait for the rest
+        if len(text) > self._sent[row]:
+            self.on_text(row, text[self._sent[row]:])
+            self._sent[row] = len(text)
+
+
+# What a request handler tells the stream about its LLM answers; does nothing without a stream.
+def stream_answer(events: Optional[EventStream], field: str, value: Any, as_text: Optional[str] = None):
+    if events is None:
+        return
+    if as_text is not None:
+        events.text(field, as_text)
+    events.answer(field, value)